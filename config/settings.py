@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -79,12 +80,57 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgres for production (web, every Celery worker and beat share one server);
+# the default SQLite file is for single-node use.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'postx'),
+            'USER': os.environ.get('POSTGRES_USER', 'postx'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Keep connections between requests/tasks, and check they are still alive before reuse
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
     }
-}
+    # DB_POOL_MAX_SIZE > 0 switches to a psycopg connection pool per process instead
+    # (needs psycopg[pool]; Django requires CONN_MAX_AGE = 0 with a pool). Size it so
+    # processes x max_size stays under the server's max_connections.
+    DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 0))
+    if DB_POOL_MAX_SIZE:
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': 10,
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Writers wait up to this many seconds for the lock instead of failing
+                'timeout': 20,
+                # Take the write lock at BEGIN: a transaction that reads first and then
+                # writes can't be upgraded while another process writes, and SQLite
+                # fails that upgrade at once ("database is locked") without waiting
+                'transaction_mode': 'IMMEDIATE',
+                # NORMAL only fsyncs at checkpoints, which is safe in WAL mode (below)
+                'init_command': 'PRAGMA synchronous=NORMAL;',
+            },
+        }
+    }
+# WAL lets readers (web) carry on while a worker writes. It is stored in the database
+# file, so core.signals.enable_sqlite_wal checks journal_mode on connect and only
+# switches a file that isn't in WAL yet
+SQLITE_WAL = True
 
 
 # Password validation
@@ -132,22 +178,174 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-import os
-
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Media is served through core.media: Django checks access and sets cache headers, the
+# front server sends the bytes. MEDIA_ACCEL: 'nginx' (X-Accel-Redirect to an `internal`
+# location MEDIA_ACCEL_PREFIX aliased to MEDIA_ROOT), 'sendfile' (X-Sendfile), or ''
+# to stream from Django (local development only).
+MEDIA_ACCEL = os.environ.get('MEDIA_ACCEL', '')
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Public origin Meta fetches images from, and how long those signed links stay valid
+PUBLIC_BASE_URL = os.environ.get('PUBLIC_BASE_URL', 'https://janessa-unwedded-forrest.ngrok-free.dev')
+MEDIA_SIGNED_URL_TTL = 3600
+
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 
+# Max posts check_schedule claims per state on each tick (the rest wait for the next one)
+SCHEDULER_BATCH_SIZE = int(os.environ.get('SCHEDULER_BATCH_SIZE', 500))
+
+# Gemini model used for captions (switch back to 'gemini-1.5-flash' if 2.5 fails)
+GEMINI_MODEL = 'gemini-2.5-flash'
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
+# Client-side Gemini limits shared by the async engine (requests / tokens per minute)
+GEMINI_RPM = int(os.environ.get('GEMINI_RPM', 1000))
+GEMINI_TPM = int(os.environ.get('GEMINI_TPM', 1000000))
+
+# Generated captions, keyed on model + normalized prompt. BACKEND: 'memory', 'django' or 'file'
+CAPTION_CACHE = {
+    'BACKEND': 'memory',
+    'TTL': 7 * 24 * 3600,
+    'MAX_ENTRIES': 1000,
+}
+
+# 'batch': one structured request per client group; 'async': concurrent requests in one process
+AI_GENERATION_ENGINE = os.environ.get('AI_GENERATION_ENGINE', 'batch')
+AI_ASYNC_CONCURRENCY = 32
+AI_ASYNC_CHUNK_SIZE = 200
+
+# Instagram Graph API
+GRAPH_API_URL = os.environ.get('GRAPH_API_URL', 'https://graph.facebook.com/v21.0')
+GRAPH_API_TIMEOUT = (3.05, 20)  # (connect, read) seconds
+GRAPH_API_MAX_RETRIES = 3
+GRAPH_API_POOL_SIZE = 10
+# Client-side limit per access token: sustained calls/second and burst size
+GRAPH_API_RATE_PER_TOKEN = 1.0
+GRAPH_API_BURST_PER_TOKEN = 10
+# Instagram content-publishing limit: posts per business account in any rolling 24 hours.
+# Publishes past it are deferred until the window has room (core.quota).
+INSTAGRAM_PUBLISH_QUOTA = int(os.environ.get('INSTAGRAM_PUBLISH_QUOTA', 100))
+# Container status checks: first after PUBLISH_POLL_DELAY seconds, doubling up to
+# PUBLISH_POLL_MAX_DELAY, giving up after PUBLISH_POLL_MAX_RETRIES re-checks
+PUBLISH_POLL_DELAY = 5
+PUBLISH_POLL_MAX_DELAY = 60
+PUBLISH_POLL_MAX_RETRIES = 10
+
+# Campaign image uploads: browsers stream files in CAMPAIGN_UPLOAD_CHUNK_SIZE pieces into
+# UPLOAD_STAGING_ROOT (kept out of MEDIA_ROOT so half-uploaded files are never served),
+# then a worker checks them against the limits below before they join the pool
+UPLOAD_STAGING_ROOT = os.environ.get('UPLOAD_STAGING_ROOT', os.path.join(BASE_DIR, 'upload_staging'))
+CAMPAIGN_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+CAMPAIGN_UPLOAD_EXPIRY_HOURS = 24
+CAMPAIGN_IMAGE_MAX_BYTES = 30 * 1024 * 1024
+CAMPAIGN_IMAGE_MAX_PIXELS = 40_000_000
+CAMPAIGN_IMAGE_FORMATS = ('JPEG', 'PNG', 'WEBP')
+
+# Prometheus metrics at /metrics. Every process (web + each worker child) writes its
+# counters to METRICS_DIR every METRICS_FLUSH_INTERVAL seconds and the endpoint adds
+# them up; point all processes on a host at the same directory, outside the checkout
+# (e.g. /var/run/postx-metrics). Unset = each process only reports its own numbers.
+# Scrapers authenticate with "Authorization: Bearer $METRICS_TOKEN"; superusers can just log in.
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = 5
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# One JSON object per line, with post_id / campaign_id / task_id where known
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {'()': 'core.logs.StructuredFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'structured'},
+    },
+    'loggers': {
+        'core': {'handlers': ['console'], 'level': os.environ.get('LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
+
+# Rolling horizon: campaigns only have posts (and captions) for the next
+# CAMPAIGN_HORIZON_DAYS days; an hourly beat task adds days as they come into range.
+# 0 materializes the whole campaign up front.
+CAMPAIGN_HORIZON_DAYS = int(os.environ.get('CAMPAIGN_HORIZON_DAYS', 14))
+
+# Campaign slots are kept at least this far from the client's other posts
+# (core.planner moves a colliding slot forward, never past its next slot).
+SCHEDULE_MIN_SPACING_MINUTES = int(os.environ.get('SCHEDULE_MIN_SPACING_MINUTES', 15))
+
+# Event-driven dispatch: a post gets an ETA task at its scheduled_time once it is due
+# within DISPATCH_HORIZON seconds. Keep the horizon well under the broker's visibility
+# timeout or Redis redelivers waiting ETA tasks. A timer that fires more than
+# DISPATCH_EARLY_TOLERANCE seconds before its (rescheduled) post is due does nothing.
+DISPATCH_HORIZON = 30 * 60
+DISPATCH_EARLY_TOLERANCE = 2
+SCHEDULE_SWEEP_MINUTES = 5
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 2 * 3600}
+
+# Task lanes, so a big campaign can never hold up a publish. Run a worker per lane, e.g.
+#   celery -A config worker -Q publish -c 8       (timers, uploads, container polling)
+#   celery -A config worker -Q generate -c 4      (captions someone is waiting for)
+#   celery -A config worker -Q bulk,celery -c 4   (campaign captions, image work)
+CELERY_TASK_ROUTES = {
+    'core.tasks.check_schedule': {'queue': 'publish'},
+    'core.tasks.dispatch_post': {'queue': 'publish'},
+    'core.tasks.upload_to_facebook': {'queue': 'publish'},
+    'core.tasks.publish_container': {'queue': 'publish'},
+    'core.tasks.generate_ai_content': {'queue': 'generate'},
+    'core.tasks.regenerate_ai_caption': {'queue': 'generate'},
+    'core.tasks.admit_bulk_generation': {'queue': 'generate'},
+    'core.tasks.initialize_campaign_posts': {'queue': 'bulk'},
+    'core.tasks.generate_ai_content_batch': {'queue': 'bulk'},
+    'core.tasks.generate_ai_content_concurrent': {'queue': 'bulk'},
+    'core.tasks.ingest_campaign_upload': {'queue': 'bulk'},
+    'core.tasks.generate_image_variants': {'queue': 'bulk'},
+    'core.tasks.expire_stale_uploads': {'queue': 'bulk'},
+}
+
+# Fair share of the bulk lane: every BULK_ADMIT_INTERVAL seconds the pump tops it up
+# to BULK_MAX_IN_FLIGHT campaign posts, split evenly between clients with work waiting
+BULK_ADMIT_INTERVAL = 10
+BULK_MAX_IN_FLIGHT = 200
+# A post still 'generating' after this many seconds is assumed lost with its worker and
+# goes back in line, instead of holding a bulk slot forever
+BULK_GENERATION_TIMEOUT = 30 * 60
+
 # The Schedule (This replaces the n8n Trigger)
+# Only a reconciliation sweep now: timers missed by a restart, and arming the next horizon
 from celery.schedules import crontab
 
 CELERY_BEAT_SCHEDULE = {
-    'check-every-minute': {
+    'check-schedule-sweep': {
         'task': 'core.tasks.check_schedule',
-        'schedule': crontab(minute='*'),
-    }
-}
\ No newline at end of file
+        'schedule': crontab(minute=f'*/{SCHEDULE_SWEEP_MINUTES}'),
+    },
+    'admit-bulk-generation': {
+        'task': 'core.tasks.admit_bulk_generation',
+        'schedule': BULK_ADMIT_INTERVAL,
+    },
+    'extend-campaign-horizons': {
+        'task': 'core.tasks.extend_campaign_horizons',
+        'schedule': crontab(minute=15),
+    },
+    'expire-stale-uploads': {
+        'task': 'core.tasks.expire_stale_uploads',
+        'schedule': crontab(minute=0, hour='*/6'),
+    },
+}
+# Dashboard fragment cache. Cards and days are keyed on post versions kept in the
+# database, so any backend works; point 'fragments' at Redis/Memcached to share
+# rendered cards between web processes.
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dashboard-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+DASHBOARD_FRAGMENT_TIMEOUT = 24 * 3600
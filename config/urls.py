@@ -2,8 +2,6 @@ from django.contrib import admin
 from django.urls import path
 from django.contrib.auth import views as auth_views
 from core import views
-from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -13,10 +11,19 @@ urlpatterns = [
     path('create/', views.create_post, name='create_post'),
     path('approve/<int:post_id>/', views.approve_post, name='approve_post'),
     path('regenerate/<int:post_id>/', views.regenerate_caption, name='regenerate_caption'),
+    path('posts/status/', views.post_status, name='post_status'),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('media/signed/<int:expires>/<str:sig>/<path:name>', views.signed_media, name='signed_media'),
+    path('media/<path:name>', views.serve_media, name='media'),
+    path('api/timeline/', views.timeline_api, name='timeline_api'),
+    path('api/posts/bulk/', views.bulk_posts, name='bulk_posts'),
     path('edit/<int:post_id>/', views.edit_post, name='edit_post'),
     path('campaign/new/', views.create_campaign, name='create_campaign'),
+    path('campaign/<int:campaign_id>/uploads/', views.campaign_uploads, name='campaign_uploads'),
+    path('uploads/<uuid:upload_id>/', views.upload_chunk, name='upload_chunk'),
+    path('campaign/<int:campaign_id>/edit/', views.edit_campaign, name='edit_campaign'),
     path('campaign/stop/<int:campaign_id>/', views.stop_campaign, name='stop_campaign'),
     path('post/delete/<int:post_id>/', views.delete_post, name='delete_post'),
     path('campaign/delete/<int:campaign_id>/', views.delete_campaign, name='delete_campaign'),
     path('campaign/restart/<int:campaign_id>/', views.restart_campaign, name='restart_campaign'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Client, Post, Campaign
+from .models import Client, Post, Campaign, MediaBlob
 
 @admin.register(Client)
 class ClientAdmin(admin.ModelAdmin):
@@ -12,4 +12,9 @@ class CampaignAdmin(admin.ModelAdmin):
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
     list_display = ('client', 'status', 'scheduled_time', 'campaign')
-    list_filter = ('status', 'client', 'campaign')
\ No newline at end of file
+    list_filter = ('status', 'client', 'campaign')
+
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'ref_count', 'created_at')
+    readonly_fields = ('digest', 'name', 'size', 'ref_count', 'created_at')
\ No newline at end of file
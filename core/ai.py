@@ -0,0 +1,174 @@
+"""
+Gemini caption generation: prompt building, the shared model object,
+batch generation (many captions for one client in a single request) and
+the caption cache in front of all of it.
+
+The SDK is only imported (and configured with GEMINI_API_KEY) by the first
+get_model() call: web processes, beat and management commands import this
+module through core.tasks but never generate, and the SDK takes about a
+second to import.
+"""
+import json
+import threading
+from string import Template
+
+from django.conf import settings
+
+from . import metrics
+from .caption_cache import caption_key, get_caption_cache
+
+# --- PROMPTS ---
+# Built once per process; each call only substitutes the per-post values.
+CAPTION_GUIDELINES = """
+        KEEP THESE GUIDELINES IN MIND:
+        1. Strong Opening Hook: The first sentence is crucial. Ask a question, state a surprising fact, create urgency/FOMO, or use provocative language.
+        2. Clarity and Conciseness: Get straight to the point. Use simple language, maybe bullet points, and keep paragraphs short (1-2 sentences).
+        3. Provide Value: Educate, inspire, entertain, or solve a problem.
+        4. Call to Action (CTA): Tell the audience exactly what to do next (Comment, Share, Link in Bio, Tag a friend).
+        5. Tone and Personality: Be authentic, conversational, and use emojis to convey emotion. Avoid sounding like a corporate bot.
+        6. Searchability: Use strategic hashtags.
+"""
+
+CAPTION_PROMPT = Template("""
+        You are a senior Social Media Manager for $company_name.
+        
+        COMPANY BIO:
+        $company_bio
+        
+        TOPIC/NEWS FOR THIS POST:
+        $news_update
+        
+        TASK:
+        Write a high-engaging Instagram caption using the AIDA framework.
+        Include 3-5 emojis and end with 5 hashtags.
+        """ + CAPTION_GUIDELINES + """
+        ⚠️ STRICT OUTPUT RULES (DO NOT IGNORE):
+        1. Return ONLY the final caption text.
+        2. Do NOT add introductions like "Here is a caption" or "Sure!".
+        3. Do NOT add quotes "" around the text.
+        4. Start the response immediately with the hook/headline.
+        """)
+
+BATCH_PROMPT = Template("""
+        You are a senior Social Media Manager for $company_name.
+        
+        COMPANY BIO:
+        $company_bio
+        
+        TOPICS/NEWS, ONE PER POST:
+$topics
+        
+        TASK:
+        Write exactly $count captions, one per topic above and in the same order.
+        Each must be a high-engaging Instagram caption using the AIDA framework.
+        Include 3-5 emojis and end with 5 hashtags. Make every caption distinct.
+        """ + CAPTION_GUIDELINES + """
+        ⚠️ STRICT OUTPUT RULES (DO NOT IGNORE):
+        1. Return ONLY a JSON array of $count strings, nothing else.
+        2. Each string is the final caption text, starting immediately with the hook/headline.
+        3. Do NOT add introductions, numbering or keys.
+        """)
+
+REWRITE_PROMPT = Template("""You are a senior Social Media Manager for $company_name
+        Write a high-engaging Instagram caption using the AIDA framework.
+        Include 3-5 emojis and end with 5 hashtags.
+        """ + CAPTION_GUIDELINES + """
+        ⚠️ STRICT OUTPUT RULES (DO NOT IGNORE):
+        1. Return ONLY the final caption text.
+        2. Do NOT add introductions like "Here is a caption" or "Sure!".
+        3. Do NOT add quotes "" around the text.
+        4. Start the response immediately with the hook/headline.
+        """)
+
+# One model object per process, reused by every task
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(name=None):
+    name = name or settings.GEMINI_MODEL
+    if name not in _models:
+        with _models_lock:
+            if name not in _models:
+                import google.generativeai as genai
+                genai.configure(api_key=settings.GEMINI_API_KEY)
+                _models[name] = genai.GenerativeModel(name)
+    return _models[name]
+
+
+def clean_caption(text):
+    # Extra safety cleanup (just in case AI ignores rule #3)
+    return text.replace('Here is a caption:', '').strip().strip('"')
+
+
+def build_caption_prompt(client, news_update):
+    return CAPTION_PROMPT.substitute(
+        company_name=client.company_name, company_bio=client.company_bio, news_update=news_update,
+    )
+
+
+def build_batch_prompt(client, news_updates):
+    """One prompt for many posts: the bio and guidelines are sent once, not per post."""
+    topics = "\n".join(f"        {i}. {text}" for i, text in enumerate(news_updates, start=1))
+    return BATCH_PROMPT.substitute(
+        company_name=client.company_name, company_bio=client.company_bio,
+        topics=topics, count=len(news_updates),
+    )
+
+
+def build_rewrite_prompt(client):
+    return REWRITE_PROMPT.substitute(company_name=client.company_name)
+
+
+def parse_batch_captions(text, expected):
+    """Validates the model's JSON array; raises ValueError if it can't be trusted."""
+    captions = json.loads(text)
+    if not isinstance(captions, list) or len(captions) != expected:
+        raise ValueError(f"Expected a JSON array of {expected} captions")
+    if not all(isinstance(c, str) and c.strip() for c in captions):
+        raise ValueError("Every caption must be a non-empty string")
+    return [clean_caption(c) for c in captions]
+
+
+def caption_variant(post):
+    """
+    Cache variant for a post's caption. Campaign posts repeat the same topic
+    text on purpose, so each gets its own entry (a re-run of the same post
+    still hits it); one-off posts with identical text share theirs.
+    """
+    return f"post:{post.id}" if post.campaign_id else ''
+
+
+def call_model(prompt, kind, **kwargs):
+    """One Gemini request, timed for /metrics."""
+    with metrics.timer('postx_gemini_request_seconds', kind=kind):
+        return get_model().generate_content(prompt, **kwargs)
+
+
+def generate_from_prompt(prompt, variant='', bypass_cache=False):
+    """Single caption for any prompt, served from the caption cache when possible."""
+    key = caption_key(settings.GEMINI_MODEL, prompt, variant)
+    return get_caption_cache().get_or_generate(
+        key, lambda: clean_caption(call_model(prompt, 'single').text), bypass=bypass_cache,
+    )
+
+
+def generate_caption(client, news_update, variant='', bypass_cache=False):
+    return generate_from_prompt(build_caption_prompt(client, news_update), variant, bypass_cache)
+
+
+def rewrite_caption(client, bypass_cache=True):
+    """The dashboard's "rewrite" button: a fresh caption unless told otherwise."""
+    return generate_from_prompt(build_rewrite_prompt(client), bypass_cache=bypass_cache)
+
+
+def generate_captions_batch(client, news_updates, variant='', bypass_cache=False):
+    """N captions in one structured request. Raises ValueError on a bad response."""
+    prompt = build_batch_prompt(client, news_updates)
+
+    def generate():
+        response = call_model(prompt, 'batch', generation_config={'response_mime_type': 'application/json'})
+        return parse_batch_captions(response.text, len(news_updates))
+
+    key = caption_key(settings.GEMINI_MODEL, prompt, variant)
+    return get_caption_cache().get_or_generate(key, generate, bypass=bypass_cache)
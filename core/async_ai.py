@@ -0,0 +1,133 @@
+"""
+Asyncio caption engine: one worker process keeps many Gemini requests in
+flight at once (generate_content_async) instead of blocking a prefork slot
+per post. Concurrency is capped by a semaphore and a client-side
+requests-per-minute / tokens-per-minute limiter.
+
+Status transitions are the same as generate_ai_content:
+generating -> waiting_approval / approved, or error. Each step is a guarded
+UPDATE, so a post that was published, reviewed or claimed by another task
+in the meantime is left as it is.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import ai, metrics
+from .caption_cache import caption_key, get_caption_cache
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# Tokens we budget for the caption itself on top of the prompt
+EXPECTED_OUTPUT_TOKENS = 300
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + EXPECTED_OUTPUT_TOKENS
+
+
+class AsyncRateLimiter:
+    """Sliding 60-second window over both request count and token volume."""
+
+    WINDOW = 60.0
+
+    def __init__(self, rpm, tpm, clock=time.monotonic):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.clock = clock
+        self._events = deque()  # (timestamp, tokens)
+        self._tokens = 0
+        self._lock = asyncio.Lock()
+
+    def _expire(self, now):
+        while self._events and now - self._events[0][0] >= self.WINDOW:
+            self._tokens -= self._events.popleft()[1]
+
+    def _wait_time(self, now, tokens):
+        if len(self._events) < self.rpm and self._tokens + tokens <= self.tpm:
+            return 0.0
+        if not self._events:
+            return 0.0  # a single request bigger than the whole TPM budget still has to go
+        # Wait until enough of the oldest entries leave the window
+        freed, needed_tokens = 0, self._tokens + tokens - self.tpm
+        for i, (stamp, event_tokens) in enumerate(self._events):
+            freed += event_tokens
+            if len(self._events) - (i + 1) < self.rpm and freed >= needed_tokens:
+                return stamp + self.WINDOW - now
+        return self._events[-1][0] + self.WINDOW - now
+
+    async def acquire(self, tokens):
+        async with self._lock:
+            while True:
+                now = self.clock()
+                self._expire(now)
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    self._events.append((now, tokens))
+                    self._tokens += tokens
+                    return
+                await asyncio.sleep(wait)
+
+
+async def generate_post(post_id, model, limiter, semaphore):
+    """Returns the post's new status (or None if it was skipped or taken over meanwhile)."""
+    stamp = timezone.now()
+    # Ours while it is 'generating' with our claim stamp
+    mine = Post.objects.filter(id=post_id, status='generating', claimed_at=stamp)
+    try:
+        # Drafts, reviewed and published posts are not ours to caption
+        if not await Post.objects.filter(id=post_id, status__in=Post.GENERATABLE).aupdate(
+                status='generating', claimed_at=stamp, version=F('version') + 1):
+            return None
+        post = await Post.objects.select_related('client').aget(id=post_id)
+
+        prompt = ai.build_caption_prompt(post.client, post.news_update)
+        cache = get_caption_cache()
+        key = caption_key(settings.GEMINI_MODEL, prompt, ai.caption_variant(post))
+        caption = cache.get(key)
+        if caption is None:
+            async with semaphore:
+                await limiter.acquire(estimate_tokens(prompt))
+                with metrics.timer('postx_gemini_request_seconds', kind='async'):
+                    response = await model.generate_content_async(prompt)
+            caption = ai.clean_caption(response.text)
+            cache.set(key, caption)
+
+        status = 'waiting_approval' if post.requires_approval else 'approved'
+        if not await mine.aupdate(generated_caption=caption, status=status, version=F('version') + 1):
+            return None
+        return status
+
+    except Exception as e:
+        logger.warning("AI Error: %s", e, extra={'post_id': post_id})
+        if not await mine.aupdate(status='error', version=F('version') + 1):
+            return None
+        return 'error'
+
+
+async def generate_all(post_ids, model=None, concurrency=None, rpm=None, tpm=None):
+    """Generates captions for all `post_ids` concurrently. Returns {post id: new status} of the posts written."""
+    model = model or ai.get_model()
+    semaphore = asyncio.Semaphore(concurrency or settings.AI_ASYNC_CONCURRENCY)
+    limiter = AsyncRateLimiter(rpm or settings.GEMINI_RPM, tpm or settings.GEMINI_TPM)
+
+    results = await asyncio.gather(*(generate_post(pid, model, limiter, semaphore) for pid in post_ids))
+    return {pid: status for pid, status in zip(post_ids, results) if status}
+
+
+def count_statuses(statuses):
+    counts = {}
+    for status in statuses.values():
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+async def generate_many(post_ids, **kwargs):
+    """Like generate_all, but returns {status: count}."""
+    return count_statuses(await generate_all(post_ids, **kwargs))
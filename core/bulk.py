@@ -0,0 +1,87 @@
+"""
+Set-based post actions for the bulk API: each action is one guarded UPDATE
+(or DELETE) over a queryset that already carries the tenant filter, so
+reviewing a 500-post campaign costs a handful of queries and never loads the
+posts into Python.
+
+    posts = select_posts(user, campaign=42)
+    approve(posts)  # -> number of posts approved
+"""
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import Post, PublishQuotaUse
+from .storage import release_blob
+from .tasks import arm_dispatch
+from .timeline import visible_posts
+
+# Most ids one request may list; whole campaigns go through `campaign=` instead
+MAX_IDS = 1000
+
+# Posts a worker is busy with are never touched: its save() would undo the change
+IDLE_STATUSES = ('draft', 'scheduled', 'waiting_approval', 'approved', 'posted', 'error')
+# Posts that haven't gone live yet and can still be held back or moved
+PENDING_STATUSES = ('draft', 'scheduled', 'waiting_approval', 'approved')
+
+
+def select_posts(user, ids=None, campaign=None):
+    """The posts named by `ids` and/or `campaign`, restricted to those `user` may manage."""
+    posts = visible_posts(user)
+    if ids is not None:
+        posts = posts.filter(id__in=ids)
+    if campaign is not None:
+        posts = posts.filter(campaign_id=campaign)
+    return posts
+
+
+def approve(posts):
+    """
+    Captions waiting for review go to the publish queue (and get their timers).
+    Approved posts the publishing quota is holding back (dispatch_at past their
+    scheduled_time) keep the timer quota.admit gave them.
+    """
+    with transaction.atomic():
+        count = posts.filter(status='waiting_approval').update(status='approved', version=F('version') + 1)
+        if count:
+            arm_dispatch(posts.filter(status='approved').exclude(dispatch_at__gt=F('scheduled_time')))
+    return count
+
+
+def reject(posts):
+    """Holds not-yet-published posts back as drafts; their pending timers become no-ops."""
+    return posts.filter(status__in=('scheduled', 'waiting_approval', 'approved')).update(
+        status='draft', dispatch_token=None, dispatch_at=None, version=F('version') + 1,
+    )
+
+
+def reschedule(posts, scheduled_time=None, shift=None):
+    """Moves pending posts to `scheduled_time`, or by `shift` (a timedelta), and re-arms them."""
+    if (scheduled_time is None) == (shift is None):
+        raise ValueError("Pass exactly one of scheduled_time and shift")
+    value = scheduled_time if shift is None else F('scheduled_time') + shift
+    with transaction.atomic():
+        count = posts.filter(status__in=PENDING_STATUSES).update(scheduled_time=value, version=F('version') + 1)
+        if count:
+            arm_dispatch(posts)
+    return count
+
+
+def delete(posts):
+    """
+    Deletes idle posts with one DELETE ... RETURNING and drops their image
+    references per blob, instead of Django's row-by-row delete signals.
+    The raw DELETE skips on_delete, so quota charges are detached first:
+    a published post still counts against its account's 24h window.
+    """
+    idle = posts.filter(status__in=IDLE_STATUSES).values('id')
+    ids_sql, params = idle.query.sql_with_params()
+    table = connection.ops.quote_name(Post._meta.db_table)
+    with transaction.atomic(), connection.cursor() as cursor:
+        PublishQuotaUse.objects.filter(post__in=idle).update(post=None)
+        cursor.execute(f"DELETE FROM {table} WHERE id IN ({ids_sql}) RETURNING image", params)
+        images = [row[0] for row in cursor.fetchall()]
+        for name, count in Counter(name for name in images if name).items():
+            release_blob(name, count)
+    return len(images)
@@ -0,0 +1,197 @@
+"""
+Cache for generated captions, keyed on the model name plus a normalized
+hash of the prompt (and an optional variant, see `caption_key`).
+
+Backends are picked by settings.CAPTION_CACHE['BACKEND']:
+  'memory' - per-process LRU with TTL (default)
+  'django' - any Django cache alias (shared between processes)
+  'file'   - a JSON file, handy for tests and one-off scripts
+
+Hits and misses are counted in postx_caption_cache_lookups_total (core.metrics),
+so /metrics reports them for every process.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+
+from . import metrics
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_prompt(prompt):
+    return _WHITESPACE.sub(' ', prompt).strip()
+
+
+def caption_key(model_name, prompt, variant=''):
+    """
+    `variant` keeps prompts that are identical on purpose apart - e.g. two
+    campaign posts with the same marketing angle must not share a caption.
+    """
+    raw = '\0'.join((model_name, variant, normalize_prompt(prompt)))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class CaptionCache:
+    """Base class: subclasses implement _get/_set; hit/miss counting lives here."""
+    backend = None
+
+    def __init__(self, ttl=7 * 24 * 3600, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        metrics.inc('postx_caption_cache_lookups_total', backend=self.backend,
+                    result='miss' if value is None else 'hit')
+        return value
+
+    def set(self, key, value):
+        self._set(key, value)
+
+    def get_or_generate(self, key, generate, bypass=False):
+        """Returns the cached caption, or calls `generate()` and stores its result.
+        bypass=True always generates (explicit regeneration) and refreshes the entry."""
+        if not bypass:
+            cached = self.get(key)
+            if cached is not None:
+                return cached
+        value = generate()
+        self.set(key, value)
+        return value
+
+    def stats(self):
+        """This instance's own counts; the process-wide ones are in core.metrics."""
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value):
+        raise NotImplementedError
+
+
+class MemoryCaptionCache(CaptionCache):
+    backend = 'memory'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._data = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def _set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+class DjangoCaptionCache(CaptionCache):
+    """Eviction is left to the Django cache backend (e.g. Redis maxmemory-policy)."""
+    backend = 'django'
+
+    def __init__(self, alias='default', **kwargs):
+        super().__init__(**kwargs)
+        self.alias = alias
+
+    def _get(self, key):
+        return caches[self.alias].get(f"caption:{key}")
+
+    def _set(self, key, value):
+        caches[self.alias].set(f"caption:{key}", value, self.ttl)
+
+
+class FileCaptionCache(CaptionCache):
+    backend = 'file'
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as fh:
+                return json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _dump(self, data):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as fh:
+            json.dump(data, fh)
+        os.replace(tmp, self.path)
+
+    def _get(self, key):
+        with self._lock:
+            data = self._load()
+            entry = data.get(key)
+            if entry is None or entry['expires'] < time.time():
+                return None
+            entry['used'] = time.time()
+            self._dump(data)
+            return entry['value']
+
+    def _set(self, key, value):
+        with self._lock:
+            now = time.time()
+            data = {k: v for k, v in self._load().items() if v['expires'] >= now}
+            data[key] = {'value': value, 'expires': now + self.ttl, 'used': now}
+            if len(data) > self.max_entries:
+                keep = sorted(data, key=lambda k: data[k]['used'])[-self.max_entries:]
+                data = {k: data[k] for k in keep}
+            self._dump(data)
+
+
+BACKENDS = {
+    'memory': MemoryCaptionCache,
+    'django': DjangoCaptionCache,
+    'file': FileCaptionCache,
+}
+
+_cache = None
+
+
+def get_caption_cache():
+    global _cache
+    if _cache is None:
+        options = {k.lower(): v for k, v in settings.CAPTION_CACHE.items()}
+        backend = BACKENDS[options.pop('backend', 'memory')]
+        _cache = backend(**options)
+    return _cache
+
+
+def _caption_cache_setting_changed(setting, **kwargs):
+    global _cache
+    if setting == 'CAPTION_CACHE':
+        _cache = None
+
+
+setting_changed.connect(_caption_cache_setting_changed)
@@ -0,0 +1,35 @@
+"""
+Fair-share admission for bulk caption work.
+
+Campaign posts don't go to the bulk queue all at once any more. A small pump
+(admit_bulk_generation) runs every BULK_ADMIT_INTERVAL seconds and tops the
+bulk lane up to BULK_MAX_IN_FLIGHT posts, splitting that budget evenly
+between every client with work waiting. A year-long campaign for one client
+then only ever holds its share of the lane, and a small client that shows up
+later is served on the next tick instead of behind the whole backlog.
+"""
+
+
+def fair_shares(demand, budget):
+    """
+    Max-min fair split of `budget` between clients: {client: wanted} -> {client: granted}.
+    Nobody gets more than they asked for; what small clients don't need is
+    shared out between the bigger ones. Leftover units go to the lowest keys
+    first so the result is deterministic.
+    """
+    shares = {client: 0 for client, wanted in demand.items() if wanted > 0}
+    remaining = max(budget, 0)
+    while remaining and shares:
+        hungry = sorted(client for client in shares if shares[client] < demand[client])
+        if not hungry:
+            break
+        each = remaining // len(hungry)
+        if not each:
+            for client in hungry[:remaining]:
+                shares[client] += 1
+            break
+        for client in hungry:
+            granted = min(each, demand[client] - shares[client])
+            shares[client] += granted
+            remaining -= granted
+    return {client: granted for client, granted in shares.items() if granted}
@@ -0,0 +1,226 @@
+"""
+Local stand-ins for the external services, used by tests and benchmarks.
+Nothing here is imported by the running app.
+"""
+import asyncio
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+def count_tokens(text):
+    """Rough Gemini-style token estimate (~4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+class FakeResponse:
+    def __init__(self, text, prompt_tokens, output_tokens):
+        self.text = text
+        self.usage_metadata = type('UsageMetadata', (), {
+            'prompt_token_count': prompt_tokens,
+            'candidates_token_count': output_tokens,
+            'total_token_count': prompt_tokens + output_tokens,
+        })()
+
+
+class FakeGenerativeModel:
+    """
+    Stands in for genai.GenerativeModel. Each call sleeps `latency` plus
+    `seconds_per_output_token` per generated token and keeps token counters.
+    Batch prompts ("Write exactly N captions") get a JSON array of N captions;
+    `broken_json=True` makes those come back unparseable.
+    """
+
+    CAPTION = "Ready for something new? ✨ We've been busy. Link in bio! 🚀 #news #launch #brand #daily #insta"
+
+    def __init__(self, latency=0.0, seconds_per_output_token=0.0, broken_json=False):
+        self.latency = latency
+        self.seconds_per_output_token = seconds_per_output_token
+        self.broken_json = broken_json
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def _answer(self, prompt, generation_config=None):
+        batch = re.search(r'Write exactly (\d+) captions', prompt)
+        if batch:
+            count = int(batch.group(1))
+            text = json.dumps([f"{self.CAPTION} ({i})" for i in range(1, count + 1)], ensure_ascii=False)
+            if self.broken_json:
+                text = "Sure! Here are your captions: " + text[:len(text) // 2]
+        else:
+            text = self.CAPTION
+        response = FakeResponse(text, count_tokens(prompt), count_tokens(text))
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += response.usage_metadata.prompt_token_count
+            self.output_tokens += response.usage_metadata.candidates_token_count
+        delay = self.latency + self.seconds_per_output_token * response.usage_metadata.candidates_token_count
+        return response, delay
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        response, delay = self._answer(prompt, generation_config)
+        time.sleep(delay)
+        return response
+
+    async def generate_content_async(self, prompt, generation_config=None, **kwargs):
+        response, delay = self._answer(prompt, generation_config)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.in_flight -= 1
+        return response
+
+
+class FakeGraphAPI:
+    """
+    A tiny threaded HTTP server that speaks enough of the Instagram Graph API
+    for the publish pipeline: POST /<ig_id>/media, GET /<container_id>?fields=status_code
+    and POST /<ig_id>/media_publish.
+
+    Containers report IN_PROGRESS until `processing_seconds` have passed.
+    `latency` is added to every response and `fail_next()` queues error
+    responses (e.g. 500s or 429s with Retry-After) ahead of the real ones.
+    The server speaks HTTP/1.1 keep-alive; `connections` counts the TCP
+    connections it accepted.
+
+        with FakeGraphAPI(processing_seconds=0) as fake:
+            settings.GRAPH_API_URL = fake.url
+    """
+
+    def __init__(self, processing_seconds=0.0, latency=0.0):
+        self.processing_seconds = processing_seconds
+        self.latency = latency
+        self.containers = {}   # container_id -> {'created': t, 'status': ..., 'caption': ...}
+        self.published = []    # media IDs in publish order
+        self.calls = []        # (method, path) of every request
+        self.connections = 0
+        self._failures = []    # queued (status, body, headers)
+        self._ids = itertools.count(1000)
+        self._lock = threading.Lock()
+        self._server = None
+
+    # --- lifecycle ---
+    def start(self):
+        handler = type('Handler', (_GraphHandler,), {'fake': self})
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    # --- behaviour ---
+    def fail_next(self, count=1, status=500, body=None, headers=None):
+        """The next `count` requests get this error instead of a real answer."""
+        body = body or {'error': {'message': 'An unexpected error has occurred.', 'code': 2, 'is_transient': True}}
+        with self._lock:
+            self._failures.extend([(status, body, headers or {})] * count)
+
+    def handle(self, method, path, params):
+        """Returns (http_status, json_body, headers)."""
+        with self._lock:
+            self.calls.append((method, path))
+            if self._failures:
+                return self._failures.pop(0)
+        return (*self.respond(method, path, params), {})
+
+    def respond(self, method, path, params):
+        """Returns (http_status, json_body)."""
+        parts = path.strip('/').split('/')
+
+        if method == 'POST' and len(parts) == 2 and parts[1] == 'media':
+            if not params.get('image_url'):
+                return 400, {'error': {'message': 'image_url is required', 'code': 100}}
+            container_id = str(next(self._ids))
+            with self._lock:
+                self.containers[container_id] = {
+                    'created': time.monotonic(), 'status': None, 'caption': params.get('caption'),
+                }
+            return 200, {'id': container_id}
+
+        if method == 'GET' and len(parts) == 1 and parts[0] in self.containers:
+            return 200, {'status_code': self.container_status(parts[0]), 'id': parts[0]}
+
+        if method == 'POST' and len(parts) == 2 and parts[1] == 'media_publish':
+            container_id = params.get('creation_id')
+            if container_id not in self.containers or self.container_status(container_id) != 'FINISHED':
+                return 400, {'error': {'message': 'Media ID is not available', 'code': 9007}}
+            media_id = str(next(self._ids))
+            with self._lock:
+                self.containers[container_id]['status'] = 'PUBLISHED'
+                self.published.append(media_id)
+            return 200, {'id': media_id}
+
+        return 404, {'error': {'message': f'Unknown path {path}', 'code': 803}}
+
+    def container_status(self, container_id):
+        container = self.containers[container_id]
+        if container['status']:
+            return container['status']
+        if time.monotonic() - container['created'] < self.processing_seconds:
+            return 'IN_PROGRESS'
+        return 'FINISHED'
+
+
+class _GraphHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fake = None
+
+    def setup(self):
+        super().setup()
+        with self.fake._lock:
+            self.fake.connections += 1
+
+    def _handle(self, method):
+        url = urlsplit(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if method == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            params.update({k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()})
+
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        status, body, headers = self.fake.handle(method, url.path, params)
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def log_message(self, *args):
+        pass
@@ -1,3 +1,5 @@
+from datetime import date, datetime, timedelta
+
 from django import forms
 from .models import Post, Campaign
 
@@ -60,4 +62,20 @@ class CampaignForm(forms.ModelForm):
             
             # THE NEW CHECKBOX
             'auto_approve': forms.CheckboxInput(attrs={'class': 'h-5 w-5 text-indigo-600 rounded'}),
-        }
\ No newline at end of file
+        }
+
+    def clean(self):
+        cleaned_data = super().clean()
+        per_day = cleaned_data.get('posts_per_day')
+        interval = cleaned_data.get('interval_hours')
+        start = cleaned_data.get('daily_start_time')
+        if per_day is not None and per_day < 1:
+            self.add_error('posts_per_day', "Post at least once a day.")
+        elif interval is not None and interval < 1:
+            self.add_error('interval_hours', "Posts must be at least an hour apart.")
+        elif per_day and interval and start:
+            # The whole day's slots have to fit before midnight, or they run into the next day's
+            last = datetime.combine(date(2000, 1, 1), start) + timedelta(hours=(per_day - 1) * interval)
+            if last.date() != date(2000, 1, 1):
+                self.add_error('interval_hours', f"{per_day} posts {interval}h apart from {start:%H:%M} run past midnight.")
+        return cleaned_data
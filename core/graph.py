@@ -0,0 +1,301 @@
+"""
+Instagram Graph API client.
+
+Every Graph call goes through one pooled, keep-alive `GraphAPIClient` per
+worker process (see `get_client`): explicit timeouts, retries with jittered
+exponential backoff on transient failures, respect for Retry-After and Meta's
+usage headers, and a per-access-token rate limit.
+
+Publishing is two-phase: create a media container, wait until Meta has
+processed it (status_code FINISHED), then media_publish it. media_publish is
+not idempotent, so a timeout or 5xx on it is never retried blindly: it raises
+GraphAPIUncertain and the caller re-checks the container (PUBLISHED or not).
+"""
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.signals import setting_changed
+
+from . import metrics
+
+# Graph error codes that mean "slow down" rather than "this request is wrong"
+RATE_LIMIT_CODES = {4, 17, 32, 613, 80001, 80002}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GraphAPIError(Exception):
+    """The Graph API answered, but not with what we asked for."""
+
+    def __init__(self, message, payload=None, status=None):
+        super().__init__(message)
+        self.payload = payload
+        self.status = status
+
+
+class GraphAPIUncertain(GraphAPIError):
+    """A non-idempotent call may or may not have taken effect (timeout or 5xx); check before repeating it."""
+
+
+class GraphRateLimited(GraphAPIError):
+    """Throttled for longer than we are willing to wait in-process; retry after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after, payload=None, status=None):
+        super().__init__(message, payload, status)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Per-key token bucket: `rate` calls per second with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}  # key -> [tokens, last_refill, blocked_until]
+        self._lock = threading.Lock()
+
+    def reserve(self, key):
+        """Takes one token and returns how long the caller must wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            tokens, last, blocked_until = self._buckets.get(key, [self.burst, now, 0.0])
+            tokens = min(self.burst, tokens + (now - last) * self.rate) - 1
+            self._buckets[key] = [tokens, now, blocked_until]
+            wait = -tokens / self.rate if tokens < 0 else 0.0
+            return max(wait, blocked_until - now)
+
+    def block(self, key, seconds):
+        """Nobody gets a token for `key` for the next `seconds`."""
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets.setdefault(key, [self.burst, now, 0.0])
+            bucket[2] = max(bucket[2], now + seconds)
+
+
+class GraphAPIClient:
+    def __init__(self, base_url, timeout=(3.05, 20), max_retries=3, backoff=0.5, max_backoff=30.0,
+                 pool_size=10, rate_per_token=1.0, burst_per_token=10, sleep=time.sleep):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.limiter = TokenBucket(rate_per_token, burst_per_token)
+
+        self.session = requests.Session()
+        # We do our own retries; the adapter only pools connections
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, path, access_token, **params):
+        return self.request('GET', path, access_token, params=params)
+
+    def post(self, path, access_token, idempotent=True, **data):
+        return self.request('POST', path, access_token, data=data, idempotent=idempotent)
+
+    def request(self, method, path, access_token, params=None, data=None, idempotent=True):
+        """
+        Returns the decoded JSON body of a successful call or raises GraphAPIError.
+        A non-`idempotent` call is only retried when Meta certainly did not act on
+        it (connect failures, rate limits); otherwise it raises GraphAPIUncertain.
+        """
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        if method == 'GET':
+            params = {**(params or {}), 'access_token': access_token}
+        else:
+            data = {**(data or {}), 'access_token': access_token}
+
+        endpoint = _endpoint(path)
+        attempt = 0
+        while True:
+            self._throttle(access_token)
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, params=params, data=data, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.inc('postx_graph_requests_total', endpoint=endpoint, status='network_error')
+                if not idempotent and not isinstance(e, requests.ConnectTimeout):
+                    raise GraphAPIUncertain(f"Graph API {endpoint} outcome unknown: {e}") from e
+                if attempt >= self.max_retries:
+                    raise GraphAPIError(f"Graph API unreachable: {e}") from e
+                self._wait(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            metrics.observe('postx_graph_request_seconds', time.perf_counter() - started, endpoint=endpoint)
+            metrics.inc('postx_graph_requests_total', endpoint=endpoint, status=str(response.status_code))
+            payload = self._json(response)
+            self._note_usage(access_token, response)
+            if response.ok:
+                return payload
+            if not idempotent and response.status_code >= 500:
+                raise GraphAPIUncertain(f"Graph API {endpoint} outcome unknown ({response.status_code}): {payload}",
+                                        payload, response.status_code)
+
+            wait = self._retry_delay(access_token, response, payload, attempt)
+            if wait is None:
+                raise GraphAPIError(f"Graph API Error {response.status_code}: {payload}", payload, response.status_code)
+            attempt += 1
+            self._wait(wait)
+
+    # --- retry policy ---
+    def _backoff(self, attempt):
+        # "Full jitter": anywhere between 0 and the exponential cap
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def _retry_delay(self, access_token, response, payload, attempt):
+        """Seconds to wait before retrying, or None if the error is not retryable."""
+        error = payload.get('error', {}) if isinstance(payload, dict) else {}
+        rate_limited = response.status_code == 429 or error.get('code') in RATE_LIMIT_CODES
+        transient = rate_limited or response.status_code in RETRY_STATUSES or error.get('is_transient')
+        if not transient or attempt >= self.max_retries:
+            if rate_limited:
+                raise GraphRateLimited(f"Graph API rate limited: {payload}",
+                                       self._server_delay(response) or self.max_backoff, payload, response.status_code)
+            return None
+
+        wait = self._server_delay(response)
+        if wait is None:
+            return self._backoff(attempt)
+        if wait > self.max_backoff:
+            # Too long to hold a worker: let the caller reschedule itself
+            raise GraphRateLimited(f"Graph API rate limited for {wait:.0f}s", wait, payload, response.status_code)
+        if rate_limited:
+            # Every caller using this token waits it out (in _throttle), not just us
+            self.limiter.block(access_token, wait)
+            return 0
+        return wait
+
+    def _server_delay(self, response):
+        """Retry-After, else Meta's estimated_time_to_regain_access (minutes)."""
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        regain = 0
+        for usage in _business_usage(response):
+            regain = max(regain, usage.get('estimated_time_to_regain_access') or 0)
+        return regain * 60 if regain else None
+
+    def _note_usage(self, access_token, response):
+        """Back off BEFORE Meta starts rejecting us when a usage header is nearly at 100%."""
+        usages = list(_business_usage(response))
+        app_usage = _header_json(response, 'X-App-Usage')
+        if isinstance(app_usage, dict):
+            usages.append(app_usage)
+        peak = max((max(u.get(k) or 0 for k in ('call_count', 'total_time', 'total_cputime')) for u in usages), default=0)
+        if peak >= 95:
+            self.limiter.block(access_token, self.max_backoff)
+
+    def _throttle(self, access_token):
+        wait = self.limiter.reserve(access_token)
+        if wait > self.max_backoff:
+            raise GraphRateLimited(f"Access token throttled for {wait:.0f}s", wait)
+        self._wait(wait)
+
+    def _wait(self, seconds):
+        if seconds > 0:
+            self.sleep(seconds)
+
+    @staticmethod
+    def _json(response):
+        try:
+            return response.json()
+        except ValueError:
+            return {'error': {'message': response.text[:200]}}
+
+
+def _endpoint(path):
+    """Metric label for a Graph path: '<id>/media' -> 'media', a bare node id -> 'node'."""
+    parts = path.strip('/').split('/')
+    return parts[-1] if len(parts) > 1 else 'node'
+
+
+def _header_json(response, name):
+    try:
+        return json.loads(response.headers.get(name) or 'null')
+    except ValueError:
+        return None
+
+
+def _business_usage(response):
+    usage = _header_json(response, 'X-Business-Use-Case-Usage')
+    if isinstance(usage, dict):
+        for entries in usage.values():
+            yield from (e for e in entries if isinstance(e, dict))
+
+
+# --- one client per worker process ---
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GraphAPIClient(
+                    settings.GRAPH_API_URL,
+                    timeout=settings.GRAPH_API_TIMEOUT,
+                    max_retries=settings.GRAPH_API_MAX_RETRIES,
+                    pool_size=settings.GRAPH_API_POOL_SIZE,
+                    rate_per_token=settings.GRAPH_API_RATE_PER_TOKEN,
+                    burst_per_token=settings.GRAPH_API_BURST_PER_TOKEN,
+                )
+    return _client
+
+
+def reset_client():
+    """Drops the shared client (forked children must not share parent sockets)."""
+    global _client
+    _client = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=reset_client)
+
+
+def _graph_setting_changed(setting, **kwargs):
+    if setting.startswith('GRAPH_API_'):
+        reset_client()
+
+
+setting_changed.connect(_graph_setting_changed)
+
+
+# --- content publishing ---
+def create_media_container(page_id, access_token, image_url, caption):
+    """Step 1: returns the container ID Meta will process in the background."""
+    data = get_client().post(f"{page_id}/media", access_token, image_url=image_url, caption=caption)
+    if 'id' not in data:
+        raise GraphAPIError(f"Facebook Container Error: {data}", data)
+    return data['id']
+
+
+def get_container_status(container_id, access_token):
+    """IN_PROGRESS, FINISHED, ERROR, EXPIRED or PUBLISHED."""
+    data = get_client().get(container_id, access_token, fields='status_code')
+    if 'status_code' not in data:
+        raise GraphAPIError(f"Facebook Container Status Error: {data}", data)
+    return data['status_code']
+
+
+def publish_media_container(page_id, access_token, container_id):
+    """
+    Step 2: publishes a FINISHED container and returns the media ID. Raises
+    GraphAPIUncertain instead of retrying when Meta may have published it anyway.
+    """
+    data = get_client().post(f"{page_id}/media_publish", access_token, idempotent=False, creation_id=container_id)
+    if 'id' not in data:
+        raise GraphAPIError(f"Facebook Publish Error: {data}", data)
+    return data['id']
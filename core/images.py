@@ -0,0 +1,108 @@
+"""
+Derivative images: small dashboard thumbnails and Instagram-compliant JPEGs,
+rendered once per source file and reused by every post that shares it.
+
+Derivatives are generated in the background when an image is uploaded, or
+lazily the first time one is asked for; until then callers get the original.
+"""
+import hashlib
+import io
+import os
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from PIL import Image, ImageOps
+
+from .storage import blob_storage, is_blob
+
+# name -> rendering rules
+VARIANTS = {
+    # Dashboard cards: small, cheap to download
+    'thumb': {'max_size': (640, 640), 'quality': 80},
+    # Instagram feed: aspect ratio between 4:5 and 1.91:1, 320-1440px wide, JPEG
+    'instagram': {'min_ratio': 4 / 5, 'max_ratio': 1.91, 'min_width': 320, 'max_width': 1440, 'quality': 90},
+}
+
+# Derivatives are written under fixed names, so overwriting an identical render is fine
+derivative_storage = FileSystemStorage(allow_overwrite=True)
+
+EXISTS_CACHE_TIMEOUT = 24 * 3600
+MISS_CACHE_TIMEOUT = 60
+ENQUEUE_LOCK_TIMEOUT = 10 * 60
+
+
+def variant_name(source_name, variant):
+    """Where the `variant` of `source_name` lives. Blobs reuse their content hash."""
+    if is_blob(source_name):
+        key = os.path.splitext(os.path.basename(source_name))[0]
+    else:
+        key = hashlib.sha1(source_name.encode()).hexdigest()
+    return f"derivatives/{variant}/{key[:2]}/{key}.jpg"
+
+
+def render_variant(image, variant):
+    """Returns a new RGB PIL image following VARIANTS[variant]."""
+    rules = VARIANTS[variant]
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+        image = background
+
+    if 'max_size' in rules:
+        image = image.copy()
+        image.thumbnail(rules['max_size'], Image.LANCZOS)
+        return image
+
+    # Crop to the allowed aspect ratio range, keeping the centre
+    width, height = image.size
+    ratio = width / height
+    if ratio < rules['min_ratio']:
+        new_height = round(width / rules['min_ratio'])
+        top = (height - new_height) // 2
+        image = image.crop((0, top, width, top + new_height))
+    elif ratio > rules['max_ratio']:
+        new_width = round(height * rules['max_ratio'])
+        left = (width - new_width) // 2
+        image = image.crop((left, 0, left + new_width, height))
+
+    width, height = image.size
+    target = min(max(width, rules['min_width']), rules['max_width'])
+    if target != width:
+        image = image.resize((target, round(height * target / width)), Image.LANCZOS)
+    return image
+
+
+def ensure_variant(source_name, variant):
+    """Renders the derivative if it doesn't exist yet and returns its name."""
+    name = variant_name(source_name, variant)
+    if not derivative_storage.exists(name):
+        with blob_storage.open(source_name) as fh:
+            with Image.open(fh) as image:
+                rendered = render_variant(image, variant)
+        out = io.BytesIO()
+        rendered.save(out, 'JPEG', quality=VARIANTS[variant]['quality'], optimize=True, progressive=True)
+        derivative_storage.save(name, ContentFile(out.getvalue()))
+    cache.set(f"variant:{name}", True, EXISTS_CACHE_TIMEOUT)
+    return name
+
+
+def variant_url(source_name, variant):
+    """
+    URL of the derivative if it's ready. Otherwise schedules it (at most once
+    per ENQUEUE_LOCK_TIMEOUT) and returns the original so nothing breaks.
+    """
+    name = variant_name(source_name, variant)
+    ready = cache.get(f"variant:{name}")
+    if ready is None:
+        ready = derivative_storage.exists(name)
+        # Misses are only remembered briefly; ensure_variant() flips them to True
+        cache.set(f"variant:{name}", ready, EXISTS_CACHE_TIMEOUT if ready else MISS_CACHE_TIMEOUT)
+    if ready:
+        return derivative_storage.url(name)
+
+    if cache.add(f"variant-queued:{source_name}", True, ENQUEUE_LOCK_TIMEOUT):
+        from .tasks import generate_image_variants
+        generate_image_variants.delay(source_name)
+    return blob_storage.url(source_name)
@@ -0,0 +1,32 @@
+"""
+One JSON object per log line, so the pipeline can be searched by post,
+campaign or Celery task instead of grepping print() output.
+
+    logger.info("Post published", extra={'post_id': post.id, 'media_id': media_id})
+"""
+import json
+import logging
+
+from celery import current_task
+
+# LogRecord attributes that are not worth repeating in every line
+_STANDARD = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class StructuredFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        # Everything passed through `extra=` (post_id, campaign_id, ...)
+        entry.update({key: value for key, value in vars(record).items() if key not in _STANDARD})
+        task = current_task
+        if task and task.request.id:
+            entry.setdefault('task', task.name)
+            entry.setdefault('task_id', task.request.id)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
@@ -0,0 +1,55 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import Client, Campaign, Post
+from core.tasks import build_campaign_schedule, materialize_campaign_posts
+
+
+class Command(BaseCommand):
+    help = "Benchmarks campaign materialization (rows/sec) on the configured database. Nothing is kept."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--per-day', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--legacy', action='store_true', help="Also time the old one-save()-per-post loop.")
+
+    def handle(self, *args, **options):
+        days, per_day = options['days'], options['per_day']
+        self.stdout.write(f"DB: {connection.vendor} | campaign: {days} days x {per_day}/day = {days * per_day} posts")
+
+        for run in range(options['repeat']):
+            bulk = self._timed(days, per_day, legacy=False)
+            line = f"run {run + 1}: bulk {bulk:,.0f} rows/sec"
+            if options['legacy']:
+                legacy = self._timed(days, per_day, legacy=True)
+                line += f" | legacy {legacy:,.0f} rows/sec ({bulk / legacy:.1f}x)"
+            self.stdout.write(line)
+
+    def _timed(self, days, per_day, legacy):
+        # Everything happens inside a transaction that is rolled back at the end
+        with transaction.atomic():
+            user = User.objects.create(username=f"bench-{time.monotonic_ns()}")
+            client = Client.objects.create(user=user, company_name="Bench Co", company_bio="Benchmarks.")
+            today = timezone.localdate()
+            campaign = Campaign.objects.create(
+                client=client, name="Bench", type='bio', posts_per_day=per_day,
+                start_date=today, end_date=today + timedelta(days=days - 1), interval_hours=1,
+            )
+
+            start = time.perf_counter()
+            if legacy:
+                for post in build_campaign_schedule(campaign, campaign_images=[]):
+                    post.save()
+                created = Post.objects.filter(campaign=campaign).count()
+            else:
+                created = materialize_campaign_posts(campaign, until=campaign.end_date)
+            elapsed = time.perf_counter() - start
+
+            transaction.set_rollback(True)
+        return created / elapsed
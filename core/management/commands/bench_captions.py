@@ -0,0 +1,69 @@
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from core import ai
+from core.fakes import FakeGenerativeModel
+from core.models import Client, Campaign, Post
+from core.tasks import generate_ai_content, generate_ai_content_batch, materialize_campaign_posts
+
+
+class Command(BaseCommand):
+    help = "Compares per-post and batched caption generation for one campaign against a stubbed Gemini model."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=30)
+        parser.add_argument('--batch-size', type=int, default=30)
+        parser.add_argument('--latency', type=float, default=0.8, help="Fixed seconds per model call.")
+        parser.add_argument('--per-token', type=float, default=0.002, help="Seconds per generated token.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{options['posts']} posts | stub latency {options['latency']}s + {options['per_token']}s/token")
+        single = self._run(options, batched=False)
+        batch = self._run(options, batched=True)
+        for label, stats in (("single", single), ("batched", batch)):
+            self.stdout.write(
+                f"{label:8}: {stats['calls']:3} calls | {stats['prompt_tokens']:6} prompt tokens | "
+                f"{stats['output_tokens']:6} output tokens | {stats['seconds']:.2f}s"
+            )
+        self.stdout.write(
+            f"batched saves {1 - batch['prompt_tokens'] / single['prompt_tokens']:.0%} of prompt tokens "
+            f"and {1 - batch['seconds'] / single['seconds']:.0%} of wall-clock time"
+        )
+
+    def _run(self, options, batched):
+        model = FakeGenerativeModel(latency=options['latency'], seconds_per_output_token=options['per_token'])
+        with transaction.atomic(), mock.patch.object(ai, 'get_model', return_value=model):
+            user = User.objects.create(username=f"bench-{time.monotonic_ns()}")
+            client = Client.objects.create(
+                user=user, company_name="Bench Co",
+                company_bio="A neighbourhood bakery baking sourdough, pastries and celebration cakes since 1998. " * 4,
+            )
+            today = timezone.localdate()
+            campaign = Campaign.objects.create(
+                client=client, name="Bench", type='bio', posts_per_day=1,
+                start_date=today, end_date=today + timedelta(days=options['posts'] - 1),
+            )
+            materialize_campaign_posts(campaign, until=campaign.end_date)
+            ids = list(Post.objects.filter(campaign=campaign).values_list('id', flat=True))
+
+            start = time.perf_counter()
+            if batched:
+                size = options['batch_size']
+                for i in range(0, len(ids), size):
+                    generate_ai_content_batch(ids[i:i + size])
+            else:
+                for post_id in ids:
+                    generate_ai_content(post_id)
+            seconds = time.perf_counter() - start
+
+            assert not Post.objects.filter(campaign=campaign, generated_caption__isnull=True).exists()
+            transaction.set_rollback(True)
+
+        return {'calls': model.calls, 'prompt_tokens': model.prompt_tokens,
+                'output_tokens': model.output_tokens, 'seconds': seconds}
@@ -0,0 +1,149 @@
+import multiprocessing
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.test import override_settings
+from django.utils import timezone
+
+from core.models import Client, Post
+from core.tasks import claim_due_posts
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def claim(rng):
+    """The scheduler: one UPDATE ... RETURNING, as check_schedule runs it."""
+    claim_due_posts('approved', 'publishing', 5)
+
+
+def finish(rng):
+    """A publish task: read the post, then write its new status in the same transaction."""
+    with transaction.atomic():
+        post = Post.objects.filter(status='publishing', client__company_name='DB write bench').order_by('?').first()
+        if post:
+            post.status = 'approved'
+            post.save(update_fields=['status'])
+
+
+def read(rng):
+    """The dashboard."""
+    list(Post.objects.filter(client__company_name='DB write bench').values('status').order_by('-scheduled_time')[:50])
+
+
+WORKLOAD = ((claim, 4), (finish, 4), (read, 2))
+
+
+def worker(options, rate, seed, results):
+    connections.close_all()
+    rng = random.Random(seed)
+    ops, weights = zip(*WORKLOAD)
+    latencies, errors, locked = [], 0, 0
+    started = time.monotonic()
+    deadline = started + options['seconds']
+    n = 0
+    while time.monotonic() < deadline:
+        # Open loop: hold the target rate even when some calls are slow
+        wait = started + n / rate - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        n += 1
+        op = rng.choices(ops, weights)[0]
+        t0 = time.perf_counter()
+        try:
+            op(rng)
+        except OperationalError as e:
+            errors += 1
+            locked += 'locked' in str(e) or 'busy' in str(e)
+            continue
+        latencies.append(time.perf_counter() - t0)
+    connections.close_all()
+    results.put({'latencies': latencies, 'errors': errors, 'locked': locked})
+
+
+class Command(BaseCommand):
+    help = (
+        "Write-concurrency stress test: N processes (think web + Celery workers + beat) claim, "
+        "update and read posts at a target total rate against the configured database, and "
+        "report lock errors and latency. Seeds and deletes its own rows; use a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--rate', type=float, default=200.0, help="Target operations/second over all processes.")
+        parser.add_argument('--seconds', type=float, default=10.0)
+        parser.add_argument('--posts', type=int, default=500)
+        parser.add_argument('--legacy', action='store_true',
+                            help="SQLite only: run with the old untuned connection options for comparison.")
+
+    def handle(self, *args, **options):
+        if options['legacy'] and connection.vendor != 'sqlite':
+            raise CommandError("--legacy only applies to SQLite.")
+        configured = connection.settings_dict['OPTIONS']
+        # The worker processes are forked, so they inherit this too
+        profile = override_settings(SQLITE_WAL=not options['legacy'])
+        profile.enable()
+        if options['legacy']:
+            # The profile before WAL tuning: rollback journal, deferred BEGIN, 5s timeout.
+            # journal_mode is stored in the file, so switch it back explicitly.
+            connection.close()
+            connection.settings_dict['OPTIONS'] = {}
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode=DELETE')
+        user = self.seed(options['posts'])
+        try:
+            results = self.run(options)
+        finally:
+            User.objects.filter(pk=user.pk).delete()
+            connection.close()
+            connection.settings_dict['OPTIONS'] = configured
+            profile.disable()
+
+        latencies = sorted(value for r in results for value in r['latencies'])
+        errors = sum(r['errors'] for r in results)
+        locked = sum(r['locked'] for r in results)
+        total = len(latencies) + errors
+        profile = 'legacy' if options['legacy'] else 'configured'
+        self.stdout.write(
+            f"{connection.vendor} ({profile}), {options['processes']} processes, "
+            f"target {options['rate']:.0f} ops/s for {options['seconds']:.0f}s"
+        )
+        self.stdout.write(
+            f"  achieved {total / options['seconds']:.1f} ops/s | ok {len(latencies)} | "
+            f"errors {errors} (locked {locked})"
+        )
+        if latencies:
+            self.stdout.write(
+                f"  latency p50 {percentile(latencies, 50) * 1000:.1f}ms | "
+                f"p99 {percentile(latencies, 99) * 1000:.1f}ms | max {latencies[-1] * 1000:.1f}ms"
+            )
+
+    def seed(self, count):
+        user = User.objects.create(username=f"db-write-bench-{time.monotonic_ns()}")
+        client = Client.objects.create(user=user, company_name='DB write bench', company_bio='-')
+        past = timezone.now() - timedelta(hours=1)
+        Post.objects.bulk_create(
+            Post(client=client, news_update='bench', scheduled_time=past - timedelta(seconds=i), status='approved')
+            for i in range(count)
+        )
+        return user
+
+    def run(self, options):
+        # Children must open their own connections, never share the parent's
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        rate = options['rate'] / options['processes']
+        procs = [context.Process(target=worker, args=(options, rate, i, results)) for i in range(options['processes'])]
+        for p in procs:
+            p.start()
+        collected = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+        return collected
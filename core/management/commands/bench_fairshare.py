@@ -0,0 +1,131 @@
+import heapq
+import random
+import statistics
+
+from django.core.management.base import BaseCommand
+
+from core.fairshare import fair_shares
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Lane:
+    """`slots` workers serving jobs in the order they were queued (a Celery queue)."""
+
+    def __init__(self, slots):
+        self.free_at = [0.0] * slots
+
+    def run(self, queued_at, service):
+        """Returns when a job queued at `queued_at` finishes."""
+        start = max(queued_at, heapq.heappop(self.free_at))
+        heapq.heappush(self.free_at, start + service)
+        return start + service
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulates one agency launching a huge campaign while small clients create theirs and "
+        "publishes keep coming: per-client caption latency and publish latency with one shared "
+        "queue, with separate lanes, and with lanes + fair-share admission."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--agency-posts', type=int, default=20_000)
+        parser.add_argument('--small-clients', type=int, default=5)
+        parser.add_argument('--small-posts', type=int, default=100)
+        parser.add_argument('--caption-seconds', type=float, default=0.4, help="Worker time per caption.")
+        parser.add_argument('--publish-seconds', type=float, default=1.5, help="Worker time per publish.")
+        parser.add_argument('--publish-rate', type=float, default=0.5, help="Publishes due per second.")
+        parser.add_argument('--bulk-slots', type=int, default=8)
+        parser.add_argument('--publish-slots', type=int, default=4)
+        parser.add_argument('--interval', type=float, default=10, help="BULK_ADMIT_INTERVAL")
+        parser.add_argument('--in-flight', type=int, default=200, help="BULK_MAX_IN_FLIGHT")
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.options = options
+        rng = random.Random(options['seed'])
+        # (client, arrival) for every campaign post; the agency arrives first
+        captions = [('agency', 0.0)] * options['agency_posts']
+        for i in range(options['small_clients']):
+            arrival = 5.0 + 20.0 * i
+            captions += [(f'shop-{i + 1}', arrival)] * options['small_posts']
+        horizon = options['agency_posts'] * options['caption_seconds'] / options['bulk_slots']
+        publishes, t = [], 0.0
+        while t < horizon:
+            t += rng.expovariate(options['publish_rate'])
+            publishes.append(t)
+
+        o = options
+        self.stdout.write(
+            f"{o['agency_posts']} agency posts + {o['small_clients']}x{o['small_posts']} small-client posts, "
+            f"{len(publishes)} publishes over {horizon:.0f}s ({o['bulk_slots']} bulk / {o['publish_slots']} publish slots)"
+        )
+        self.report("shared queue (before)", *self.shared(captions, publishes))
+        self.report("lanes, FIFO bulk", *self.lanes(captions, publishes, fair=False))
+        self.report("lanes + fair share", *self.lanes(captions, publishes, fair=True))
+
+    def shared(self, captions, publishes):
+        """Everything in one queue on bulk+publish slots, in arrival order."""
+        o = self.options
+        lane = Lane(o['bulk_slots'] + o['publish_slots'])
+        jobs = sorted([(arrival, 0, client) for client, arrival in captions] + [(t, 1, None) for t in publishes])
+        latency, publish_latency = {}, []
+        for arrival, is_publish, client in jobs:
+            if is_publish:
+                publish_latency.append(lane.run(arrival, o['publish_seconds']) - arrival)
+            else:
+                latency.setdefault(client, []).append(lane.run(arrival, o['caption_seconds']) - arrival)
+        return latency, publish_latency
+
+    def lanes(self, captions, publishes, fair):
+        o = self.options
+        publish_lane = Lane(o['publish_slots'])
+        publish_latency = [publish_lane.run(t, o['publish_seconds']) - t for t in publishes]
+
+        bulk = Lane(o['bulk_slots'])
+        latency = {}
+        if not fair:
+            for client, arrival in sorted(captions, key=lambda job: job[1]):
+                latency.setdefault(client, []).append(bulk.run(arrival, o['caption_seconds']) - arrival)
+            return latency, publish_latency
+
+        # The pump: every interval, top the lane up to --in-flight, split fairly
+        waiting = {}
+        arrivals = sorted(captions, key=lambda job: job[1])
+        finishing = []  # completion times of admitted jobs
+        tick, next_arrival = 0.0, 0
+        while next_arrival < len(arrivals) or any(waiting.values()):
+            while next_arrival < len(arrivals) and arrivals[next_arrival][1] <= tick:
+                client, arrival = arrivals[next_arrival]
+                waiting.setdefault(client, []).append(arrival)
+                next_arrival += 1
+            while finishing and finishing[0] <= tick:
+                heapq.heappop(finishing)
+            budget = o['in_flight'] - len(finishing)
+            demand = {client: len(queue) for client, queue in waiting.items()}
+            for client, share in fair_shares(demand, budget).items():
+                for arrival in waiting[client][:share]:
+                    done = bulk.run(tick, o['caption_seconds'])
+                    heapq.heappush(finishing, done)
+                    latency.setdefault(client, []).append(done - arrival)
+                del waiting[client][:share]
+            tick += o['interval']
+        return latency, publish_latency
+
+    def report(self, label, latency, publish_latency):
+        self.stdout.write(f"\n{label}")
+        self.stdout.write(f"  {'client':<10} {'posts':>6} {'p50':>9} {'p99':>9} {'max':>9}")
+        for client in sorted(latency, key=lambda c: (c != 'agency', c)):
+            values = latency[client]
+            self.stdout.write(
+                f"  {client:<10} {len(values):>6} {statistics.median(values):>8.0f}s "
+                f"{percentile(values, 99):>8.0f}s {max(values):>8.0f}s"
+            )
+        self.stdout.write(
+            f"  {'publishes':<10} {len(publish_latency):>6} {statistics.median(publish_latency):>8.1f}s "
+            f"{percentile(publish_latency, 99):>8.1f}s {max(publish_latency):>8.1f}s"
+        )
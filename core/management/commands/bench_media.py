@@ -0,0 +1,169 @@
+import http.client
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test import override_settings
+
+from core import media
+
+NAME = 'blobs/be/' + 'be' * 32 + '.jpg'
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+class SlotLimitedApp:
+    """
+    The app behind `slots` workers (gunicorn --workers): a request holds its
+    slot until its whole body has been written to the client.
+    """
+
+    def __init__(self, app, slots):
+        self.app = app
+        self.slots = threading.BoundedSemaphore(slots)
+        self.lock = threading.Lock()
+        self.busy = {}  # kind -> [requests, slot-seconds]
+
+    def __call__(self, environ, start_response):
+        self.slots.acquire()
+        started = time.perf_counter()
+        kind = 'media' if environ['PATH_INFO'].startswith('/media/') else 'page'
+        try:
+            result = self.app(environ, start_response)
+        except BaseException:
+            self.release(kind, started)
+            raise
+        return self.body(result, kind, started)
+
+    def body(self, result, kind, started):
+        try:
+            yield from result
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+            self.release(kind, started)
+
+    def release(self, kind, started):
+        with self.lock:
+            stats = self.busy.setdefault(kind, [0, 0.0])
+            stats[0] += 1
+            stats[1] += time.perf_counter() - started
+        self.slots.release()
+
+
+class Server(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Slow clients (think Meta's crawler, phones) download a large image while a probe "
+        "keeps loading an app page, against a local server with --workers request slots: "
+        "streamed from Django vs handed to the front server (MEDIA_ACCEL=nginx)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="App worker slots.")
+        parser.add_argument('--fetchers', type=int, default=8, help="Concurrent media downloads.")
+        parser.add_argument('--size-mb', type=float, default=8.0)
+        parser.add_argument('--client-mbps', type=float, default=16.0, help="Download speed of each fetcher, MB/s.")
+        parser.add_argument('--seconds', type=float, default=8.0)
+        parser.add_argument('--probe-interval', type=float, default=0.05)
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        try:
+            path = os.path.join(media_root, NAME)
+            os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as fh:
+                fh.write(os.urandom(int(options['size_mb'] * 1024 * 1024)))
+            o = options
+            self.stdout.write(
+                f"{o['fetchers']} fetchers at {o['client_mbps']} MB/s for a {o['size_mb']} MB image, "
+                f"{o['workers']} app workers, {o['seconds']}s"
+            )
+            for label, accel in (("streamed by Django", ''), ("X-Accel-Redirect", 'nginx')):
+                with override_settings(MEDIA_ROOT=media_root, MEDIA_ACCEL=accel, ALLOWED_HOSTS=['*'],
+                                       PUBLIC_BASE_URL='', DEBUG=False):
+                    self.report(label, *self.run(options))
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+        self.stdout.write("(with X-Accel-Redirect the bytes come from nginx, which isn't running here)")
+
+    def run(self, options):
+        app = SlotLimitedApp(get_wsgi_application(), options['workers'])
+        server = Server(('127.0.0.1', 0), QuietHandler)
+        server.set_app(app)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        address = server.server_address
+        deadline = time.monotonic() + options['seconds']
+        url = urlsplit(media.signed_url(NAME)).path
+        downloads, probes = [], []
+
+        def fetch():
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                self.get(address, url, rate=options['client_mbps'] * 1024 * 1024)
+                downloads.append(time.perf_counter() - started)
+
+        def probe():
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                self.get(address, '/login/')
+                probes.append(time.perf_counter() - started)
+                time.sleep(options['probe_interval'])
+
+        threads = [threading.Thread(target=fetch) for _ in range(options['fetchers'])]
+        threads.append(threading.Thread(target=probe))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        server.shutdown()
+        server.server_close()
+        return app.busy, downloads, probes
+
+    @staticmethod
+    def get(address, path, rate=None):
+        """GET with a small receive window, reading no faster than `rate` bytes/s."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
+        sock.connect(address)
+        conn = http.client.HTTPConnection(*address)
+        conn.sock = sock
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            while chunk := response.read(64 * 1024):
+                if rate:
+                    time.sleep(len(chunk) / rate)
+        finally:
+            conn.close()
+
+    def report(self, label, busy, downloads, probes):
+        requests, slot_seconds = busy.get('media', [0, 0.0])
+        self.stdout.write(f"\n{label}")
+        self.stdout.write(
+            f"  media: {len(downloads)} requests | worker time per request "
+            f"{slot_seconds / max(requests, 1) * 1000:8.1f} ms"
+        )
+        self.stdout.write(
+            f"  page probe: {len(probes)} loads | p50 {percentile(probes, 50) * 1000:7.1f} ms | "
+            f"p99 {percentile(probes, 99) * 1000:7.1f} ms | max {max(probes, default=0) * 1000:7.1f} ms"
+        )
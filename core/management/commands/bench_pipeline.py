@@ -0,0 +1,259 @@
+import io
+import json
+import resource
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock
+
+from celery import current_app
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import override_settings
+from django.utils import timezone
+from PIL import Image
+
+from core import ai, metrics, tasks
+from core.fakes import FakeGenerativeModel, FakeGraphAPI
+from core.models import Client, Campaign, CampaignImage, Post
+
+# Compared by --compare: (result key, label, True if higher is better)
+HEADLINE = (
+    ('initialize.posts_per_second', 'campaign posts/sec', True),
+    ('generate.posts_per_second', 'captions/sec', True),
+    ('publish.posts_per_second', 'publishes/sec', True),
+    ('lag.p50', 'lag p50 (s)', False),
+    ('lag.p99', 'lag p99 (s)', False),
+    ('initialize.queries', 'queries: initialize', False),
+    ('generate.queries', 'queries: generate', False),
+    ('publish.queries', 'queries: publish', False),
+    ('publish.peak_rss_mb', 'peak RSS (MB)', False),
+)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else None
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = (
+        "End-to-end pipeline benchmark: seeds clients and campaigns, then runs the real "
+        "initialize_campaign_posts / admit_bulk_generation / check_schedule / upload_to_facebook "
+        "code with eager Celery against a fake Gemini model and a local fake Graph API. "
+        "Reports throughput, schedule-to-publish lag, query counts and memory, optionally as JSON. "
+        "Everything runs in a rolled-back transaction, but use a scratch database anyway."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=5)
+        parser.add_argument('--campaigns', type=int, default=2, help="Campaigns per client.")
+        parser.add_argument('--days', type=int, default=7)
+        parser.add_argument('--per-day', type=int, default=3)
+        parser.add_argument('--window', type=float, default=10.0,
+                            help="The publish schedule is squeezed into this many seconds from now.")
+        parser.add_argument('--tick', type=float, default=0.25, help="Seconds between check_schedule sweeps.")
+        parser.add_argument('--gemini-latency', type=float, default=0.02)
+        parser.add_argument('--graph-latency', type=float, default=0.002)
+        parser.add_argument('--processing', type=float, default=0.0, help="Seconds Meta takes to process a container.")
+        parser.add_argument('--graph-rate', type=float, default=1000.0,
+                            help="Graph calls/sec per access token (GRAPH_API_RATE_PER_TOKEN); real Meta limits are ~1.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--compare', help="A previous --output file to compare against.")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as fh:
+                    baseline = json.load(fh)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read {options['compare']}: {e}")
+
+        media_root = tempfile.mkdtemp()
+        model = FakeGenerativeModel(latency=options['gemini_latency'])
+        conf = current_app.conf
+        eager = (conf.task_always_eager, conf.task_eager_propagates)
+        conf.task_always_eager, conf.task_eager_propagates = True, False
+        self.lags = []
+        observe = metrics.observe
+
+        def record(name, value, **labels):
+            if name == 'postx_publish_lag_seconds':
+                self.lags.append(value)
+            observe(name, value, **labels)
+
+        try:
+            with FakeGraphAPI(processing_seconds=options['processing'], latency=options['graph_latency']) as graph_api, \
+                    override_settings(GRAPH_API_URL=graph_api.url, GRAPH_API_RATE_PER_TOKEN=options['graph_rate'],
+                                      MEDIA_ROOT=media_root, METRICS_DIR=None,
+                                      PUBLISH_POLL_DELAY=0, PUBLISH_POLL_MAX_DELAY=0), \
+                    mock.patch.object(ai, 'get_model', return_value=model), \
+                    mock.patch.object(metrics, 'observe', side_effect=record), \
+                    transaction.atomic():
+                results = self.run_pipeline(options)
+                transaction.set_rollback(True)
+        finally:
+            conf.task_always_eager, conf.task_eager_propagates = eager
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        results['gemini'] = {'calls': model.calls, 'prompt_tokens': model.prompt_tokens, 'output_tokens': model.output_tokens}
+        results['graph'] = {'calls': len(graph_api.calls), 'connections': graph_api.connections}
+        results['meta'] = {
+            'commit': self.commit(),
+            'timestamp': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'params': {k: options[k] for k in ('clients', 'campaigns', 'days', 'per_day', 'window', 'tick',
+                                               'gemini_latency', 'graph_latency', 'processing', 'graph_rate')},
+        }
+        self.report(results, baseline)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(f"Saved to {options['output']}")
+
+    # --- the pipeline ---
+
+    def run_pipeline(self, options):
+        results = {}
+        with self.phase(results, 'seed') as stats:
+            campaigns = self.seed(options)
+            stats['posts'] = 0
+
+        with self.phase(results, 'initialize') as stats:
+            for campaign in campaigns:
+                tasks.initialize_campaign_posts(campaign.id)
+            stats['posts'] = Post.objects.filter(campaign__in=campaigns).count()
+
+        with self.phase(results, 'generate') as stats:
+            # The pump admits BULK_MAX_IN_FLIGHT at a time; beat would keep calling it
+            while Post.objects.filter(tasks.BULK_PENDING).exists():
+                if not tasks.admit_bulk_generation():
+                    break
+            stats['posts'] = Post.objects.filter(campaign__in=campaigns, status='approved').count()
+
+        self.compress_schedule(campaigns, options['window'])
+
+        with self.phase(results, 'publish') as stats:
+            deadline = time.monotonic() + options['window'] + 60
+            pending = Post.objects.filter(campaign__in=campaigns, status__in=['approved', 'publishing'])
+            while pending.exists() and time.monotonic() < deadline:
+                tasks.check_schedule()
+                time.sleep(options['tick'])
+            stats['posts'] = Post.objects.filter(campaign__in=campaigns, status='posted').count()
+            stats['errors'] = Post.objects.filter(campaign__in=campaigns, status='error').count()
+
+        results['lag'] = {
+            'p50': percentile(self.lags, 50), 'p99': percentile(self.lags, 99),
+            'max': max(self.lags, default=None), 'mean': statistics.fmean(self.lags) if self.lags else None,
+        }
+        return results
+
+    def seed(self, options):
+        today = timezone.localdate()
+        pool = io.BytesIO()
+        Image.new('RGB', (1080, 1080), 'orange').save(pool, 'PNG')
+        campaigns = []
+        for c in range(options['clients']):
+            user = User.objects.create(username=f"bench-{time.monotonic_ns()}-{c}")
+            client = Client.objects.create(
+                user=user, company_name=f"Bench Co {c}", company_bio="A neighbourhood bakery since 1998.",
+                instagram_access_token=f"token-{c}", instagram_business_id=f"1784140000000{c:04d}",
+            )
+            for m in range(options['campaigns']):
+                campaign = Campaign.objects.create(
+                    client=client, name=f"Bench {c}-{m}", type='bio', posts_per_day=options['per_day'],
+                    start_date=today + timedelta(days=1), end_date=today + timedelta(days=options['days']),
+                    interval_hours=1, auto_approve=True,
+                )
+                image = CampaignImage(campaign=campaign)
+                image.image.save('pool.png', ContentFile(pool.getvalue()))
+                campaigns.append(campaign)
+        return campaigns
+
+    def compress_schedule(self, campaigns, window):
+        """Moves every approved post into the next `window` seconds, in schedule order."""
+        posts = list(Post.objects.filter(campaign__in=campaigns, status='approved').order_by('scheduled_time', 'id'))
+        start = timezone.now() + timedelta(seconds=0.5)
+        for i, post in enumerate(posts):
+            post.scheduled_time = start + timedelta(seconds=window * i / max(len(posts), 1))
+        Post.objects.bulk_update(posts, ['scheduled_time'], batch_size=500)
+
+    @contextmanager
+    def phase(self, results, name):
+        stats = {}
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            yield stats
+        seconds = time.perf_counter() - started
+        stats.update({
+            'seconds': round(seconds, 3),
+            'queries': counter.count,
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        })
+        if stats.get('posts'):
+            stats['posts_per_second'] = round(stats['posts'] / seconds, 1)
+            stats['queries_per_post'] = round(counter.count / stats['posts'], 2)
+        results[name] = stats
+
+    # --- output ---
+
+    @staticmethod
+    def commit():
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                  capture_output=True, text=True, timeout=5).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    def report(self, results, baseline):
+        self.stdout.write(f"{'phase':<11} {'posts':>7} {'seconds':>8} {'posts/s':>9} {'queries':>8} {'q/post':>7} {'RSS MB':>7}")
+        for name in ('seed', 'initialize', 'generate', 'publish'):
+            s = results[name]
+            self.stdout.write(
+                f"{name:<11} {s['posts']:>7} {s['seconds']:>8.2f} {s.get('posts_per_second', 0):>9.1f} "
+                f"{s['queries']:>8} {s.get('queries_per_post', 0):>7.2f} {s['peak_rss_mb']:>7.1f}"
+            )
+        lag = results['lag']
+        if lag['p50'] is not None:
+            self.stdout.write(f"schedule->publish lag: p50 {lag['p50']:.2f}s | p99 {lag['p99']:.2f}s | max {lag['max']:.2f}s")
+        self.stdout.write(
+            f"errors: {results['publish']['errors']} | gemini calls: {results['gemini']['calls']} | "
+            f"graph calls: {results['graph']['calls']} over {results['graph']['connections']} connections"
+        )
+        if baseline:
+            self.stdout.write(f"\nvs {baseline.get('meta', {}).get('commit') or 'baseline'}:")
+            if baseline.get('meta', {}).get('params') != results['meta']['params']:
+                self.stdout.write(self.style.WARNING("  (run with different parameters, numbers are not comparable)"))
+            for key, label, higher_is_better in HEADLINE:
+                old, new = self.lookup(baseline, key), self.lookup(results, key)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                better = change > 0 if higher_is_better else change < 0
+                verdict = 'same' if abs(change) < 0.02 else ('better' if better else 'WORSE')
+                self.stdout.write(f"  {label:<22} {old:>10.2f} -> {new:>10.2f} ({change:+.0%}, {verdict})")
+
+    @staticmethod
+    def lookup(results, key):
+        value = results
+        for part in key.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
@@ -0,0 +1,79 @@
+import logging
+import random
+import time
+from datetime import datetime, time as dtime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import planner
+from core.models import Campaign
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the schedule planner in memory: plans --campaigns overlapping campaigns "
+        "(spread over --clients clients, all starting on the same few hours) for --days days "
+        "against each client's one-off posts, then checks the spacing. No database access."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--campaigns', type=int, default=100)
+        parser.add_argument('--clients', type=int, default=25)
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--per-day', type=int, default=3)
+        parser.add_argument('--one-off', type=int, default=200, help="Existing one-off posts per client.")
+        parser.add_argument('--spacing', type=int, default=15, help="Minimum minutes between a client's posts.")
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        o = options
+        self.stdout.write(
+            f"{o['campaigns']} campaigns x {o['days']} days x {o['per_day']}/day over {o['clients']} clients, "
+            f"{o['one_off']} one-off posts each, spacing {o['spacing']} min"
+        )
+        # The planner logs every campaign with slots it couldn't space out; they are counted below
+        logging.getLogger('core.planner').setLevel(logging.ERROR)
+        for run in range(o['repeat']):
+            rng = random.Random(o['seed'])
+            campaigns, existing = self.seed(rng, o)
+            started = time.perf_counter()
+            indexes = {c: planner.ScheduleIndex(times, spacing=o['spacing']) for c, times in existing.items()}
+            slots = [(campaign, planner.plan_campaign(campaign, indexes[campaign.client_id]))
+                     for campaign in campaigns]
+            elapsed = time.perf_counter() - started
+
+            planned = sum(len(s) for _, s in slots)
+            moved = sum(
+                when.timestamp() != planner.slot_timestamp(when.astimezone(timezone.get_default_timezone()).date(),
+                                                           c.daily_start_time, timedelta(hours=i * c.interval_hours))
+                for c, s in slots for i, when in s
+            )
+            crowded = sum(b - a < o['spacing'] * 60 for index in indexes.values()
+                          for a, b in zip(index.times, index.times[1:]))
+            self.stdout.write(
+                f"run {run + 1}: planned {planned:,} slots in {elapsed * 1000:.0f} ms "
+                f"({planned / elapsed:,.0f} slots/sec) | moved {moved:,} | still too close {crowded:,}"
+            )
+
+    def seed(self, rng, o):
+        today = timezone.localdate()
+        campaigns = []
+        for n in range(o['campaigns']):
+            interval = rng.choice((1, 2, 3))
+            latest = min(23 - (o['per_day'] - 1) * interval, 12)
+            # Unsaved: the planner only reads the schedule fields
+            campaigns.append(Campaign(
+                id=n + 1, client_id=n % o['clients'] + 1, name=f"Bench {n}", posts_per_day=o['per_day'],
+                start_date=today + timedelta(days=rng.randrange(30)), end_date=today + timedelta(days=o['days'] - 1),
+                daily_start_time=dtime(rng.randint(8, max(8, latest)), 0), interval_hours=interval,
+            ))
+        # One-off posts on distinct half hours, so any pair closer than the spacing is the planner's
+        grid = [(d, h, m) for d in range(o['days']) for h in range(8, 21) for m in (0, 30)]
+        existing = {
+            c: [timezone.make_aware(datetime.combine(today + timedelta(days=d), dtime(h, m)))
+                for d, h, m in rng.sample(grid, o['one_off'])]
+            for c in range(1, o['clients'] + 1)
+        }
+        return campaigns, existing
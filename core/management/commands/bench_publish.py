@@ -0,0 +1,118 @@
+import heapq
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from core import graph
+from core.fakes import FakeGraphAPI
+from core.tasks import publish_poll_countdown
+
+PAGE_ID, TOKEN = '17841400000000000', 'bench-token'
+
+
+class SlotPool:
+    """
+    N worker slots pulling jobs off an ETA queue, like a Celery worker with
+    --concurrency=N. A job may return a countdown to be re-queued.
+    """
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.queue = []
+        self.pending = 0
+        self.busy_seconds = 0.0
+        self.cond = threading.Condition()
+
+    def submit(self, job, countdown=0.0):
+        with self.cond:
+            heapq.heappush(self.queue, (time.monotonic() + countdown, id(job), job))
+            self.pending += 1
+            self.cond.notify()
+
+    def run(self):
+        workers = [threading.Thread(target=self._work) for _ in range(self.slots)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while True:
+                    if not self.pending:
+                        self.cond.notify_all()
+                        return
+                    if self.queue and self.queue[0][0] <= time.monotonic():
+                        _, _, job = heapq.heappop(self.queue)
+                        break
+                    timeout = self.queue[0][0] - time.monotonic() if self.queue else None
+                    self.cond.wait(timeout)
+
+            start = time.perf_counter()
+            countdown = job()
+            with self.cond:
+                self.busy_seconds += time.perf_counter() - start
+                self.pending -= 1
+            if countdown is not None:
+                self.submit(job, countdown)
+
+
+class Command(BaseCommand):
+    help = "Compares publish throughput of the old sleep-based task with the two-phase container flow, against a local fake Graph API."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=40)
+        parser.add_argument('--slots', type=int, default=4, help="Worker concurrency.")
+        parser.add_argument('--processing', type=float, default=3.0, help="Seconds Meta takes to process a container.")
+        parser.add_argument('--legacy-sleep', type=float, default=None, help="Fixed sleep of the old task (defaults to --processing).")
+        parser.add_argument('--graph-rate', type=float, default=1000.0,
+                            help="Graph calls/sec per access token (GRAPH_API_RATE_PER_TOKEN); every job shares one token.")
+
+    def handle(self, *args, **options):
+        posts, slots, processing = options['posts'], options['slots'], options['processing']
+        legacy_sleep = options['legacy_sleep'] if options['legacy_sleep'] is not None else processing
+
+        with FakeGraphAPI(processing_seconds=processing, latency=0.02) as fake, \
+                override_settings(GRAPH_API_URL=fake.url, GRAPH_API_RATE_PER_TOKEN=options['graph_rate'],
+                                  PUBLISH_POLL_DELAY=processing / 4,
+                                  PUBLISH_POLL_MAX_DELAY=processing):
+            self.stdout.write(f"{posts} posts, {slots} worker slots, {processing}s container processing")
+            self._report("legacy (sleep)", *self._run(posts, slots, lambda: self._legacy_job(legacy_sleep)))
+            self._report("two-phase     ", *self._run(posts, slots, self._two_phase_job))
+
+    def _run(self, posts, slots, make_job):
+        pool = SlotPool(slots)
+        for _ in range(posts):
+            pool.submit(make_job())
+        start = time.perf_counter()
+        pool.run()
+        return posts, time.perf_counter() - start, pool.busy_seconds
+
+    def _report(self, label, posts, wall, busy):
+        self.stdout.write(
+            f"{label}: {posts / wall * 60:7.1f} posts/min | "
+            f"{busy / posts:6.2f} slot-seconds/post | wall {wall:.1f}s"
+        )
+
+    def _legacy_job(self, sleep):
+        def job():
+            container_id = graph.create_media_container(PAGE_ID, TOKEN, 'https://example.com/a.jpg', 'caption')
+            time.sleep(sleep)
+            graph.publish_media_container(PAGE_ID, TOKEN, container_id)
+        return job
+
+    def _two_phase_job(self):
+        state = {'container': None, 'retries': 0}
+
+        def job():
+            if state['container'] is None:
+                state['container'] = graph.create_media_container(PAGE_ID, TOKEN, 'https://example.com/a.jpg', 'caption')
+                return publish_poll_countdown(0)
+            if graph.get_container_status(state['container'], TOKEN) == 'IN_PROGRESS':
+                state['retries'] += 1
+                return publish_poll_countdown(state['retries'])
+            graph.publish_media_container(PAGE_ID, TOKEN, state['container'])
+        return job
@@ -0,0 +1,72 @@
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# How each kind of process starts, up to the point where it would begin serving
+TARGETS = {
+    'manage.py': ['manage.py', 'check'],
+    'beat': ['-c', "from config.celery import app; app.loader.import_default_modules(); app.finalize()"],
+}
+
+# "import time: self [us] | cumulative | imported package", nesting shown by indentation
+LINE_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def import_profile(args):
+    """(wall seconds, {top-level module: cumulative seconds}, every module imported) of one cold start."""
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE, 'PYTHONWARNINGS': 'ignore'}
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=settings.BASE_DIR, env=env,
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if result.returncode:
+        raise CommandError(f"{' '.join(args)} failed:\n{result.stderr[-2000:]}")
+    top, modules = {}, set()
+    for line in result.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            _, cumulative, indent, name = match.groups()
+            modules.add(name)
+            if len(indent) == 1:
+                top[name] = int(cumulative) / 1e6
+    return wall, top, modules
+
+
+class Command(BaseCommand):
+    help = (
+        "Cold-start import profile (python -X importtime) of manage.py and of the Celery beat "
+        "process. Fails if a --forbid module (the Gemini SDK by default) is imported at startup "
+        "or, with --budget-ms, if the median import time goes over budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--top', type=int, default=5, help="Slowest top-level imports to list.")
+        parser.add_argument('--budget-ms', type=float, help="Fail if the median import time of a target is above this.")
+        parser.add_argument('--forbid', nargs='*', default=['google.generativeai'],
+                            help="Modules that must not be imported at startup.")
+
+    def handle(self, *args, **options):
+        failures = []
+        for target, argv in TARGETS.items():
+            runs = [import_profile(argv) for _ in range(options['repeat'])]
+            imports = statistics.median(sum(top.values()) for _, top, _ in runs)
+            wall = statistics.median(w for w, _, _ in runs)
+            self.stdout.write(f"{target}: imports {imports * 1000:.0f} ms | process {wall * 1000:.0f} ms (median of {len(runs)})")
+            _, top, modules = min(runs, key=lambda r: r[0])
+            for name, seconds in sorted(top.items(), key=lambda item: -item[1])[:options['top']]:
+                self.stdout.write(f"  {seconds * 1000:7.1f} ms  {name}")
+
+            loaded = [name for name in options['forbid'] if name in modules]
+            if loaded:
+                failures.append(f"{target} imports {', '.join(loaded)} at startup")
+            if options['budget_ms'] is not None and imports * 1000 > options['budget_ms']:
+                failures.append(f"{target} imports take {imports * 1000:.0f} ms (budget {options['budget_ms']:.0f} ms)")
+        if failures:
+            raise CommandError("; ".join(failures))
@@ -0,0 +1,99 @@
+import os
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Post, CampaignImage, MediaBlob
+from core.storage import blob_storage, is_blob
+
+# (model, legacy upload folder) pairs that live in the blob store
+BLOB_FIELDS = ((Post, 'post_images/'), (CampaignImage, 'campaign_pool/'))
+
+
+class Command(BaseCommand):
+    help = "Moves existing post/campaign images into the content-addressed store, deduplicates them and rebuilds reference counts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would happen.")
+        parser.add_argument('--keep-originals', action='store_true', help="Don't delete the legacy copies after migrating.")
+        parser.add_argument('--purge-orphans', action='store_true', help="Also delete legacy files no row points at.")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        migrated, missing, freed = 0, 0, 0
+        replaced = []
+
+        for model, _ in BLOB_FIELDS:
+            names = (model.objects.exclude(image='').exclude(image__isnull=True)
+                     .values_list('image', flat=True).distinct())
+            for name in list(names):
+                if is_blob(name):
+                    continue
+                if not blob_storage.exists(name):
+                    self.stderr.write(f"Missing file, left as is: {name}")
+                    missing += 1
+                    continue
+                if dry_run:
+                    migrated += 1
+                    continue
+                with blob_storage.open(name) as fh:
+                    new_name = blob_storage.save(name, fh)
+                model.objects.filter(image=name).update(image=new_name)
+                replaced.append(name)
+                migrated += 1
+
+        if not dry_run:
+            self._rebuild_ref_counts()
+            if not options['keep_originals']:
+                freed += self._delete(replaced)
+
+        if options['purge_orphans']:
+            orphans = self._orphans()
+            if dry_run:
+                self.stdout.write(f"Would purge {len(orphans)} orphaned files")
+            else:
+                freed += self._delete(orphans)
+
+        verb = "Would migrate" if dry_run else "Migrated"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {migrated} files ({missing} missing), {MediaBlob.objects.count()} blobs, {freed / 1e6:.1f} MB freed"
+        ))
+
+    @transaction.atomic
+    def _rebuild_ref_counts(self):
+        counts = Counter()
+        for model, _ in BLOB_FIELDS:
+            counts.update(n for n in model.objects.values_list('image', flat=True) if is_blob(n))
+
+        MediaBlob.objects.exclude(name__in=counts).delete()
+        existing = {b.name: b for b in MediaBlob.objects.all()}
+        for name, count in counts.items():
+            blob = existing.get(name) or MediaBlob(
+                name=name,
+                digest=os.path.splitext(os.path.basename(name))[0],
+                size=blob_storage.size(name),
+            )
+            blob.ref_count = count
+            blob.save()
+
+    def _orphans(self):
+        referenced = set()
+        for model, _ in BLOB_FIELDS:
+            referenced.update(model.objects.values_list('image', flat=True))
+        orphans = []
+        for _, folder in BLOB_FIELDS:
+            for root, _, files in os.walk(blob_storage.path(folder)):
+                for filename in files:
+                    rel = os.path.relpath(os.path.join(root, filename), blob_storage.location).replace(os.sep, '/')
+                    if rel not in referenced:
+                        orphans.append(rel)
+        return orphans
+
+    def _delete(self, names):
+        freed = 0
+        for name in names:
+            if blob_storage.exists(name):
+                freed += blob_storage.size(name)
+                blob_storage.delete(name)
+        return freed
@@ -0,0 +1,149 @@
+"""
+Media delivery for the dashboard and for Meta's crawler.
+
+Django only decides *whether* a file may be sent and with which cache
+headers; with MEDIA_ACCEL set, the front server (nginx X-Accel-Redirect or
+Apache/lighttpd X-Sendfile) streams the bytes, so a slow download never
+holds an app worker. Without it (local development), files are streamed
+with FileResponse, answering conditional GETs with 304 and single byte
+ranges with 206.
+
+Meta fetches through signed_url(): a short-lived HMAC-signed link that works
+without a session, so /media/ itself can stay behind the login.
+"""
+import mimetypes
+import os
+import re
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import http_date
+from django.utils._os import safe_join
+
+from .storage import BLOB_PREFIX
+
+# Content-addressed: a name never gets different bytes, so it can be kept for good
+IMMUTABLE = 'max-age=31536000, immutable'
+# Derivatives are re-rendered in place if the variant rules change
+DERIVATIVE = 'max-age=86400'
+# Anything else (logos, legacy uploads) can be replaced under the same name: always revalidate
+MUTABLE = 'no-cache'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def cache_control(name, public=False):
+    """
+    Cache-Control for `name`. Only `public` responses (signed links, which anyone
+    holding the URL may fetch) may be kept by shared caches; login-gated ones are
+    private to the browser.
+    """
+    if name.startswith(BLOB_PREFIX):
+        lifetime = IMMUTABLE
+    elif name.startswith('derivatives/'):
+        lifetime = DERIVATIVE
+    else:
+        lifetime = MUTABLE
+    return f"{'public' if public else 'private'}, {lifetime}"
+
+
+def signature(name, expires):
+    return salted_hmac('core.media.signed_url', f"{name}:{expires}").hexdigest()[:32]
+
+
+def signed_url(name, ttl=None):
+    """Absolute URL Meta can fetch `name` from for the next `ttl` seconds (MEDIA_SIGNED_URL_TTL)."""
+    expires = int(time.time()) + (ttl or settings.MEDIA_SIGNED_URL_TTL)
+    path = reverse('signed_media', args=[expires, signature(name, expires), name])
+    return f"{settings.PUBLIC_BASE_URL}{path}"
+
+
+def check_signature(name, expires, sig):
+    return expires >= time.time() and constant_time_compare(sig, signature(name, expires))
+
+
+def serve(request, name, public=False):
+    """Response for one media file: offloaded, 304, 206 or a streamed 200 (see cache_control for `public`)."""
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise Http404
+    if not os.path.isfile(path):
+        raise Http404
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    if settings.MEDIA_ACCEL == 'nginx':
+        # The front server handles conditionals and ranges for files it serves itself
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(name)
+    elif settings.MEDIA_ACCEL == 'sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+    else:
+        response = stream(request, path, stat, content_type)
+    response['Cache-Control'] = cache_control(name, public)
+    return response
+
+
+def stream(request, path, stat, content_type):
+    """The local fallback: conditional GET, single byte ranges, else the whole file."""
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        return not_modified
+
+    byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+    # A stale If-Range means the client's partial copy is useless: send everything
+    if byte_range and request.headers.get('If-Range', etag) != etag:
+        byte_range = None
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(read_range(path, start, end), status=206, content_type=content_type)
+        response['Content-Range'] = f"bytes {start}-{end}/{stat.st_size}"
+        response['Content-Length'] = str(end - start + 1)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single satisfiable `bytes=` range, else None."""
+    match = RANGE_RE.match(header or '')
+    if not match or size == 0:
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    elif last:
+        start, end = max(size - int(last), 0), size - 1  # the last N bytes
+    else:
+        return None
+    return (start, end) if start <= end else None
+
+
+def read_range(path, start, end):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = fh.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,248 @@
+"""
+Pipeline metrics in the Prometheus text format, served from /metrics.
+
+Every process (web, each Celery prefork child) counts in memory and writes a
+snapshot to METRICS_DIR/<pid>.json at most every METRICS_FLUSH_INTERVAL
+seconds. The endpoint adds all snapshots up, so counters cover every worker.
+Snapshots of processes that have exited are deleted at scrape time, which
+keeps the directory at one file per live process; Prometheus sees the drop
+as an ordinary counter reset. Gauges (posts per status, due backlog) are
+read from the database at scrape time instead.
+"""
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown
+from django.conf import settings
+from django.db.models import Count, Min
+from django.utils import timezone
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 4 * 3600, 24 * 3600)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'postx_task_duration_seconds': ('histogram', 'Celery task run time.', LATENCY_BUCKETS),
+    'postx_posts_claimed_total': ('counter', 'Posts claimed by check_schedule, per stage.', None),
+    'postx_posts_created_total': ('counter', 'Campaign posts materialized by initialize_campaign_posts.', None),
+    'postx_captions_total': ('counter', 'Caption generation results, per outcome.', None),
+    'postx_gemini_request_seconds': ('histogram', 'Gemini request latency (cache hits excluded).', LATENCY_BUCKETS),
+    'postx_caption_cache_lookups_total': ('counter', 'Caption cache lookups, per backend and result (hit/miss).', None),
+    'postx_graph_requests_total': ('counter', 'Graph API responses, per endpoint and HTTP status.', None),
+    'postx_graph_request_seconds': ('histogram', 'Graph API request latency.', LATENCY_BUCKETS),
+    'postx_publish_lag_seconds': ('histogram', 'Delay between scheduled_time and the post going live.', LAG_BUCKETS),
+    'postx_publish_total': ('counter', 'Publish attempts that finished, per outcome.', None),
+    'postx_publish_deferred_total': ('counter', 'Claimed publishes deferred by the per-account 24h publishing quota.', None),
+}
+
+
+class Registry:
+    """Counters and histograms of this process, keyed on (name, sorted label pairs)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+        self.last_flush = 0.0
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            # [per-bucket counts..., +Inf count, sum]
+            series = self.histograms.setdefault(key, [0] * (len(buckets) + 2))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(series)] for (name, labels), series in self.histograms.items()],
+            }
+
+    def flush(self, force=False):
+        """Writes this process' snapshot for the endpoint to pick up (atomically, via rename)."""
+        directory = settings.METRICS_DIR
+        now = time.monotonic()
+        if not directory or (not force and now - self.last_flush < settings.METRICS_FLUSH_INTERVAL):
+            return
+        self.last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(self.snapshot(), fh)
+        os.replace(tmp, os.path.join(directory, f"{os.getpid()}.json"))
+
+
+registry = Registry()
+# Forked workers must not inherit (and double count) the parent's numbers
+os.register_at_fork(after_in_child=registry.reset)
+
+
+def inc(name, amount=1, **labels):
+    registry.inc(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observes the block's duration in histogram `name`, labelled outcome=ok|error."""
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        observe(name, time.perf_counter() - started, outcome=outcome, **labels)
+
+
+# --- Celery: time every task, flush after each one ---
+
+_task_started = {}
+
+
+@task_prerun.connect
+def _start_task_timer(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _stop_task_timer(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        outcome = 'ok' if state in ('SUCCESS', 'RETRY') else 'error'
+        observe('postx_task_duration_seconds', time.perf_counter() - started,
+                task=task.name.rsplit('.', 1)[-1], outcome=outcome)
+    registry.flush()
+
+
+@worker_process_shutdown.connect
+def _flush_on_shutdown(**kwargs):
+    registry.flush(force=True)
+
+
+# --- Exposition ---
+
+def collect():
+    """Every process' counters and histograms added up."""
+    snapshots = [registry.snapshot()]
+    own = f"{os.getpid()}.json"
+    paths = glob.glob(os.path.join(settings.METRICS_DIR, '*.json')) if settings.METRICS_DIR else []
+    for path in paths:
+        if os.path.basename(path) == own:
+            continue  # our in-memory numbers are newer
+        if not _process_alive(os.path.basename(path)[:-len('.json')]):
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # another scrape got there first
+            continue
+        try:
+            with open(path) as fh:
+                snapshots.append(json.load(fh))
+        except (OSError, ValueError):
+            continue
+
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, series in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(series))
+            histograms[key] = [a + b for a, b in zip(total, series)]
+    return counters, histograms
+
+
+def _process_alive(pid):
+    """Whether the process that wrote snapshot `<pid>.json` is still running (on this host)."""
+    if os.name != 'posix' or not pid.isdigit():
+        return True  # os.kill(pid, 0) would terminate it on Windows
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # someone else's, but alive
+    return True
+
+
+def database_gauges(now=None):
+    """Posts per status, and how far behind the oldest due post in each queue is."""
+    from .models import Post
+
+    now = now or timezone.now()
+    per_status = dict.fromkeys((value for value, _ in Post.STATUS_CHOICES), 0)
+    for row in Post.objects.order_by().values('status').annotate(n=Count('id')):
+        per_status[row['status']] = row['n']
+
+    backlog = {}
+    for status in ('scheduled', 'approved'):
+        # Repeats the partial index condition, so this is an index lookup
+        oldest = Post.objects.filter(status=status, scheduled_time__lte=now).aggregate(m=Min('scheduled_time'))['m']
+        backlog[status] = (now - oldest).total_seconds() if oldest else 0
+    return per_status, backlog
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    """The full /metrics page."""
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        else:
+            for (metric, labels), series in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(buckets, series):
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(float(bound))),))} {count}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {series[-2]}")
+                lines.append(f"{name}_count{_labels(labels)} {series[-2]}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(float(series[-1]))}")
+
+    per_status, backlog = database_gauges()
+    lines += ["# HELP postx_posts Posts currently in each status.", "# TYPE postx_posts gauge"]
+    lines += [f'postx_posts{{status="{status}"}} {count}' for status, count in per_status.items()]
+    lines += ["# HELP postx_due_backlog_seconds Age of the oldest due post nobody has picked up yet.",
+              "# TYPE postx_due_backlog_seconds gauge"]
+    lines += [f'postx_due_backlog_seconds{{status="{status}"}} {_number(float(age))}' for status, age in backlog.items()]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_post_scheduler_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='ig_container_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_post_ig_container_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='status',
+            field=models.CharField(choices=[('draft', 'Draft'), ('scheduled', 'Scheduled (Waiting for AI)'), ('generating', 'Generating AI...'), ('waiting_approval', 'AI Done (Needs Review)'), ('regenerating', 'Rewriting Caption...'), ('approved', 'Approved (Queue to Post)'), ('publishing', 'Publishing in Progress...'), ('posted', 'Posted'), ('error', 'Error')], default='draft', max_length=20),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_campaign_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='dispatch_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='dispatch_token',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+    ]
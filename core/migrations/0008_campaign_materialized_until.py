@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+def mark_existing_campaigns(apps, schema_editor):
+    # Campaigns created before the rolling horizon already have every post
+    Campaign = apps.get_model('core', 'Campaign')
+    Campaign.objects.filter(post__isnull=False).distinct().update(materialized_until=models.F('end_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_post_dispatch_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='materialized_until',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(mark_existing_campaigns, migrations.RunPython.noop),
+    ]
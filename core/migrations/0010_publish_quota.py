@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_fragment_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublishQuotaUse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('business_id', models.CharField(max_length=100)),
+                ('used_at', models.DateTimeField()),
+                ('post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['business_id', 'used_at'], name='quota_use_idx')],
+            },
+        ),
+    ]
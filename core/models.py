@@ -1,7 +1,9 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
+from .storage import blob_storage
 import datetime
+import uuid
 class Client(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='client_profile')
     company_name = models.CharField(max_length=100)
@@ -32,11 +34,44 @@ class Campaign(models.Model):
     auto_approve = models.BooleanField(default=False, help_text="If checked, posts will be published without your review.")
     
     is_active = models.BooleanField(default=True)
+    # Rolling horizon: posts exist up to this day; extend_campaign_horizons adds the rest later
+    materialized_until = models.DateField(null=True, blank=True, editable=False)
+    # Bumped on every change; the dashboard caches the campaign card under it
+    version = models.PositiveIntegerField(default=0, editable=False)
     def __str__(self): return self.name
 
 class CampaignImage(models.Model):
     campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to='campaign_pool/')
+    image = models.ImageField(upload_to='campaign_pool/', storage=blob_storage)
+
+class CampaignUpload(models.Model):
+    """One file streamed into a campaign's image pool, chunk by chunk, then checked by a worker."""
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('duplicate', 'Duplicate'),
+        ('rejected', 'Rejected'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, related_name='uploads')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    error = models.CharField(max_length=255, blank=True)
+    image = models.ForeignKey(CampaignImage, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    def __str__(self): return f"{self.filename} ({self.status})"
+
+class MediaBlob(models.Model):
+    """One physical file in the content-addressed store, shared by every row that uses it."""
+    digest = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    def __str__(self): return f"{self.name} ({self.ref_count} refs)"
 
 class Post(models.Model):
     STATUS_CHOICES = [
@@ -44,18 +79,55 @@ class Post(models.Model):
         ('scheduled', 'Scheduled (Waiting for AI)'),
         ('generating', 'Generating AI...'),
         ('waiting_approval', 'AI Done (Needs Review)'),
+        ('regenerating', 'Rewriting Caption...'),
         ('approved', 'Approved (Queue to Post)'),
         ('publishing', 'Publishing in Progress...'), # <--- ADD THIS
         ('posted', 'Posted'),
         ('error', 'Error'),
     ]
+    # What a caption task may take over: posts still waiting for their caption, or claimed for it
+    GENERATABLE = ('scheduled', 'generating')
+
     client = models.ForeignKey(Client, on_delete=models.CASCADE)
     campaign = models.ForeignKey(Campaign, on_delete=models.SET_NULL, null=True, blank=True)
     news_update = models.TextField()
-    image = models.ImageField(upload_to='post_images/', blank=True, null=True)
+    image = models.ImageField(upload_to='post_images/', storage=blob_storage, blank=True, null=True)
     scheduled_time = models.DateTimeField()
     requires_approval = models.BooleanField(default=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
     generated_caption = models.TextField(blank=True, null=True)
-    
-    def __str__(self): return f"{self.client.company_name} - {self.status}"
\ No newline at end of file
+    # Instagram media container created by phase 1 of the publish
+    ig_container_id = models.CharField(max_length=64, blank=True, null=True)
+    # ETA dispatch: the pending timer task only acts if its token still matches,
+    # and dispatch_at is the scheduled_time it was armed for (a reschedule re-arms)
+    dispatch_token = models.UUIDField(null=True, blank=True, editable=False)
+    dispatch_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # When a worker last took the post ('generating' / 'publishing'), so stuck claims can be found
+    claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Bumped whenever something the dashboard card shows changes (see signals.bump_version)
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # check_schedule: status = X AND scheduled_time <= now ORDER BY scheduled_time.
+            # Partial, so they only hold the posts still waiting on the scheduler.
+            models.Index(fields=['scheduled_time'], condition=models.Q(status='scheduled'), name='post_due_ai_idx'),
+            models.Index(fields=['scheduled_time'], condition=models.Q(status='approved'), name='post_due_publish_idx'),
+            # Dashboard: one client's timeline ordered by time
+            models.Index(fields=['client', 'scheduled_time'], name='post_client_sched_idx'),
+            # Dashboard: admin timeline over every client
+            models.Index(fields=['scheduled_time'], name='post_sched_idx'),
+        ]
+
+    def __str__(self): return f"{self.client.company_name} - {self.status}"
+class PublishQuotaUse(models.Model):
+    """One publish charged to an Instagram account's rolling 24h quota (see core.quota)."""
+    business_id = models.CharField(max_length=100)
+    used_at = models.DateTimeField()
+    # Refunded if this post's publish fails before Meta counted it
+    post = models.ForeignKey(Post, on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['business_id', 'used_at'], name='quota_use_idx')]
+
+    def __str__(self): return f"{self.business_id} @ {self.used_at}"
@@ -0,0 +1,138 @@
+"""
+Per-client schedule planning. Every post of a client (all its campaigns
+plus one-off posts) goes into a ScheduleIndex: a sorted list of UTC
+timestamps searched by bisection. A campaign's slots are planned against it
+in one pass, each pushed forward until it is SCHEDULE_MIN_SPACING_MINUTES
+away from everything already there, so overlapping campaigns can't stack
+posts into the same minute. The index is loaded with one query.
+
+    index, filled = load_index(campaign, first_day, last_day)
+    slots = plan_campaign(campaign, index, filled, first_day, last_day)
+
+Slots are wall-clock times in TIME_ZONE (daily_start_time + i * interval_hours
+on each day). A slot that falls into a DST gap moves forward by the gap, an
+ambiguous one (clocks going back) takes its first occurrence, and two slots
+that end up on the same instant that way are spaced like any other collision.
+"""
+import bisect
+import logging
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+
+def slot_timestamp(day, start, offset, tz=None):
+    """UTC timestamp of the wall-clock time `offset` after `start` on `day` in `tz` (default TIME_ZONE)."""
+    # fold=0: gaps resolve forward (with the offset from before the change), overlaps to the first pass
+    naive = datetime.combine(day, start) + offset
+    return naive.replace(tzinfo=tz or timezone.get_default_timezone()).timestamp()
+
+
+class ScheduleIndex:
+    """Sorted UTC timestamps of one client's posts; neighbours are found by bisection."""
+
+    def __init__(self, times=(), spacing=None):
+        minutes = settings.SCHEDULE_MIN_SPACING_MINUTES if spacing is None else spacing
+        self.spacing = minutes * 60
+        self.times = sorted(t.timestamp() for t in times)
+
+    def next_free(self, ts):
+        """
+        (earliest timestamp >= `ts` at least the spacing away from every indexed
+        post, its position in the index), for place().
+        """
+        times, spacing = self.times, self.spacing
+        i = bisect.bisect_left(times, ts)
+        if i and ts - times[i - 1] < spacing:
+            ts = times[i - 1] + spacing
+        while i < len(times) and times[i] - ts < spacing:
+            ts = times[i] + spacing
+            i += 1
+        return ts, i
+
+    def place(self, ts, latest):
+        """
+        Indexes the first free time from `ts` on and returns it, or indexes `ts`
+        itself and returns None if nothing is free before `latest`.
+        """
+        free, i = self.next_free(ts)
+        if free < latest:
+            self.times.insert(i, free)
+            return free
+        bisect.insort(self.times, ts)
+        return None
+
+
+def load_index(campaign, first_day, last_day):
+    """
+    (ScheduleIndex of the client's posts around first_day..last_day, sorted
+    timestamps of the campaign's own posts among them), from one query.
+    """
+    spacing = timedelta(minutes=settings.SCHEDULE_MIN_SPACING_MINUTES)
+    day_length = timedelta(hours=campaign.posts_per_day * campaign.interval_hours)
+    begin = timezone.make_aware(datetime.combine(first_day, time.min)) - spacing
+    end = timezone.make_aware(datetime.combine(last_day, campaign.daily_start_time) + day_length) + spacing
+    rows = Post.objects.filter(client_id=campaign.client_id, scheduled_time__gte=begin, scheduled_time__lt=end) \
+        .values_list('campaign_id', 'scheduled_time')
+    index = ScheduleIndex()
+    filled = []
+    for campaign_id, scheduled_time in rows:
+        index.times.append(scheduled_time.timestamp())
+        if campaign_id == campaign.id:
+            filled.append(scheduled_time.timestamp())
+    index.times.sort()
+    filled.sort()
+    return index, filled
+
+
+def plan_campaign(campaign, index, filled=(), first_day=None, last_day=None, not_before=None):
+    """
+    [(slot number within the day, aware scheduled_time), ...] for the campaign's
+    days first_day..last_day (default: the whole campaign), each added to `index`.
+
+    A slot owns the interval up to the next one: it is moved at most that far,
+    and a campaign post already inside it (`filled`, sorted timestamps) means the
+    slot exists and is left out, so re-planning a window never duplicates a post
+    that was moved. Slots at or before `not_before` are left out too. A slot with
+    no free time in its interval stays where it was and is logged.
+    """
+    first_day = max(first_day or campaign.start_date, campaign.start_date)
+    last_day = min(last_day or campaign.end_date, campaign.end_date)
+    start, per_day = campaign.daily_start_time, campaign.posts_per_day
+    step = campaign.interval_hours * 3600
+    cutoff = not_before.timestamp() if not_before else float('-inf')
+    tz = timezone.get_default_timezone()
+    slots, unresolved = [], 0
+
+    day = first_day
+    first = slot_timestamp(day, start, timedelta(), tz)
+    while day <= last_day:
+        following = slot_timestamp(day + timedelta(days=1), start, timedelta(), tz)
+        if following - first == 86400:
+            nominals = [first + i * step for i in range(per_day)]
+        else:
+            # The clocks change today: place every slot on the wall clock
+            nominals = [slot_timestamp(day, start, timedelta(seconds=i * step), tz) for i in range(per_day)]
+        for i, nominal in enumerate(nominals):
+            if nominal <= cutoff:
+                continue
+            if filled:
+                j = bisect.bisect_left(filled, nominal)
+                if j < len(filled) and filled[j] < nominal + step:
+                    continue
+            ts = index.place(nominal, nominal + step)
+            if ts is None:
+                ts = nominal
+                unresolved += 1
+            slots.append((i, datetime.fromtimestamp(ts, tz=dt_timezone.utc)))
+        day, first = day + timedelta(days=1), following
+
+    if unresolved:
+        logger.warning("⚠️ %d slots of %s had no free time and overlap other posts", unresolved, campaign.name,
+                       extra={'campaign_id': campaign.id, 'unresolved': unresolved})
+    return slots
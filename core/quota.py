@@ -0,0 +1,143 @@
+"""
+Instagram's content-publishing limit: each business account may publish
+INSTAGRAM_PUBLISH_QUOTA posts in any rolling 24 hours, and a publish past it
+fails only after the container has been uploaded. Every admitted publish is
+charged to its account as a PublishQuotaUse row, so counting an account's
+window is a range scan over at most a quota's worth of index entries.
+
+Claimed posts that don't fit go back to 'approved' with their timer
+(dispatch_at) set to the moment the window has room again: no Graph call is
+wasted and the other accounts keep publishing. Only a timer inside
+DISPATCH_HORIZON gets an ETA task; later ones are claimed by the
+check_schedule sweep once dispatch_at has passed. projected_delays() runs
+the same arithmetic ahead of time for the dashboard.
+
+    admitted, deferred = admit(post_ids)  # deferred: {post id: when}
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DateTimeField, F, Q, Value, When
+from django.utils import timezone
+
+from .models import Client, Post, PublishQuotaUse
+
+WINDOW = timedelta(hours=24)
+
+# Posts that will publish at their scheduled_time unless something holds them back
+QUEUED = Q(status='approved') | Q(status='scheduled', requires_approval=False)
+
+
+def project(used, pending, quota=None, window=WINDOW):
+    """
+    Publish times for `pending` (sorted earliest-allowed times) given `used`
+    (sorted times already charged): each goes at its own time, or as soon as
+    fewer than `quota` publishes fall in the `window` before it.
+    """
+    quota = quota or settings.INSTAGRAM_PUBLISH_QUOTA
+    times = list(used)
+    projected = []
+    for earliest in pending:
+        when = earliest
+        if len(times) >= quota:
+            when = max(when, times[-quota] + window)
+        times.append(when)
+        projected.append(when)
+    return projected
+
+
+def charged(accounts, now):
+    """{business id: sorted times of the publishes still inside the window}, from one query."""
+    used = {}
+    rows = PublishQuotaUse.objects.filter(business_id__in=accounts, used_at__gt=now - WINDOW) \
+        .order_by('used_at').values_list('business_id', 'used_at')
+    for business_id, used_at in rows:
+        used.setdefault(business_id, []).append(used_at)
+    return used
+
+
+def admit(post_ids, now=None):
+    """
+    Charges claimed ('publishing') posts to their accounts, oldest first.
+    Returns (admitted ids, {deferred id: when}); the deferred ones are back
+    in 'approved' with a fresh timer at `when`, armed if it is inside
+    DISPATCH_HORIZON.
+    """
+    now = now or timezone.now()
+    if not post_ids:
+        return [], {}
+    with transaction.atomic():
+        rows = list(Post.objects.filter(id__in=post_ids).order_by('scheduled_time', 'id')
+                    .values_list('id', 'client__instagram_business_id'))
+        by_account = {}
+        for post_id, business_id in rows:
+            by_account.setdefault(business_id, []).append(post_id)
+        # One admission at a time per account, or two workers could both take its last slot
+        list(Client.objects.select_for_update().filter(instagram_business_id__in=by_account).values_list('id'))
+        used = charged(by_account, now)
+
+        admitted, deferred = [], {}
+        for business_id, posts in by_account.items():
+            for post_id, when in zip(posts, project(used.get(business_id, []), [now] * len(posts))):
+                if when <= now:
+                    admitted.append(PublishQuotaUse(business_id=business_id, used_at=now, post_id=post_id))
+                else:
+                    deferred[post_id] = when
+        PublishQuotaUse.objects.bulk_create(admitted)
+        # One fresh token for the whole batch: it only has to outdate the posts' older timers
+        token = uuid.uuid4()
+        if deferred:
+            timers = Case(*(When(id=post_id, then=Value(when)) for post_id, when in deferred.items()),
+                          output_field=DateTimeField())
+            Post.objects.filter(id__in=deferred).update(status='approved', dispatch_at=timers,
+                                                        dispatch_token=token, version=F('version') + 1)
+
+    horizon = now + timedelta(seconds=settings.DISPATCH_HORIZON)
+    due = [(post_id, when) for post_id, when in deferred.items() if when <= horizon]
+    if due:
+        from .tasks import dispatch_post
+
+        def enqueue():
+            for post_id, when in due:
+                dispatch_post.apply_async((post_id, str(token)), eta=when)
+        transaction.on_commit(enqueue)
+    return [use.post_id for use in admitted], deferred
+
+
+def refund(post_id):
+    """A publish that failed never counted against Meta's limit: give its slot back."""
+    PublishQuotaUse.objects.filter(post_id=post_id).delete()
+
+
+def prune(now=None):
+    """Drops charges that have left the window."""
+    now = now or timezone.now()
+    PublishQuotaUse.objects.filter(used_at__lte=now - WINDOW).delete()
+
+
+def projected_delays(posts, until, now=None):
+    """
+    {post id: projected publish time} for the queued posts in `posts` due
+    before `until` that their account's quota will hold back.
+    """
+    now = now or timezone.now()
+    if until <= now:
+        return {}
+    queued = list(posts.filter(QUEUED, scheduled_time__lt=until).order_by('scheduled_time', 'id')
+                  .values_list('id', 'client__instagram_business_id', 'scheduled_time'))
+    if not queued:
+        return {}
+    by_account = {}
+    for post_id, business_id, scheduled_time in queued:
+        by_account.setdefault(business_id, []).append((post_id, max(scheduled_time, now)))
+    used = charged(by_account, now)
+
+    delays = {}
+    for business_id, posts in by_account.items():
+        earliest = [when for _, when in posts]
+        for (post_id, wanted), when in zip(posts, project(used.get(business_id, []), earliest)):
+            if when > wanted:
+                delays[post_id] = when
+    return delays
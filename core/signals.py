@@ -0,0 +1,126 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .models import Campaign, Client, Post, CampaignImage
+from .storage import acquire_blob, release_blob
+
+# Models whose `image` lives in the blob store and is reference counted
+BLOB_MODELS = (Post, CampaignImage)
+# Models whose dashboard fragments are cached under their `version`
+VERSIONED_MODELS = (Post, Campaign)
+# Parents whose name the post cards show: {model: (Post foreign key, name field)}
+CARD_LABELS = {Campaign: ('campaign', 'name'), Client: ('client', 'company_name')}
+
+
+def _image_name(instance):
+    # Read the raw value so a deferred `image` column doesn't trigger a query
+    value = instance.__dict__.get('image')
+    return getattr(value, 'name', value) or ''
+
+
+def count_bulk_references(instances):
+    """bulk_create() sends no signals: count the new references in one go."""
+    for name, count in Counter(_image_name(obj) for obj in instances).items():
+        acquire_blob(name, count)
+    for obj in instances:
+        obj._saved_image = _image_name(obj)
+
+
+@receiver(post_init)
+def remember_image(sender, instance, **kwargs):
+    if sender not in BLOB_MODELS:
+        return
+    if not instance.pk:
+        instance._saved_image = ''
+    elif 'image' in instance.__dict__:
+        instance._saved_image = _image_name(instance)
+    else:
+        instance._saved_image = None  # deferred, looked up only if needed
+
+
+@receiver(post_save)
+def count_image_reference(sender, instance, created, **kwargs):
+    if sender not in BLOB_MODELS or 'image' not in instance.__dict__:
+        return
+    old, new = instance._saved_image, _image_name(instance)
+    if old != new:
+        acquire_blob(new)
+        release_blob(old or '')
+        instance._saved_image = new
+        if new:
+            from .tasks import generate_image_variants
+            transaction.on_commit(lambda: generate_image_variants.delay(new))
+
+
+@receiver(pre_save)
+def bump_version(sender, instance, update_fields=None, **kwargs):
+    """
+    Every save() of an existing row moves its version on, so its cached
+    dashboard fragment is never served again. Done in the UPDATE itself:
+    two workers saving at once can't both write the same number. Bulk
+    .update() calls in tasks/bulk bump `version` alongside the status.
+    (A deleted post drops out of its day's key in timeline.group_by_day.)
+    """
+    if sender in VERSIONED_MODELS and not instance._state.adding and update_fields is None:
+        instance.version = F('version') + 1
+
+
+@receiver(post_save)
+def bump_version_partial(sender, instance, created, update_fields=None, **kwargs):
+    # save(update_fields=...) can't take an extra column from a receiver: bump it afterwards
+    if sender in VERSIONED_MODELS and not created and update_fields is not None and 'version' not in update_fields:
+        sender.objects.filter(pk=instance.pk).update(version=F('version') + 1)
+
+
+@receiver(post_init)
+def remember_card_label(sender, instance, **kwargs):
+    if sender in CARD_LABELS:
+        instance._saved_label = instance.__dict__.get(CARD_LABELS[sender][1])
+
+
+@receiver(post_save)
+def bump_cards_on_rename(sender, instance, created, **kwargs):
+    """
+    A post card (and so its day) is cached under the post's version only:
+    renaming its campaign or client moves the version of every post under
+    it on, in one UPDATE. Other saves (stop, restart, ...) leave them cached.
+    """
+    if sender not in CARD_LABELS or created:
+        return
+    fk, field = CARD_LABELS[sender]
+    if field not in instance.__dict__:
+        return
+    label = instance.__dict__[field]
+    if label != instance._saved_label:
+        Post.objects.filter(**{fk: instance}).update(version=F('version') + 1)
+        instance._saved_label = label
+
+
+@receiver(pre_delete)
+def resolve_image_before_delete(sender, instance, **kwargs):
+    if sender in BLOB_MODELS and instance._saved_image is None:
+        instance._saved_image = sender.objects.filter(pk=instance.pk).values_list('image', flat=True).first() or ''
+
+
+@receiver(post_delete)
+def drop_image_reference(sender, instance, **kwargs):
+    if sender in BLOB_MODELS:
+        release_blob(instance._saved_image)
+
+
+@receiver(connection_created)
+def enable_sqlite_wal(sender, connection, **kwargs):
+    """SQLite profile: put the database file in WAL mode the first time we connect to it."""
+    if connection.vendor != 'sqlite' or not settings.SQLITE_WAL or connection.is_in_memory_db():
+        return
+    with connection.cursor() as cursor:
+        # Persistent, so only a file that isn't in WAL yet is switched (that takes a write lock)
+        cursor.execute('PRAGMA journal_mode')
+        if cursor.fetchone()[0] != 'wal':
+            cursor.execute('PRAGMA journal_mode=WAL')
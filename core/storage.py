@@ -0,0 +1,74 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+# Every deduplicated file lives under this prefix as <prefix>/<aa>/<sha256><ext>
+BLOB_PREFIX = 'blobs/'
+
+
+@deconstructible(path='core.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores each file ONCE, named after the SHA-256 of its content.
+    Saving bytes that are already stored just returns the existing name,
+    so any number of Posts / CampaignImages can point at the same file.
+    """
+
+    def blob_name(self, digest, ext):
+        return f"{BLOB_PREFIX}{digest[:2]}/{digest}{ext.lower()}"
+
+    def _save(self, name, content):
+        hasher = hashlib.sha256()
+        for chunk in content.chunks():
+            hasher.update(chunk)
+        content.seek(0)
+
+        blob_name = self.blob_name(hasher.hexdigest(), os.path.splitext(name)[1])
+        if self.exists(blob_name):
+            return blob_name
+        return super()._save(blob_name, content)
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_PREFIX)
+
+
+def acquire_blob(name, count=1):
+    """Adds `count` references to a stored blob (non-blob names are ignored)."""
+    from .models import MediaBlob
+
+    if not is_blob(name) or count <= 0:
+        return
+    if MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + count):
+        return
+    try:
+        with transaction.atomic():
+            MediaBlob.objects.create(
+                name=name,
+                digest=os.path.splitext(os.path.basename(name))[0],
+                size=blob_storage.size(name) if blob_storage.exists(name) else 0,
+                ref_count=count,
+            )
+    except IntegrityError:
+        # Someone else created the row first
+        MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') + count)
+
+
+def release_blob(name, count=1):
+    """Drops `count` references; the file is deleted once nothing points at it."""
+    from .models import MediaBlob
+
+    if not is_blob(name) or count <= 0:
+        return
+    with transaction.atomic():
+        MediaBlob.objects.filter(name=name).update(ref_count=F('ref_count') - count)
+        deleted, _ = MediaBlob.objects.filter(name=name, ref_count__lte=0).delete()
+        if deleted:
+            transaction.on_commit(lambda: blob_storage.delete(name))
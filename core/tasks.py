@@ -1,109 +1,451 @@
-from celery import shared_task
+from celery import shared_task, group
+from celery.exceptions import Retry
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, Q, TextField, Value, When
 from django.utils import timezone
-from .models import Post, Campaign
-import google.generativeai as genai
-import requests
-import time
+from .models import Client, Post, Campaign, CampaignUpload
+from .signals import count_bulk_references
+from . import ai, async_ai, fairshare, graph, images, media, metrics, planner, quota, uploads
+import asyncio
+import logging
+import os
 import random
+import uuid
 from datetime import timedelta
-from datetime import timedelta, datetime
-from django.core.files.base import ContentFile
 
-# --- CONFIGURATION ---
-# ⚠️ REPLACE THIS WITH YOUR ACTUAL API KEY
-GEMINI_API_KEY = "upload it here"
-NGROK_URL = "https://janessa-unwedded-forrest.ngrok-free.dev"
-genai.configure(api_key=GEMINI_API_KEY)
+logger = logging.getLogger(__name__)
+
+# Due, and not held back to a later timer
+DUE = "scheduled_time <= %s AND (dispatch_at IS NULL OR dispatch_at <= %s)"
+
+
+def claim_due_posts(from_status, to_status, limit, now=None):
+    """
+    Atomically flips up to `limit` due posts from `from_status` to `to_status`
+    and returns the IDs that THIS caller won. Posts whose timer was pushed
+    back (quota.admit) wait for their dispatch_at.
+
+    It is a single UPDATE ... RETURNING statement, so overlapping beat ticks or
+    several schedulers can never claim the same post twice. On PostgreSQL the
+    inner SELECT also uses FOR UPDATE SKIP LOCKED so concurrent claimers skip
+    each other's rows instead of queueing behind them.
+    """
+    now = now or timezone.now()
+    now = connection.ops.adapt_datetimefield_value(now)
+    return _claim_posts(from_status, to_status, limit, DUE, [now, now])
+
+
+def claim_bulk_posts(client_id, limit):
+    """
+    Like claim_due_posts, for fair-share admission: flips up to `limit` of one
+    client's campaign posts that still wait for a caption (soonest first) to
+    'generating', whenever they are due.
+    """
+    return _claim_posts('scheduled', 'generating', limit,
+                        "client_id = %s AND campaign_id IS NOT NULL AND generated_caption IS NULL", [client_id])
+
+
+def _claim_posts(from_status, to_status, limit, where, where_params):
+    sql, params = claim_sql(from_status, to_status, limit, where, where_params)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def claim_sql(from_status, to_status, limit, where, where_params):
+    """(sql, params) of the claiming UPDATE ... RETURNING, also EXPLAINed by the query plan tests."""
+    table = connection.ops.quote_name(Post._meta.db_table)
+    campaigns = connection.ops.quote_name(Campaign._meta.db_table)
+    lock = " FOR UPDATE SKIP LOCKED" if connection.features.has_select_for_update_skip_locked else ""
+    # Posts of paused campaigns stay where they are until the campaign is resumed. A
+    # correlated check, so the planner doesn't turn it into an index OR over campaign_id
+    paused = f"NOT EXISTS (SELECT 1 FROM {campaigns} c WHERE c.id = {table}.campaign_id AND NOT c.is_active)"
+    sql = (
+        f"UPDATE {table} SET status = %s, version = version + 1, claimed_at = %s WHERE id IN ("
+        f"SELECT id FROM {table} WHERE status = %s AND {where} AND {paused} "
+        f"ORDER BY scheduled_time LIMIT %s{lock}"
+        f") AND status = %s RETURNING id"
+    )
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    params = [to_status, now, from_status, *where_params, limit, from_status]
+    return sql, params
+
+
+# status -> (claimed as, stage label) for posts whose scheduled_time has come
+DISPATCH_STAGES = {
+    'scheduled': ('generating', 'generate'),
+    'approved': ('publishing', 'publish'),
+}
+
+
+def arm_dispatch(posts, now=None):
+    """
+    Event-driven scheduling: every 'scheduled' / 'approved' post in `posts` that
+    is due within DISPATCH_HORIZON gets a fresh token and a dispatch_post task
+    with its scheduled_time as ETA (overdue ones fire right away). Later posts
+    are armed by the check_schedule sweep once they come into the horizon.
+    Re-arming just replaces the token, so the old timer becomes a no-op.
+    Returns the number of timers set.
+    """
+    now = now or timezone.now()
+    horizon = now + timedelta(seconds=settings.DISPATCH_HORIZON)
+    armed = []
+    for status in DISPATCH_STAGES:
+        # One status at a time so each query hits that status' partial index
+        batch = list(posts.filter(status=status, scheduled_time__lte=horizon).only('id', 'scheduled_time'))
+        for post in batch:
+            post.dispatch_token, post.dispatch_at = uuid.uuid4(), post.scheduled_time
+        Post.objects.bulk_update(batch, ['dispatch_token', 'dispatch_at'], batch_size=CAMPAIGN_BULK_CHUNK_SIZE)
+        armed += batch
+
+    def enqueue():
+        for post in armed:
+            dispatch_post.apply_async((post.id, str(post.dispatch_token)), eta=post.dispatch_at)
+    transaction.on_commit(enqueue)
+    return len(armed)
+
+
+@shared_task
+def dispatch_post(post_id, token):
+    """ETA timer of one post: claims it (same guarded flip as the sweep) and starts its next stage."""
+    post = Post.objects.filter(id=post_id, dispatch_token=token).values('status', 'scheduled_time').first()
+    if post is None or post['status'] not in DISPATCH_STAGES:
+        return None  # re-armed, edited, or already handled by someone else
+    if post['scheduled_time'] > timezone.now() + timedelta(seconds=settings.DISPATCH_EARLY_TOLERANCE):
+        return None  # rescheduled to later: the sweep arms it again
+
+    to_status, stage = DISPATCH_STAGES[post['status']]
+    claim = Post.objects.filter(Q(campaign__isnull=True) | Q(campaign__is_active=True),
+                                id=post_id, dispatch_token=token, status=post['status'])
+    if not claim.update(status=to_status, claimed_at=timezone.now(), version=F('version') + 1):
+        return None
+    metrics.inc('postx_posts_claimed_total', stage=stage)
+    if stage == 'generate':
+        dispatch_ai_generation([post_id], queue='generate')
+    elif quota.admit([post_id])[0]:
+        upload_to_facebook.delay(post_id)
+    else:
+        metrics.inc('postx_publish_deferred_total')
+        return 'deferred'
+    return stage
+
 
 @shared_task
 def check_schedule():
-    """Heartbeat: Only checks for AI Generation or Publishing."""
+    """
+    Reconciliation sweep (beat, every SCHEDULE_SWEEP_MINUTES): the ETA timers
+    do the real work; this claims anything overdue a timer missed and arms the
+    posts that have come into the dispatch horizon.
+    """
     now = timezone.now()
-    
+    batch_size = getattr(settings, 'SCHEDULER_BATCH_SIZE', 500)
+
     # 1. Trigger AI for Scheduled Posts
-    # Mark as 'generating' immediately to prevent double-AI
-    drafts = Post.objects.filter(status='scheduled', scheduled_time__lte=now)
-    for post in drafts:
-        post.status = 'generating' # <--- LOCK 1
-        post.save()
-        generate_ai_content.delay(post.id)
+    # Claimed as 'generating' in one statement to prevent double-AI
+    generating = claim_due_posts('scheduled', 'generating', batch_size, now) # <--- LOCK 1
+    dispatch_ai_generation(generating, queue='generate')  # due now: not behind the bulk backlog
 
     # 2. Publish Approved Posts
-    # Mark as 'publishing' immediately to prevent double-posting
-    ready = Post.objects.filter(status='approved', scheduled_time__lte=now)
-    for post in ready:
-        print(f"🔒 Locking Post #{post.id} to prevent double-post...")
-        post.status = 'publishing' # <--- LOCK 2
-        post.save()
-        upload_to_facebook.delay(post.id)
+    # Claimed as 'publishing' in one statement to prevent double-posting
+    publishing = claim_due_posts('approved', 'publishing', batch_size, now) # <--- LOCK 2
+    # Only as many as each account's 24h quota allows; the rest get a timer for when it has room
+    quota.prune(now)
+    publishing, deferred = quota.admit(publishing, now)
+    for post_id in publishing:
+        upload_to_facebook.delay(post_id)
+
+    # 3. Timers for future posts that are now inside the horizon (new, or rescheduled since)
+    unarmed = Q(dispatch_at__isnull=True) | ~Q(dispatch_at=F('scheduled_time'))
+    armed = arm_dispatch(Post.objects.filter(unarmed, scheduled_time__gt=now), now)
+
+    metrics.inc('postx_posts_claimed_total', len(generating), stage='generate')
+    metrics.inc('postx_posts_claimed_total', len(publishing), stage='publish')
+    metrics.inc('postx_publish_deferred_total', len(deferred))
+    if generating or publishing or deferred or armed:
+        logger.info("🔒 Claimed %d posts for AI and %d for publishing (%d deferred by quota), armed %d timers",
+                    len(generating), len(publishing), len(deferred), armed,
+                    extra={'generating': len(generating), 'publishing': len(publishing),
+                           'deferred': len(deferred), 'armed': armed})
+    return {'generating': len(generating), 'publishing': len(publishing), 'deferred': len(deferred), 'armed': armed}
+
+# --- BULK CAMPAIGN SETTINGS ---
+# Rows per INSERT when materializing a campaign
+CAMPAIGN_BULK_CHUNK_SIZE = 500
+# Posts per AI task when handing a campaign off to the generator
+AI_DISPATCH_CHUNK_SIZE = 25
+
+MARKETING_ANGLES = ["Values", "Unique Selling Point", "Customer Success", "Behind the Scenes", "Call to Action"]
+
+
+def build_campaign_schedule(campaign, campaign_images=None, index=None, filled=(), first_day=None, last_day=None, not_before=None):
+    """
+    Computes the Posts of the campaign in memory (nothing is saved), for the
+    days first_day..last_day (default: the whole campaign). Times come from
+    planner.plan_campaign against `index` (the client's other posts; none by
+    default): slots that already have a post in `filled` are left out, and so
+    are slots at or before `not_before`.
+    """
+    if campaign_images is None:
+        campaign_images = list(campaign.images.all())
+    if index is None:
+        index = planner.ScheduleIndex()
+
+    posts = []
+    for i, post_time in planner.plan_campaign(campaign, index, filled, first_day, last_day, not_before):
+
+        # Content Logic
+        if campaign.type == 'topic':
+            news_text = f"Series '{campaign.name}' - Post {i+1}: {campaign.topic_prompt}"
+        else:
+            angle = MARKETING_ANGLES[i % len(MARKETING_ANGLES)]
+            news_text = f"General Awareness ({angle})"
+
+        new_post = Post(
+            client=campaign.client,
+            campaign=campaign,
+            news_update=news_text,
+            scheduled_time=post_time,
+            # INHERIT APPROVAL SETTING from Campaign
+            requires_approval=not campaign.auto_approve,
+            status='scheduled' # Ready for AI to pick it up when time comes
+        )
+
+        # Assign Image (Shuffle Logic)
+        if campaign_images:
+            chosen_image = random.choice(campaign_images)
+            # Point at the shared blob - its reference count keeps the file
+            # alive if the campaign (and its pool) is deleted later
+            new_post.image = chosen_image.image.name
+
+        # If no images, we leave it empty (fallback to Logo later)
+        posts.append(new_post)
+
+    return posts
+
+
+def horizon_end(campaign, today=None):
+    """Last day that should have posts by now: CAMPAIGN_HORIZON_DAYS ahead, or the whole campaign if 0."""
+    if not settings.CAMPAIGN_HORIZON_DAYS:
+        return campaign.end_date
+    today = today or timezone.localdate()
+    return min(campaign.end_date, today + timedelta(days=settings.CAMPAIGN_HORIZON_DAYS))
+
+
+def materialize_campaign_posts(campaign, until=None, now=None):
+    """
+    Writes the campaign schedule from where it stopped (materialized_until) up to
+    `until` (default: horizon_end) with chunked bulk_create inside ONE transaction.
+    Safe to re-run: slots that already exist are skipped, so a worker that died
+    halfway simply picks up where the rolled-back transaction left off. Once a
+    campaign has posts, later windows never add slots that are already past.
+    Returns the number of rows created.
+    """
+    now = now or timezone.now()
+    until = until or horizon_end(campaign, timezone.localdate(now))
+    first_day = campaign.start_date
+    not_before = None
+    if campaign.materialized_until:
+        first_day = max(first_day, campaign.materialized_until + timedelta(days=1))
+        not_before = now
+    if first_day > until:
+        return 0
+
+    with transaction.atomic():
+        # One planner at a time per client, or two campaigns could take the same free slot
+        list(Client.objects.select_for_update().filter(id=campaign.client_id).values_list('id'))
+        index, filled = planner.load_index(campaign, first_day, until)
+        posts = build_campaign_schedule(campaign, index=index, filled=filled, first_day=first_day, last_day=until,
+                                        not_before=not_before)
+        Post.objects.bulk_create(posts, batch_size=CAMPAIGN_BULK_CHUNK_SIZE)
+        count_bulk_references(posts)
+        Campaign.objects.filter(id=campaign.id).update(materialized_until=until)
+        campaign.materialized_until = until
+    return len(posts)
+
+
+def extend_campaign(campaign):
+    """Materializes the next window of one campaign and gets its new posts going. Returns posts created."""
+    created = materialize_campaign_posts(campaign)
+    metrics.inc('postx_posts_created_total', created)
+    # Pool images that finished ingesting while we were materializing
+    uploads.backfill_campaign_images(campaign)
+    arm_dispatch(Post.objects.filter(campaign=campaign))
+    return created
+
+
+# Campaign posts nothing has started working on yet: safe to drop and rebuild
+UNSTARTED_STATUSES = ('scheduled', 'waiting_approval', 'approved')
+
+
+def release_future_posts(campaign, now=None, missed=False, keep_reviewed=False):
+    """
+    Deletes the campaign's posts after `now` that no worker has picked up and
+    rewinds materialized_until, so the next window rebuilds them from the
+    current campaign settings. Published and in-flight posts are left alone.
+    keep_reviewed=True leaves the future posts someone has already looked at
+    ('waiting_approval' / 'approved') too; only 'scheduled' ones are rebuilt.
+    missed=True also drops unstarted posts that came due meanwhile (resuming a
+    paused campaign shouldn't publish everything it skipped at once).
+    Returns the number of posts deleted.
+    """
+    now = now or timezone.now()
+    future = Q(scheduled_time__gt=now, status__in=('scheduled',) if keep_reviewed else UNSTARTED_STATUSES)
+    if missed:
+        future |= Q(scheduled_time__lte=now)
+    with transaction.atomic():
+        deleted, _ = Post.objects.filter(future, campaign=campaign, status__in=UNSTARTED_STATUSES).delete()
+        rewound = min(campaign.materialized_until or campaign.end_date, timezone.localdate(now) - timedelta(days=1))
+        Campaign.objects.filter(id=campaign.id).update(materialized_until=rewound)
+        campaign.materialized_until = rewound
+    return deleted
+
+
+def dispatch_ai_generation(post_ids, queue=None):
+    """
+    Hands posts to the AI in a few chunked tasks instead of one message per post.
+    AI_GENERATION_ENGINE picks the worker: 'batch' (one structured request per
+    client group) or 'async' (many concurrent requests inside one process).
+    The chunks go to the 'bulk' lane unless `queue` says otherwise.
+    """
+    post_ids = list(post_ids)
+    if settings.AI_GENERATION_ENGINE == 'async':
+        task, size = generate_ai_content_concurrent, settings.AI_ASYNC_CHUNK_SIZE
+    else:
+        task, size = generate_ai_content_batch, AI_DISPATCH_CHUNK_SIZE
+    chunks = [post_ids[i:i + size] for i in range(0, len(post_ids), size)]
+    if chunks:
+        options = {'queue': queue} if queue else {}
+        group(task.s(chunk).set(**options) for chunk in chunks).apply_async()
+    return len(chunks)
+
+
+# Campaign posts still waiting for their first caption
+BULK_PENDING = Q(status='scheduled', generated_caption__isnull=True, campaign__isnull=False, campaign__is_active=True)
+
 
 @shared_task
+def admit_bulk_generation():
+    """
+    Fair-share pump (beat, every BULK_ADMIT_INTERVAL seconds, plus a kick when a
+    campaign is created): tops the bulk lane up to BULK_MAX_IN_FLIGHT posts,
+    split evenly between every client that has campaign posts waiting. Posts
+    'generating' for longer than BULK_GENERATION_TIMEOUT (their worker died)
+    are put back in line first, so they can't hold the lane forever.
+    Returns {client_id: posts admitted}.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.BULK_GENERATION_TIMEOUT)
+    # Rows claimed before claimed_at existed have none: go by their scheduled_time instead
+    stale = Post.objects.filter(Q(claimed_at__lt=cutoff) | Q(claimed_at__isnull=True, scheduled_time__lt=cutoff),
+                                status='generating', campaign__isnull=False)
+    requeued = stale.update(status='scheduled', version=F('version') + 1)
+    if requeued:
+        logger.warning("⚠️ Put %d posts stuck in 'generating' back in line", requeued, extra={'requeued': requeued})
+
+    pending = Post.objects.filter(BULK_PENDING)
+    if not pending.exists():
+        return {}
+    in_flight = Post.objects.filter(status='generating', campaign__isnull=False).count()
+    budget = settings.BULK_MAX_IN_FLIGHT - in_flight
+    if budget <= 0:
+        return {}
+
+    demand = dict(pending.order_by().values_list('client').annotate(n=Count('id')))
+    admitted = {}
+    for client_id, share in fairshare.fair_shares(demand, budget).items():
+        claimed = claim_bulk_posts(client_id, share)
+        dispatch_ai_generation(claimed)
+        admitted[client_id] = len(claimed)
+    logger.info("⚖️ Admitted %d campaign posts for %d clients", sum(admitted.values()), len(admitted),
+                extra={'admitted': admitted, 'in_flight': in_flight})
+    return admitted
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
 def initialize_campaign_posts(campaign_id):
     """
-    Generates ALL posts for the ENTIRE duration of the campaign immediately.
-    Fixes the 'Duplicate' bug and 'Date' issue.
+    Generates the posts of the campaign's first CAMPAIGN_HORIZON_DAYS (all of
+    them if that is 0); extend_campaign_horizons adds the rest as days pass.
+    Also rebuilds the window after an edit or a resume (release_future_posts).
+    acks_late: if the worker dies, the broker redelivers and we resume.
     """
     try:
-        campaign = Campaign.objects.get(id=campaign_id)
-        print(f"🚀 Initializing Campaign: {campaign.name}")
-        
-        # Get Images from the Campaign Pool
-        campaign_images = list(campaign.images.all())
-        
-        # Determine Logic
-        MARKETING_ANGLES = ["Values", "Unique Selling Point", "Customer Success", "Behind the Scenes", "Call to Action"]
-        
-        # LOOP THROUGH DATES
-        current_date = campaign.start_date
-        while current_date <= campaign.end_date:
-            
-            # Create Base Time for this specific day
-            base_time_str = f"{current_date} {campaign.daily_start_time}"
-            base_time = datetime.strptime(base_time_str, "%Y-%m-%d %H:%M:%S")
-            # Make it timezone aware (Important for Django)
-            base_time = timezone.make_aware(base_time)
-
-            for i in range(campaign.posts_per_day):
-                # Calculate specific time for this post
-                post_time = base_time + timedelta(hours=(i * campaign.interval_hours))
-                
-                # Content Logic
-                if campaign.type == 'topic':
-                    news_text = f"Series '{campaign.name}' - Post {i+1}: {campaign.topic_prompt}"
-                else:
-                    angle = MARKETING_ANGLES[i % len(MARKETING_ANGLES)]
-                    news_text = f"General Awareness ({angle})"
-
-                # Create the Post Object
-                new_post = Post(
-                    client=campaign.client,
-                    campaign=campaign,
-                    news_update=news_text,
-                    scheduled_time=post_time,
-                    # INHERIT APPROVAL SETTING from Campaign
-                    requires_approval=not campaign.auto_approve, 
-                    status='scheduled' # Ready for AI to pick it up when time comes
-                )
-                
-                # Assign Image (Shuffle Logic)
-                if campaign_images:
-                    chosen_image = random.choice(campaign_images)
-                    # Duplicate the file so if campaign is deleted, post image remains
-                    new_post.image.save(chosen_image.image.name, chosen_image.image.file, save=False)
-                
-                # If no images, we leave it empty (fallback to Logo later)
-                
-                new_post.save()
-                
-                # OPTIONAL: Trigger AI immediately for ALL posts (so user can review now)
-                # If you comment this out, AI will generate them day-by-day.
-                generate_ai_content.delay(new_post.id)
-
-            # Move to next day
-            current_date += timedelta(days=1)
-            
+        campaign = Campaign.objects.select_related('client').get(id=campaign_id)
+        if not campaign.is_active:
+            return
+        logger.info("🚀 Initializing Campaign: %s", campaign.name, extra={'campaign_id': campaign.id})
+
+        created = extend_campaign(campaign)
+        logger.info("📅 Created %d posts for %s", created, campaign.name, extra={'campaign_id': campaign.id, 'posts_created': created})
+
+        # Captions come through the fair-share pump so one huge campaign can't
+        # starve everyone else; kick it now instead of waiting for the next tick
+        admit_bulk_generation.delay()
+
     except Exception as e:
-        print(f"Campaign Error: {e}")
+        logger.exception("Campaign Error: %s", e, extra={'campaign_id': campaign_id})
+
+
+@shared_task
+def extend_campaign_horizons():
+    """
+    Rolling horizon (beat, hourly): tops every running campaign up to
+    CAMPAIGN_HORIZON_DAYS ahead. Paused campaigns are skipped until resumed.
+    Returns the number of posts created.
+    """
+    today = timezone.localdate()
+    # materialized_until is NULL until initialize_campaign_posts has run: leave those to it
+    behind = Campaign.objects.filter(is_active=True, materialized_until__lt=F('end_date'))
+    if settings.CAMPAIGN_HORIZON_DAYS:
+        behind = behind.filter(materialized_until__lt=today + timedelta(days=settings.CAMPAIGN_HORIZON_DAYS))
+    created = 0
+    for campaign in behind.select_related('client'):
+        added = extend_campaign(campaign)
+        if added:
+            logger.info("📅 Extended %s by %d posts", campaign.name, added,
+                        extra={'campaign_id': campaign.id, 'posts_created': added})
+        created += added
+    if created:
+        admit_bulk_generation.delay()
+    return created
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def ingest_campaign_upload(upload_id):
+    """Validates + dedups one finished upload into the pool, then hands images to posts that have none."""
+    upload = CampaignUpload.objects.filter(id=upload_id, status='processing').first()
+    if upload is None:
+        return None
+    status = uploads.ingest(upload)
+    logger.info("🖼️ Upload %s: %s", upload.filename, status, extra={
+        'campaign_id': upload.campaign_id, 'upload_id': str(upload.id), 'status': status, 'error': upload.error,
+    })
+    if status == 'ready':
+        backfilled = uploads.backfill_campaign_images(upload.campaign)
+        if backfilled:
+            logger.info("🖼️ Gave pool images to %d posts", backfilled, extra={'campaign_id': upload.campaign_id})
+    return status
+
+
+@shared_task
+def expire_stale_uploads():
+    """Uploads abandoned halfway are dropped after CAMPAIGN_UPLOAD_EXPIRY_HOURS."""
+    cutoff = timezone.now() - timedelta(hours=settings.CAMPAIGN_UPLOAD_EXPIRY_HOURS)
+    stale = list(CampaignUpload.objects.filter(status='uploading', created_at__lt=cutoff))
+    for upload in stale:
+        path = uploads.staging_path(upload)
+        if os.path.exists(path):
+            os.remove(path)
+    CampaignUpload.objects.filter(id__in=[u.id for u in stale], status='uploading').update(
+        status='rejected', error='Upload was never finished',
+    )
+    return len(stale)
+
+
+def finish_generation(post, caption):
+    post.generated_caption = caption
+    post.status = 'waiting_approval' if post.requires_approval else 'approved'
+
 
 @shared_task
 def generate_ai_content(post_id):
@@ -118,127 +460,234 @@ def generate_ai_content(post_id):
             return
 
         post.status = 'generating'
+        post.claimed_at = timezone.now()
         post.save()
 
-        # Build Prompt based on Context
-        # Note: If 2.5 fails, switch back to 'gemini-1.5-flash'
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        # --- NEW DETAILED PROMPT ---
-        prompt = f"""
-        You are a senior Social Media Manager for {post.client.company_name}.
-        
-        COMPANY BIO:
-        {post.client.company_bio}
-        
-        TOPIC/NEWS FOR THIS POST:
-        {post.news_update}
-        
-        TASK:
-        Write a high-engaging Instagram caption using the AIDA framework.
-        Include 3-5 emojis and end with 5 hashtags.
-        
-        KEEP THESE GUIDELINES IN MIND:
-        1. Strong Opening Hook: The first sentence is crucial. Ask a question, state a surprising fact, create urgency/FOMO, or use provocative language.
-        2. Clarity and Conciseness: Get straight to the point. Use simple language, maybe bullet points, and keep paragraphs short (1-2 sentences).
-        3. Provide Value: Educate, inspire, entertain, or solve a problem.
-        4. Call to Action (CTA): Tell the audience exactly what to do next (Comment, Share, Link in Bio, Tag a friend).
-        5. Tone and Personality: Be authentic, conversational, and use emojis to convey emotion. Avoid sounding like a corporate bot.
-        6. Searchability: Use strategic hashtags.
-
-        ⚠️ STRICT OUTPUT RULES (DO NOT IGNORE):
-        1. Return ONLY the final caption text.
-        2. Do NOT add introductions like "Here is a caption" or "Sure!".
-        3. Do NOT add quotes "" around the text.
-        4. Start the response immediately with the hook/headline.
-        """
-        
-        response = model.generate_content(prompt)
-        
-        # Extra safety cleanup (just in case AI ignores rule #3)
-        clean_caption = response.text.replace('Here is a caption:', '').strip().strip('"')
-        
-        post.generated_caption = clean_caption
+        # Note: If 2.5 fails, switch GEMINI_MODEL back to 'gemini-1.5-flash'
+        clean_caption = ai.generate_caption(post.client, post.news_update, variant=ai.caption_variant(post))
         
         # Logic remains exactly the same as before
-        if post.requires_approval:
-            post.status = 'waiting_approval'
-        else:
-            post.status = 'approved'
-            
+        finish_generation(post, clean_caption)
         post.save()
+        arm_dispatch(Post.objects.filter(id=post.id))
+        metrics.inc('postx_captions_total', outcome='ok')
 
     except Exception as e:
-        print(f"AI Error: {e}")
+        logger.exception("AI Error: %s", e, extra={'post_id': post_id})
+        metrics.inc('postx_captions_total', outcome='error')
         post.status = 'error'
         post.save()
 
 
+@shared_task
+def generate_ai_content_batch(post_ids):
+    """
+    Runs the AI for a chunk of posts inside one worker task.
+    Posts of the same client/campaign share ONE structured request; if that
+    response can't be parsed the group falls back to one call per post.
+    A duplicate or late chunk leaves posts that have moved on alone: only the
+    rows its own guarded claim took are written back and armed.
+    """
+    posts = list(Post.objects.select_related('client').filter(id__in=post_ids, status__in=Post.GENERATABLE)
+                 .order_by('scheduled_time'))
+    groups = {}
+    for post in posts:
+        groups.setdefault((post.client_id, post.campaign_id), []).append(post)
+
+    for group_posts in groups.values():
+        stamp = timezone.now()
+        Post.objects.filter(id__in=[p.id for p in group_posts], status__in=Post.GENERATABLE) \
+            .update(status='generating', claimed_at=stamp, version=F('version') + 1)
+        # Ours until someone else claims them again (a later chunk stamps its own claimed_at)
+        mine = Post.objects.filter(id__in=[p.id for p in group_posts], status='generating', claimed_at=stamp)
+        claimed = set(mine.values_list('id', flat=True))
+        group_posts = [p for p in group_posts if p.id in claimed]
+        if not group_posts:
+            continue
+        ids = [p.id for p in group_posts]
+        try:
+            captions = ai.generate_captions_batch(
+                group_posts[0].client, [p.news_update for p in group_posts],
+                variant=','.join(ai.caption_variant(p) for p in group_posts),
+            )
+        except Exception as e:
+            logger.warning("Batch AI Error (%d posts), falling back to single calls: %s", len(ids), e,
+                           extra={'post_ids': ids, 'campaign_id': group_posts[0].campaign_id})
+            metrics.inc('postx_captions_total', outcome='batch_fallback')
+            for post_id in ids:
+                generate_ai_content(post_id)
+            continue
+
+        for post, caption in zip(group_posts, captions):
+            finish_generation(post, caption)
+        with transaction.atomic():
+            # Still ours? Locked, so what we write is exactly what we arm
+            written = list(mine.select_for_update().values_list('id', flat=True))
+            # One UPDATE for the group; version is bumped in SQL so concurrent edits aren't lost
+            Post.objects.filter(id__in=written).update(
+                generated_caption=Case(*(When(id=p.id, then=Value(p.generated_caption)) for p in group_posts),
+                                       output_field=TextField()),
+                status=Case(*(When(id=p.id, then=Value(p.status)) for p in group_posts)),
+                version=F('version') + 1,
+            )
+            arm_dispatch(Post.objects.filter(id__in=written))
+        metrics.inc('postx_captions_total', len(written), outcome='ok')
+
 
 @shared_task
-def upload_to_facebook(post_id):
+def regenerate_ai_caption(post_id, previous_status='waiting_approval'):
     """
-    Uploads to Instagram.
-    Includes Fallback Logic: If no Post Image, use Client Logo.
+    The dashboard's "rewrite" button, run off the request thread.
+    The view has already flipped the post to 'regenerating'; we put it back
+    to `previous_status` with the new caption (or the old one if the AI failed).
     """
     try:
-        post = Post.objects.get(id=post_id)
-        print(f"🚀 Starting Upload for Post #{post.id}...")
-
-        # --- IMAGE SELECTION LOGIC ---
-        if post.image:
-            image_url = f"{NGROK_URL}{post.image.url}"
-            print(f"📸 Using Custom Post Image.")
-        elif post.client.logo:
-            image_url = f"{NGROK_URL}{post.client.logo.url}"
-            print(f"⚠️ No custom image. Using Client Logo as fallback.")
-        else:
-            raise Exception("❌ No Image! Post has no image and Client has no Logo.")
+        post = Post.objects.select_related('client').get(id=post_id, status='regenerating')
+    except Post.DoesNotExist:
+        return  # deleted or changed in the meantime
 
+    try:
+        # Explicit regeneration: always skip the caption cache
+        post.generated_caption = ai.rewrite_caption(post.client, bypass_cache=True)
+    except Exception as e:
+        logger.exception("Rewrite Error: %s", e, extra={'post_id': post_id})
+    post.status = previous_status
+    post.save(update_fields=['generated_caption', 'status'])
+    arm_dispatch(Post.objects.filter(id=post.id))
+
+
+@shared_task
+def generate_ai_content_concurrent(post_ids):
+    """Runs the asyncio engine: every post in the chunk is in flight at once."""
+    statuses = asyncio.run(async_ai.generate_all(post_ids))
+    # Only what this task wrote: posts taken over meanwhile keep their own timers
+    arm_dispatch(Post.objects.filter(id__in=[i for i, status in statuses.items() if status != 'error']))
+    counts = async_ai.count_statuses(statuses)
+    for status, count in counts.items():
+        metrics.inc('postx_captions_total', count, outcome='error' if status == 'error' else 'ok')
+    logger.info("✨ Async AI finished %d posts", len(post_ids), extra={'counts': counts})
+    return counts
+
+
+@shared_task
+def generate_image_variants(name, variants=None):
+    """Pre-renders the thumbnail and Instagram derivatives of an uploaded image."""
+    for variant in variants or images.VARIANTS:
+        try:
+            images.ensure_variant(name, variant)
+        except Exception as e:
+            logger.warning("⚠️ Could not render '%s' for %s: %s", variant, name, e)
+    # Cached dashboard cards still point at the original until the thumbnail exists
+    Post.objects.filter(image=name).update(version=F('version') + 1)
+    return name
+
+
+def publish_image_url(post):
+    """
+    Public URL Meta should fetch: Post Image, else fall back to the Client Logo.
+    Always the Instagram derivative, so odd aspect ratios or huge PNGs can't be rejected.
+    """
+    if post.image:
+        logger.info("📸 Using Custom Post Image.", extra={'post_id': post.id})
+        source = post.image.name
+    elif post.client.logo:
+        logger.info("⚠️ No custom image. Using Client Logo as fallback.", extra={'post_id': post.id})
+        source = post.client.logo.name
+    else:
+        raise Exception("❌ No Image! Post has no image and Client has no Logo.")
+    name = images.ensure_variant(source, 'instagram')
+    return media.signed_url(name)
+
+
+def publish_poll_countdown(retries):
+    """Seconds until the next container status check (exponential backoff, capped)."""
+    return min(settings.PUBLISH_POLL_DELAY * (2 ** retries), settings.PUBLISH_POLL_MAX_DELAY)
+
+
+@shared_task(bind=True, max_retries=None)
+def upload_to_facebook(self, post_id):
+    """
+    Uploads to Instagram - phase 1 of 2.
+    Creates the media container and hands the wait over to `publish_container`,
+    so no worker sits idle while Meta processes the image.
+    """
+    try:
+        post = Post.objects.select_related('client').get(id=post_id)
+        logger.info("🚀 Starting Upload for Post #%d...", post.id, extra={'post_id': post.id, 'campaign_id': post.campaign_id})
+
+        image_url = publish_image_url(post)
+        logger.info("📤 Uploading image URL: %s", image_url, extra={'post_id': post.id})
+        container_id = graph.create_media_container(
+            post.client.instagram_business_id,
+            post.client.instagram_access_token,
+            image_url,
+            post.generated_caption,
+        )
+        logger.info("📦 Container ID: %s", container_id, extra={'post_id': post.id, 'container_id': container_id})
+
+        post.ig_container_id = container_id
+        post.save(update_fields=['ig_container_id'])
+        publish_container.apply_async((post.id, container_id), countdown=publish_poll_countdown(0))
+
+    except graph.GraphRateLimited as e:
+        # Throttled: stay in 'publishing' and come back when the token recovers
+        logger.warning("⏳ Rate limited, retrying in %.0fs", e.retry_after, extra={'post_id': post_id})
+        raise self.retry(countdown=e.retry_after)
+    except Retry:
+        raise
+    except Exception as e:
+        logger.error("❌ Upload Error: %s", e, extra={'post_id': post_id})
+        metrics.inc('postx_publish_total', outcome='error')
+        Post.objects.filter(id=post_id).update(status='error', version=F('version') + 1)
+        quota.refund(post_id)
+
+
+@shared_task(bind=True, max_retries=None)
+def publish_container(self, post_id, container_id):
+    """
+    Uploads to Instagram - phase 2 of 2.
+    Checks the container's status_code; while Meta is still processing it the
+    task re-schedules itself with backoff instead of sleeping. A media_publish
+    that timed out or got a 5xx is not repeated blindly: the task re-schedules
+    itself and the next run sees whether the container was PUBLISHED.
+    """
+    try:
+        post = Post.objects.select_related('client').get(id=post_id)
         access_token = post.client.instagram_access_token
-        page_id = post.client.instagram_business_id
-        
-        # 1. Step 1: Create Container
-        print(f"📤 Uploading image URL: {image_url}")
-        url_create = f"https://graph.facebook.com/v21.0/{page_id}/media"
-        payload_create = {
-            'image_url': image_url,
-            'caption': post.generated_caption,
-            'access_token': access_token
-        }
-        
-        r1 = requests.post(url_create, data=payload_create)
-        data1 = r1.json()
-        
-        if 'id' not in data1:
-            raise Exception(f"Facebook Container Error: {data1}")
-            
-        container_id = data1['id']
-        print(f"📦 Container ID: {container_id}")
-
-        # 2. Wait for processing
-        print("⏳ Waiting 15 seconds for processing...")
-        time.sleep(15)
-
-        # 3. Step 2: Publish Container
-        url_publish = f"https://graph.facebook.com/v21.0/{page_id}/media_publish"
-        payload_publish = {
-            'creation_id': container_id,
-            'access_token': access_token
-        }
-        
-        r2 = requests.post(url_publish, data=payload_publish)
-        data2 = r2.json()
-        
-        if 'id' not in data2:
-            raise Exception(f"Facebook Publish Error: {data2}")
 
-        # 4. Success
-        print(f"🎉 SUCCESS! Post Published ID: {data2['id']}")
+        status_code = graph.get_container_status(container_id, access_token)
+        if status_code == 'IN_PROGRESS':
+            if self.request.retries >= settings.PUBLISH_POLL_MAX_RETRIES:
+                raise Exception(f"Container {container_id} still processing after {self.request.retries} checks")
+            raise self.retry(countdown=publish_poll_countdown(self.request.retries + 1))
+        if status_code == 'PUBLISHED':
+            # An earlier attempt published it but never heard back
+            logger.info("🎉 Container %s was already published", container_id, extra={'post_id': post.id, 'container_id': container_id})
+        elif status_code != 'FINISHED':
+            raise Exception(f"Container {container_id} is {status_code}")
+        else:
+            try:
+                media_id = graph.publish_media_container(post.client.instagram_business_id, access_token, container_id)
+            except graph.GraphAPIUncertain as e:
+                if self.request.retries >= settings.PUBLISH_POLL_MAX_RETRIES:
+                    raise
+                logger.warning("⏳ Publish outcome unknown, re-checking the container: %s", e,
+                               extra={'post_id': post.id, 'container_id': container_id})
+                raise self.retry(countdown=publish_poll_countdown(self.request.retries + 1))
+            logger.info("🎉 SUCCESS! Post Published ID: %s", media_id, extra={'post_id': post.id, 'media_id': media_id})
+
         post.status = 'posted'
-        post.save()
+        post.save(update_fields=['status'])
+        metrics.inc('postx_publish_total', outcome='posted')
+        metrics.observe('postx_publish_lag_seconds', max((timezone.now() - post.scheduled_time).total_seconds(), 0))
 
+    except graph.GraphRateLimited as e:
+        logger.warning("⏳ Rate limited, re-checking in %.0fs", e.retry_after, extra={'post_id': post_id, 'container_id': container_id})
+        raise self.retry(countdown=e.retry_after)
+    except Retry:
+        raise
     except Exception as e:
-        print(f"❌ Upload Error: {e}")
-        post.status = 'error'
-        post.save()
+        logger.error("❌ Publish Error: %s", e, extra={'post_id': post_id, 'container_id': container_id})
+        metrics.inc('postx_publish_total', outcome='error')
+        Post.objects.filter(id=post_id).update(status='error', version=F('version') + 1)
+        quota.refund(post_id)
@@ -0,0 +1,13 @@
+from django import template
+
+from core.images import variant_url
+
+register = template.Library()
+
+
+@register.filter
+def variant(image, name):
+    """{{ post.image|variant:"thumb" }} - URL of a derivative, or the original until it's ready."""
+    if not image:
+        return ''
+    return variant_url(image.name, name)
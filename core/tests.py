@@ -1,3 +1,1402 @@
-from django.test import TestCase
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, datetime, time as dtime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from celery.exceptions import Retry
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .fakes import FakeGenerativeModel, FakeGraphAPI
+from .forms import CampaignForm
+from .models import Client, Campaign, CampaignImage, CampaignUpload, MediaBlob, Post, PublishQuotaUse
+from .storage import blob_storage
+from . import ai, async_ai, bulk, caption_cache, fairshare, graph, images, logs, media, metrics, quota, tasks, uploads, views
+
+
+def make_client(username='acme'):
+    user = User.objects.create(username=username)
+    return Client.objects.create(
+        user=user, company_name='Acme', company_bio='We make things.',
+        instagram_access_token='token', instagram_business_id='17841400000000000',
+    )
+
+
+def make_campaign(client, **kwargs):
+    fields = dict(
+        client=client, name='Launch', type='bio', posts_per_day=3,
+        start_date=date(2030, 1, 1), end_date=date(2030, 1, 10),
+        daily_start_time=dtime(9, 0), interval_hours=2,
+    )
+    fields.update(kwargs)
+    return Campaign.objects.create(**fields)
+
+
+@override_settings(CAMPAIGN_HORIZON_DAYS=0)
+class CampaignMaterializationTests(TestCase):
+    def setUp(self):
+        self.campaign = make_campaign(make_client())
+
+    def test_bulk_materialization_creates_every_slot(self):
+        # savepoint, client lock, client's posts, pool images, INSERT, horizon, release
+        with self.assertNumQueries(7):
+            created = tasks.materialize_campaign_posts(self.campaign)
+        self.assertEqual(created, 30)
+        self.assertEqual(Post.objects.filter(campaign=self.campaign, status='scheduled').count(), 30)
+
+    def test_rerun_resumes_without_duplicates(self):
+        tasks.materialize_campaign_posts(self.campaign)
+        # A worker that died mid-transaction leaves some slots and no horizon mark
+        Post.objects.filter(campaign=self.campaign).order_by('-scheduled_time')[:1].get().delete()
+        Campaign.objects.filter(id=self.campaign.id).update(materialized_until=None)
+        self.campaign.refresh_from_db()
+        self.assertEqual(tasks.materialize_campaign_posts(self.campaign), 1)
+        self.assertEqual(Post.objects.filter(campaign=self.campaign).count(), 30)
+
+    def test_ai_generation_is_dispatched_in_chunks(self):
+        with mock.patch.object(tasks.admit_bulk_generation, 'delay') as kick:
+            tasks.initialize_campaign_posts(self.campaign.id)
+        kick.assert_called_once_with()
+        with mock.patch.object(tasks, 'group') as group:
+            tasks.admit_bulk_generation()
+        chunks = [sig.args[0] for sig in group.call_args.args[0]]
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(sum(len(c) for c in chunks), 30)
+
+
+
+@override_settings(CAMPAIGN_HORIZON_DAYS=0, SCHEDULE_MIN_SPACING_MINUTES=15)
+class SchedulePlannerTests(TestCase):
+    def setUp(self):
+        self.client_profile = make_client()
+
+    def times(self, campaign):
+        return list(Post.objects.filter(campaign=campaign).order_by('scheduled_time').values_list('scheduled_time', flat=True))
+
+    def test_overlapping_campaigns_are_spaced_apart(self):
+        first = make_campaign(self.client_profile)
+        second = make_campaign(self.client_profile, name='Overlap', interval_hours=1)
+        tasks.materialize_campaign_posts(first)
+        tasks.materialize_campaign_posts(second)
+        times = sorted(Post.objects.values_list('scheduled_time', flat=True))
+        self.assertEqual(len(times), 60)
+        self.assertGreaterEqual(min(b - a for a, b in zip(times, times[1:])), timedelta(minutes=15))
+        # 09:00 belonged to the first campaign: the second one's slot moved just past it
+        self.assertEqual(timezone.localtime(self.times(second)[0]).time(), dtime(9, 15))
+
+        # Rebuilding the window finds the moved posts in their slots instead of adding more
+        Campaign.objects.filter(id=second.id).update(materialized_until=None)
+        second.refresh_from_db()
+        self.assertEqual(tasks.materialize_campaign_posts(second), 0)
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_slots_follow_the_wall_clock_across_dst(self):
+        # 2030-03-10: clocks jump from 02:00 to 03:00, so the 02:00 slot lands on 03:00 too
+        campaign = make_campaign(self.client_profile, start_date=date(2030, 3, 10), end_date=date(2030, 3, 11),
+                                 daily_start_time=dtime(1, 0), interval_hours=1)
+        tasks.materialize_campaign_posts(campaign)
+        utc = [t.astimezone(dt_timezone.utc).strftime('%d %H:%M') for t in self.times(campaign)]
+        self.assertEqual(utc, ['10 06:00', '10 07:00', '10 07:15', '11 05:00', '11 06:00', '11 07:00'])
+
+    def test_form_rejects_a_day_that_runs_past_midnight(self):
+        data = {'name': 'Late', 'type': 'bio', 'posts_per_day': 6, 'start_date': '2030-01-01',
+                'end_date': '2030-01-10', 'daily_start_time': '18:00', 'interval_hours': 2}
+        form = CampaignForm(data)
+        self.assertFalse(form.is_valid())
+        self.assertIn('interval_hours', form.errors)
+        self.assertTrue(CampaignForm({**data, 'posts_per_day': 3}).is_valid())
+
+
+@override_settings(CAMPAIGN_HORIZON_DAYS=3)
+class RollingHorizonTests(TestCase):
+    def setUp(self):
+        self.client_profile = make_client()
+        self.today = timezone.localdate()
+        self.campaign = make_campaign(self.client_profile, start_date=self.today + timedelta(days=1),
+                                      end_date=self.today + timedelta(days=9))
+        self.kick = self.enterContext(mock.patch.object(tasks.admit_bulk_generation, 'delay'))
+        self.initialize = self.enterContext(mock.patch.object(tasks.initialize_campaign_posts, 'delay'))
+        self.client.force_login(self.client_profile.user)
+
+    def future_posts(self):
+        return Post.objects.filter(campaign=self.campaign, scheduled_time__gt=timezone.now())
+
+    def test_only_the_horizon_is_materialized_and_beat_extends_it(self):
+        self.assertEqual(tasks.materialize_campaign_posts(self.campaign), 9)
+        self.assertEqual(self.campaign.materialized_until, self.today + timedelta(days=3))
+
+        later = timezone.now() + timedelta(days=2)
+        with mock.patch.object(timezone, 'now', return_value=later):
+            self.assertEqual(tasks.extend_campaign_horizons(), 6)
+            self.assertEqual(tasks.extend_campaign_horizons(), 0)
+        self.kick.assert_called_once_with()
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.materialized_until, self.today + timedelta(days=5))
+
+        Campaign.objects.filter(id=self.campaign.id).update(is_active=False)
+        with mock.patch.object(timezone, 'now', return_value=later + timedelta(days=2)):
+            self.assertEqual(tasks.extend_campaign_horizons(), 0)
+
+    def test_pause_holds_the_campaign_and_resume_rebuilds_it(self):
+        tasks.materialize_campaign_posts(self.campaign)
+        reviewed = list(self.future_posts().order_by('scheduled_time')[:2])
+        for post, status in zip(reviewed, ('approved', 'waiting_approval')):
+            Post.objects.filter(id=post.id).update(status=status, generated_caption='Reviewed')
+        due = Post.objects.create(client=self.client_profile, campaign=self.campaign, news_update='x', status='approved',
+                                  generated_caption='Hi', scheduled_time=timezone.now() - timedelta(minutes=1))
+
+        self.client.get(reverse('stop_campaign', args=[self.campaign.id]))
+        self.assertEqual(set(self.future_posts()), set(reviewed))  # reviewed work survives a pause
+        self.assertEqual(tasks.claim_due_posts('approved', 'publishing', 10), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('restart_campaign', args=[self.campaign.id]))
+        self.assertFalse(Post.objects.filter(id=due.id).exists())  # missed while paused: skipped
+        self.assertEqual(Post.objects.filter(id__in=[p.id for p in reviewed]).count(), 2)
+        self.initialize.assert_called_once_with(self.campaign.id)
+        tasks.initialize_campaign_posts(self.campaign.id)
+        self.assertEqual(self.future_posts().count(), 9)
+
+    def test_edit_rebuilds_only_the_future_window(self):
+        tasks.materialize_campaign_posts(self.campaign)
+        posted = Post.objects.create(client=self.client_profile, campaign=self.campaign, news_update='x',
+                                     status='posted', scheduled_time=timezone.now() - timedelta(days=1))
+        data = {
+            'name': 'Launch', 'type': 'bio', 'topic_prompt': '', 'posts_per_day': 1, 'interval_hours': 2,
+            'start_date': self.campaign.start_date, 'end_date': self.campaign.end_date, 'daily_start_time': '10:00',
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('edit_campaign', args=[self.campaign.id]), data)
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.initialize.assert_called_once_with(self.campaign.id)
+        tasks.initialize_campaign_posts(self.campaign.id)
+
+        self.assertTrue(Post.objects.filter(id=posted.id).exists())
+        times = list(self.future_posts().order_by('scheduled_time').values_list('scheduled_time', flat=True))
+        self.assertEqual(len(times), 3)
+        self.assertTrue(all(timezone.localtime(t).hour == 10 for t in times))
+
+
+@override_settings(CAMPAIGN_HORIZON_DAYS=0)
+class BlobStoreTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.campaign = make_campaign(make_client())
+
+    def add_pool_image(self, filename, data=b'same bytes'):
+        image = CampaignImage(campaign=self.campaign)
+        image.image.save(filename, ContentFile(data))
+        return image
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.add_pool_image('a.jpg')
+        second = self.add_pool_image('b.JPG')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.startswith('blobs/'))
+        self.assertEqual(MediaBlob.objects.get().ref_count, 2)
+
+    def test_campaign_posts_reference_pool_without_copying(self):
+        pool = self.add_pool_image('pool.jpg')
+        tasks.materialize_campaign_posts(self.campaign)
+        self.assertEqual(set(Post.objects.values_list('image', flat=True)), {pool.image.name})
+        self.assertEqual(MediaBlob.objects.get().ref_count, 31)
+
+        # Deleting the campaign drops the pool reference, the posts keep the file alive
+        self.campaign.delete()
+        self.assertEqual(MediaBlob.objects.get().ref_count, 30)
+        self.assertTrue(blob_storage.exists(pool.image.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.all().delete()
+        self.assertFalse(MediaBlob.objects.exists())
+        self.assertFalse(blob_storage.exists(pool.image.name))
+
+    def test_dedupe_media_migrates_legacy_copies(self):
+        legacy = FileSystemStorage()
+        for name in ('post_images/one.jpg', 'post_images/two.jpg'):
+            legacy.save(name, ContentFile(b'legacy'))
+        client = self.campaign.client
+        Post.objects.bulk_create([
+            Post(client=client, news_update='x', scheduled_time='2030-01-01T09:00Z', image='post_images/one.jpg'),
+            Post(client=client, news_update='y', scheduled_time='2030-01-01T10:00Z', image='post_images/two.jpg'),
+        ])
+        call_command('dedupe_media', stdout=io.StringIO())
+
+        names = set(Post.objects.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertEqual(MediaBlob.objects.get(name=names.pop()).ref_count, 2)
+        self.assertFalse(blob_storage.exists('post_images/one.jpg'))
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+        cache.clear()
+        self.campaign = make_campaign(make_client())
+
+    def upload(self, size, mode='RGB', fmt='PNG'):
+        out = io.BytesIO()
+        Image.new(mode, size, 'red').save(out, fmt)
+        image = CampaignImage(campaign=self.campaign)
+        image.image.save(f'upload.{fmt.lower()}', ContentFile(out.getvalue()))
+        return image.image.name
+
+    def open_variant(self, name, variant):
+        return Image.open(images.derivative_storage.path(images.ensure_variant(name, variant)))
+
+    def test_instagram_variant_fits_feed_rules(self):
+        for size, ratio in (((400, 1000), 0.8), ((3000, 1000), 1.91), ((200, 200), 1.0)):
+            with self.open_variant(self.upload(size, mode='RGBA'), 'instagram') as out:
+                self.assertEqual(out.format, 'JPEG')
+                self.assertAlmostEqual(out.width / out.height, ratio, places=2)
+                self.assertTrue(320 <= out.width <= 1440)
+
+    def test_thumbnail_is_small(self):
+        with self.open_variant(self.upload((2000, 1500)), 'thumb') as out:
+            self.assertEqual(out.size, (640, 480))
+
+    def test_dashboard_url_falls_back_until_rendered(self):
+        name = self.upload((800, 800))
+        with mock.patch.object(tasks.generate_image_variants, 'delay') as enqueue:
+            self.assertEqual(images.variant_url(name, 'thumb'), blob_storage.url(name))
+            images.variant_url(name, 'thumb')
+        enqueue.assert_called_once_with(name)
+        images.ensure_variant(name, 'thumb')
+        self.assertEqual(images.variant_url(name, 'thumb'), images.derivative_storage.url(images.variant_name(name, 'thumb')))
+
+    def test_upload_schedules_rendering(self):
+        with mock.patch.object(tasks.generate_image_variants, 'delay') as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                name = self.upload((100, 100))
+        enqueue.assert_called_once_with(name)
+
+
+class MediaDeliveryTests(TestCase):
+    BLOB = 'blobs/ab/' + 'ab' * 32 + '.jpg'
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root, MEDIA_ACCEL='',
+                                            PUBLIC_BASE_URL='https://app.example.com'))
+        for name, body in ((self.BLOB, b'0123456789' * 100), ('logos/acme.png', b'logo')):
+            os.makedirs(os.path.dirname(os.path.join(self.media_root, name)), exist_ok=True)
+            with open(os.path.join(self.media_root, name), 'wb') as fh:
+                fh.write(body)
+        self.client_profile = make_client()
+
+    def signed_path(self, name, ttl=None):
+        return media.signed_url(name, ttl).removeprefix('https://app.example.com')
+
+    def test_signed_links_work_without_a_session_until_they_expire(self):
+        url = media.signed_url(self.BLOB)
+        self.assertTrue(url.startswith('https://app.example.com/media/signed/'))
+        response = self.client.get(self.signed_path(self.BLOB))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789' * 100)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+        path = self.signed_path(self.BLOB)
+        self.assertEqual(self.client.get(path.replace('ab/ab', 'ab/cd')).status_code, 403)
+        with mock.patch.object(media.time, 'time', return_value=time.time() + 2 * settings.MEDIA_SIGNED_URL_TTL):
+            self.assertEqual(self.client.get(path).status_code, 403)
+
+    def test_dashboard_media_needs_login_and_caches_by_content(self):
+        self.assertEqual(self.client.get('/media/' + self.BLOB).status_code, 403)
+        self.client.force_login(self.client_profile.user)
+        response = self.client.get('/media/' + self.BLOB)
+        # Behind the login: the browser may keep it, shared caches may not
+        self.assertEqual(response['Cache-Control'], 'private, max-age=31536000, immutable')
+        self.assertEqual(self.client.get('/media/logos/acme.png')['Cache-Control'], 'private, no-cache')
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+
+        again = self.client.get('/media/' + self.BLOB, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again['Cache-Control'], response['Cache-Control'])
+
+    def test_byte_ranges(self):
+        self.client.force_login(self.client_profile.user)
+        response = self.client.get('/media/' + self.BLOB, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1000')
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(media.parse_range('bytes=-5', 1000), (995, 999))
+        self.assertIsNone(media.parse_range('bytes=2000-', 1000))
+        self.assertIsNone(media.parse_range('bytes=0-1,5-6', 1000))
+
+    def test_front_server_offload(self):
+        self.client.force_login(self.client_profile.user)
+        with override_settings(MEDIA_ACCEL='nginx'):
+            response = self.client.get('/media/' + self.BLOB)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.BLOB)
+        self.assertEqual(response.content, b'')
+        with override_settings(MEDIA_ACCEL='sendfile'):
+            response = self.client.get('/media/' + self.BLOB)
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.media_root, self.BLOB))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir)
+        self.enterContext(override_settings(METRICS_DIR=self.metrics_dir, METRICS_TOKEN='scrape'))
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+        self.client_profile = make_client()
+
+    def scrape(self, **headers):
+        return self.client.get(reverse('metrics'), headers=headers)
+
+    def test_snapshots_of_all_processes_are_added_up(self):
+        # Another worker process flushed earlier
+        other = metrics.Registry()
+        other.inc('postx_posts_claimed_total', 3, stage='publish')
+        other.observe('postx_gemini_request_seconds', 0.2, kind='batch', outcome='ok')
+        with mock.patch.object(os, 'getpid', return_value=os.getppid()):
+            other.flush(force=True)
+
+        metrics.inc('postx_posts_claimed_total', 2, stage='publish')
+        metrics.observe('postx_gemini_request_seconds', 3, kind='batch', outcome='ok')
+        body = self.scrape(Authorization='Bearer scrape').content.decode()
+
+        self.assertIn('postx_posts_claimed_total{stage="publish"} 5', body)
+        self.assertIn('postx_gemini_request_seconds_bucket{kind="batch",outcome="ok",le="0.25"} 1', body)
+        self.assertIn('postx_gemini_request_seconds_bucket{kind="batch",outcome="ok",le="+Inf"} 2', body)
+        self.assertIn('postx_gemini_request_seconds_count{kind="batch",outcome="ok"} 2', body)
+
+    @skipUnless(os.name == 'posix', "liveness is checked with kill(pid, 0)")
+    def test_snapshots_of_exited_processes_are_pruned(self):
+        exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+        exited.wait()
+        other = metrics.Registry()
+        other.inc('postx_posts_claimed_total', 3, stage='publish')
+        with mock.patch.object(os, 'getpid', return_value=exited.pid):
+            other.flush(force=True)
+        counters, _ = metrics.collect()
+        self.assertNotIn(('postx_posts_claimed_total', (('stage', 'publish'),)), counters)
+        self.assertEqual(os.listdir(self.metrics_dir), [])
+
+    def test_status_gauges_and_backlog_come_from_the_database(self):
+        now = timezone.now()
+        Post.objects.create(client=self.client_profile, news_update='x', status='approved',
+                            scheduled_time=now - timedelta(minutes=10))
+        Post.objects.create(client=self.client_profile, news_update='y', status='scheduled',
+                            scheduled_time=now + timedelta(days=1))
+        per_status, backlog = metrics.database_gauges(now)
+        self.assertEqual((per_status['approved'], per_status['scheduled'], per_status['posted']), (1, 1, 0))
+        self.assertAlmostEqual(backlog['approved'], 600, delta=1)
+        self.assertEqual(backlog['scheduled'], 0)
+
+    def test_endpoint_needs_token_or_superuser(self):
+        self.assertEqual(self.scrape().status_code, 403)
+        self.assertEqual(self.scrape(Authorization='Bearer wrong').status_code, 403)
+        self.client.force_login(User.objects.create(username='root', is_superuser=True))
+        self.assertEqual(self.scrape().status_code, 200)
+
+    def test_publish_records_graph_calls_and_lag(self):
+        with FakeGraphAPI(processing_seconds=0) as fake, override_settings(GRAPH_API_URL=fake.url):
+            post = Post.objects.create(
+                client=self.client_profile, news_update='Launch', status='publishing', generated_caption='Hi',
+                scheduled_time=timezone.now() - timedelta(seconds=30),
+            )
+            container_id = graph.create_media_container('17841400000000000', 'token', 'https://img', 'Hi')
+            tasks.publish_container(post.id, container_id)
+        counters, histograms = metrics.collect()
+        self.assertEqual(counters[('postx_publish_total', (('outcome', 'posted'),))], 1)
+        self.assertIn(('postx_graph_requests_total', (('endpoint', 'media_publish'), ('status', '200'))), counters)
+        lag = histograms[('postx_publish_lag_seconds', ())]
+        self.assertEqual(lag[-2], 1)
+        self.assertGreaterEqual(lag[-1], 30)
+
+    def test_log_lines_are_json_with_ids(self):
+        record = logging.LogRecord('core.tasks', logging.INFO, __file__, 1, 'Published %s', ('x',), None)
+        record.post_id = 7
+        line = json.loads(logs.StructuredFormatter().format(record))
+        self.assertEqual((line['message'], line['post_id'], line['level']), ('Published x', 7, 'INFO'))
+
+
+class ClaimDuePostsTests(TestCase):
+    def setUp(self):
+        self.client_profile = make_client()
+        Post.objects.bulk_create([
+            Post(client=self.client_profile, news_update=str(i), status=status,
+                 scheduled_time=f'2020-01-01T{9 + i:02d}:00Z')
+            for i, status in enumerate(['scheduled'] * 3 + ['approved'] * 2 + ['draft'])
+        ])
+
+    def test_claims_oldest_first_up_to_limit_and_never_twice(self):
+        first = tasks.claim_due_posts('scheduled', 'generating', limit=2)
+        second = tasks.claim_due_posts('scheduled', 'generating', limit=2)
+        third = tasks.claim_due_posts('scheduled', 'generating', limit=2)
+
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertEqual(third, [])
+        self.assertFalse(set(first) & set(second))
+        self.assertEqual(Post.objects.filter(status='generating').count(), 3)
+
+    def test_future_posts_are_not_claimed(self):
+        Post.objects.update(scheduled_time='2999-01-01T00:00Z')
+        self.assertEqual(tasks.claim_due_posts('approved', 'publishing', limit=10), [])
+
+    @override_settings(SCHEDULER_BATCH_SIZE=1)
+    def test_check_schedule_dispatches_only_claimed_ids(self):
+        with mock.patch.object(tasks, 'dispatch_ai_generation') as dispatch_ai, \
+                mock.patch.object(tasks.upload_to_facebook, 'delay') as upload:
+            self.assertEqual(tasks.check_schedule(), {'generating': 1, 'publishing': 1, 'deferred': 0, 'armed': 0})
+        claimed = Post.objects.get(status='publishing')
+        upload.assert_called_once_with(claimed.id)
+        dispatch_ai.assert_called_once_with([Post.objects.get(status='generating').id], queue='generate')
+
+
+
+@override_settings(INSTAGRAM_PUBLISH_QUOTA=2)
+class PublishQuotaTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(tasks.dispatch_post, 'apply_async'))
+        self.upload = self.enterContext(mock.patch.object(tasks.upload_to_facebook, 'delay'))
+        self.client_profile = make_client()
+        self.now = timezone.now()
+
+    def approved(self, client, count, at):
+        return [Post.objects.create(client=client, news_update='x', status='approved', scheduled_time=at)
+                for _ in range(count)]
+
+    def test_window_has_room_once_the_oldest_publish_expires(self):
+        t = self.now
+        used = [t - timedelta(hours=20), t - timedelta(hours=2)]
+        self.assertEqual(quota.project(used, [t, t, t]),
+                         [t + timedelta(hours=4), t + timedelta(hours=22), t + timedelta(hours=28)])
+        self.assertEqual(quota.project([], [t, t]), [t, t])
+
+    def test_sweep_defers_what_the_account_quota_cannot_take(self):
+        other = make_client('globex')
+        other.instagram_business_id = '17841400000000001'
+        other.save()
+        PublishQuotaUse.objects.create(business_id=self.client_profile.instagram_business_id,
+                                       used_at=self.now - timedelta(hours=23))
+        mine = self.approved(self.client_profile, 2, self.now - timedelta(minutes=5))
+        theirs = self.approved(other, 1, self.now - timedelta(minutes=5))
+        with self.captureOnCommitCallbacks(execute=True):
+            result = tasks.check_schedule()
+        self.assertEqual((result['publishing'], result['deferred']), (2, 1))
+        self.assertEqual({c.args[0] for c in self.upload.call_args_list}, {mine[0].id, theirs[0].id})
+
+        held = Post.objects.get(id=mine[1].id)
+        self.assertEqual(held.status, 'approved')
+        self.assertEqual(held.dispatch_at, self.now + timedelta(hours=1))
+        # An hour is past the dispatch horizon: a later sweep claims it, not a timer
+        tasks.dispatch_post.apply_async.assert_not_called()
+        self.assertEqual(tasks.check_schedule()['publishing'], 0)
+
+        # A failed publish gives its slot back
+        quota.refund(mine[0].id)
+        self.assertEqual(PublishQuotaUse.objects.filter(business_id=self.client_profile.instagram_business_id).count(), 1)
+
+    def test_deferral_inside_the_horizon_gets_a_timer(self):
+        PublishQuotaUse.objects.bulk_create(
+            PublishQuotaUse(business_id=self.client_profile.instagram_business_id, used_at=self.now - delta)
+            for delta in (timedelta(hours=23, minutes=50), timedelta(hours=1)))
+        post, = self.approved(self.client_profile, 1, self.now)
+        Post.objects.filter(id=post.id).update(status='publishing')
+        version = Post.objects.get(id=post.id).version
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(quota.admit([post.id], self.now), ([], {post.id: self.now + timedelta(minutes=10)}))
+        held = Post.objects.get(id=post.id)
+        self.assertEqual((held.status, held.version), ('approved', version + 1))
+        tasks.dispatch_post.apply_async.assert_called_once_with((post.id, str(held.dispatch_token)), eta=held.dispatch_at)
+
+    def test_dashboard_shows_projected_delays(self):
+        posts = self.approved(self.client_profile, 3, self.now + timedelta(hours=1))
+        self.client.force_login(self.client_profile.user)
+        response = self.client.get(reverse('dashboard'))
+        projected = {p.id: p.projected_at for day in response.context['days'] for p in day['posts']}
+        self.assertEqual(projected, {posts[0].id: None, posts[1].id: None,
+                                     posts[2].id: self.now + timedelta(hours=25)})
+        self.assertContains(response, '⏳ Quota')
+
+
+@skipUnless(connection.vendor == 'sqlite', "SQLite connection tuning")
+class SQLiteProfileTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_connections_wait_for_locks_and_write_immediately(self):
+        self.assertEqual(self.pragma('busy_timeout'), 20000)
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+    def test_database_files_are_put_in_wal_mode(self):
+        # The test database lives in memory, which has no WAL: connect to a file instead
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        for _ in range(2):  # a second connection finds it already switched
+            wal = type(connections['default'])({**connection.settings_dict, 'NAME': os.path.join(root, 'db.sqlite3')}, alias='wal')
+            try:
+                with wal.cursor() as cursor:
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0], 'wal')
+            finally:
+                wal.close()
+
+
+@override_settings(CAMPAIGN_HORIZON_DAYS=0)
+class FairShareTests(TestCase):
+    def test_budget_is_split_max_min_fair(self):
+        self.assertEqual(fairshare.fair_shares({'big': 10_000, 'a': 5, 'b': 50}, 100), {'big': 47, 'a': 5, 'b': 48})
+        self.assertEqual(fairshare.fair_shares({'big': 10_000, 'small': 3}, 0), {})
+        self.assertEqual(sum(fairshare.fair_shares({1: 7, 2: 7, 3: 7}, 10).values()), 10)
+
+    @override_settings(BULK_MAX_IN_FLIGHT=40)
+    def test_small_client_is_not_stuck_behind_a_huge_campaign(self):
+        agency, shop = make_client('agency'), make_client('shop')
+        make_campaign(agency, end_date=date(2030, 12, 31))  # ~1000 posts
+        make_campaign(shop, end_date=date(2030, 1, 2))      # 6 posts
+        for campaign in Campaign.objects.all():
+            tasks.materialize_campaign_posts(campaign)
+
+        with mock.patch.object(tasks, 'dispatch_ai_generation') as dispatch:
+            self.assertEqual(tasks.admit_bulk_generation(), {agency.id: 34, shop.id: 6})
+            # The lane is full until those finish
+            self.assertEqual(tasks.admit_bulk_generation(), {})
+        dispatched = [call.args[0] for call in dispatch.call_args_list]
+        self.assertEqual(sorted(len(ids) for ids in dispatched), [6, 34])
+        self.assertEqual(Post.objects.filter(status='generating').count(), 40)
+
+    @override_settings(BULK_MAX_IN_FLIGHT=10)
+    def test_posts_stuck_generating_go_back_in_line(self):
+        campaign = make_campaign(make_client(), end_date=date(2030, 1, 4))  # 12 posts
+        tasks.materialize_campaign_posts(campaign)
+        with mock.patch.object(tasks, 'dispatch_ai_generation'):
+            self.assertEqual(sum(tasks.admit_bulk_generation().values()), 10)
+            # Their worker died: once the timeout has passed they are admitted again
+            later = timezone.now() + timedelta(seconds=settings.BULK_GENERATION_TIMEOUT + 1)
+            with mock.patch.object(timezone, 'now', return_value=later):
+                self.assertEqual(sum(tasks.admit_bulk_generation().values()), 10)
+        self.assertEqual(Post.objects.filter(status='generating', claimed_at=later).count(), 10)
+
+    def test_timer_claim_is_not_mistaken_for_a_stuck_one(self):
+        campaign = make_campaign(make_client(), end_date=date(2030, 1, 1))
+        tasks.materialize_campaign_posts(campaign)
+        post = Post.objects.filter(campaign=campaign).first()
+        Post.objects.filter(id=post.id).update(scheduled_time=timezone.now(), dispatch_token=uuid.uuid4())
+        post.refresh_from_db()
+        with mock.patch.object(tasks, 'dispatch_ai_generation') as dispatch:
+            self.assertEqual(tasks.dispatch_post(post.id, str(post.dispatch_token)), 'generate')
+            tasks.admit_bulk_generation()
+        self.assertEqual([c for c in dispatch.call_args_list if post.id in c.args[0]],
+                         [mock.call([post.id], queue='generate')])
+        self.assertIsNotNone(Post.objects.get(id=post.id).claimed_at)
+
+    def test_lanes_route_publishing_away_from_bulk_work(self):
+        routes = settings.CELERY_TASK_ROUTES
+        self.assertEqual(routes[tasks.upload_to_facebook.name]['queue'], 'publish')
+        self.assertEqual(routes[tasks.generate_ai_content.name]['queue'], 'generate')
+        self.assertEqual(routes[tasks.generate_ai_content_batch.name]['queue'], 'bulk')
+
+
+class EventDispatchTests(TestCase):
+    def setUp(self):
+        self.client_profile = make_client()
+        self.timers = self.enterContext(mock.patch.object(tasks.dispatch_post, 'apply_async'))
+        self.upload = self.enterContext(mock.patch.object(tasks.upload_to_facebook, 'delay'))
+
+    def make_post(self, minutes, status='approved'):
+        return Post.objects.create(client=self.client_profile, news_update='x', status=status,
+                                   generated_caption='Hi', scheduled_time=timezone.now() + timedelta(minutes=minutes))
+
+    def armed_token(self, post):
+        post.refresh_from_db()
+        return str(post.dispatch_token)
+
+    def test_posts_inside_the_horizon_get_an_eta_timer(self):
+        soon, later = self.make_post(10), self.make_post(24 * 60)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(tasks.arm_dispatch(Post.objects.all()), 1)
+        soon.refresh_from_db()
+        self.timers.assert_called_once_with((soon.id, str(soon.dispatch_token)), eta=soon.scheduled_time)
+        later.refresh_from_db()
+        self.assertIsNone(later.dispatch_token)
+
+    def test_sweep_arms_new_and_rescheduled_posts_once(self):
+        post = self.make_post(10)
+        self.assertEqual(tasks.check_schedule()['armed'], 1)
+        self.assertEqual(tasks.check_schedule()['armed'], 0)
+        Post.objects.filter(id=post.id).update(scheduled_time=F('scheduled_time') + timedelta(minutes=5))
+        self.assertEqual(tasks.check_schedule()['armed'], 1)
+
+    def test_timer_claims_and_publishes_with_current_token_only(self):
+        post = self.make_post(0)
+        tasks.arm_dispatch(Post.objects.filter(id=post.id))
+        stale = self.armed_token(post)
+        tasks.arm_dispatch(Post.objects.filter(id=post.id))  # e.g. approved again after an edit
+
+        self.assertIsNone(tasks.dispatch_post(post.id, stale))
+        self.assertEqual(tasks.dispatch_post(post.id, self.armed_token(post)), 'publish')
+        self.assertIsNone(tasks.dispatch_post(post.id, self.armed_token(post)))  # redelivered
+        self.upload.assert_called_once_with(post.id)
+        self.assertEqual(Post.objects.get(id=post.id).status, 'publishing')
+
+    def test_timer_for_a_post_moved_later_does_nothing(self):
+        post = self.make_post(0)
+        tasks.arm_dispatch(Post.objects.filter(id=post.id))
+        Post.objects.filter(id=post.id).update(scheduled_time=timezone.now() + timedelta(hours=1))
+        self.assertIsNone(tasks.dispatch_post(post.id, self.armed_token(post)))
+        self.assertEqual(Post.objects.get(id=post.id).status, 'approved')
+
+    def test_approving_arms_the_post(self):
+        post = self.make_post(5, status='waiting_approval')
+        self.client.force_login(self.client_profile.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('approve_post', args=[post.id]))
+        self.timers.assert_called_once_with((post.id, self.armed_token(post)), eta=mock.ANY)
+
+
+class QueryPlanTests(TestCase):
+    """The scheduler and dashboard queries must keep hitting their indexes."""
+
+    def setUp(self):
+        client = make_client()
+        Post.objects.bulk_create([
+            Post(client=client, news_update='x', status=status, scheduled_time=f'2030-01-{day:02d}T09:00Z')
+            for day in range(1, 29) for status in ('scheduled', 'approved', 'posted')
+        ])
+        self.client_profile = client
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be seq-scanned
+            with connection.cursor() as cursor:
+                cursor.execute("SET enable_seqscan = off")
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_scheduler_uses_partial_indexes(self):
+        # The claim itself, with its dispatch_at and active-campaign predicates
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        explain = "EXPLAIN QUERY PLAN " if connection.vendor == 'sqlite' else "EXPLAIN "
+        for status, index in (('scheduled', 'post_due_ai_idx'), ('approved', 'post_due_publish_idx')):
+            sql, params = tasks.claim_sql(status, 'claimed', 500, tasks.DUE, [now, now])
+            with connection.cursor() as cursor:
+                cursor.execute(explain + sql, params)
+                plan = '\n'.join(' '.join(map(str, row)) for row in cursor.fetchall())
+            self.assertIn(index, plan)
+
+    def test_client_timeline_uses_composite_index(self):
+        timeline = Post.objects.filter(client=self.client_profile).order_by('scheduled_time')
+        self.assertUsesIndex(timeline, 'post_client_sched_idx')
+
+
+class TwoPhasePublishTests(TestCase):
+    def setUp(self):
+        self.fake = FakeGraphAPI().start()
+        self.addCleanup(self.fake.stop)
+        override = override_settings(GRAPH_API_URL=self.fake.url)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.post = Post.objects.create(
+            client=make_client(), news_update='Launch', scheduled_time=timezone.now(),
+            status='publishing', generated_caption='Hello!', image='blobs/ab/abc.jpg',
+        )
+        self.enterContext(mock.patch.object(images, 'ensure_variant', return_value='derivatives/instagram/ab/abc.jpg'))
+
+    def test_upload_creates_container_and_defers_publish(self):
+        with mock.patch.object(tasks.publish_container, 'apply_async') as defer:
+            tasks.upload_to_facebook(self.post.id)
+        self.post.refresh_from_db()
+        self.assertTrue(self.post.ig_container_id)
+        defer.assert_called_once_with((self.post.id, self.post.ig_container_id), countdown=tasks.publish_poll_countdown(0))
+        self.assertEqual(self.fake.published, [])
+
+    def test_finished_container_is_published(self):
+        with mock.patch.object(tasks.publish_container, 'apply_async'):
+            tasks.upload_to_facebook(self.post.id)
+        self.post.refresh_from_db()
+        tasks.publish_container.apply(args=(self.post.id, self.post.ig_container_id))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.status, 'posted')
+        self.assertEqual(len(self.fake.published), 1)
+
+    def test_failed_media_publish_rechecks_the_container_instead_of_retrying(self):
+        with mock.patch.object(tasks.publish_container, 'apply_async'):
+            tasks.upload_to_facebook(self.post.id)
+        self.post.refresh_from_db()
+        self.fake.fail_next(status=502)
+        with mock.patch.object(graph, 'get_container_status', return_value='FINISHED'), \
+                mock.patch.object(tasks.publish_container, 'retry', side_effect=Retry) as retry:
+            tasks.publish_container.apply(args=(self.post.id, self.post.ig_container_id))
+        retry.assert_called_once_with(countdown=tasks.publish_poll_countdown(1))
+        self.assertEqual([path for _, path in self.fake.calls].count('/17841400000000000/media_publish'), 1)
+
+        # Meta did publish it after all: the re-check sees that and doesn't publish twice
+        self.fake.containers[self.post.ig_container_id]['status'] = 'PUBLISHED'
+        tasks.publish_container.apply(args=(self.post.id, self.post.ig_container_id))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.status, 'posted')
+        self.assertEqual(self.fake.published, [])
+
+    def test_processing_container_is_rechecked_later_not_slept_on(self):
+        self.fake.processing_seconds = 60
+        with mock.patch.object(tasks.publish_container, 'apply_async'):
+            tasks.upload_to_facebook(self.post.id)
+        self.post.refresh_from_db()
+        with mock.patch.object(tasks.publish_container, 'retry', side_effect=Retry) as retry:
+            tasks.publish_container.apply(args=(self.post.id, self.post.ig_container_id))
+        retry.assert_called_once_with(countdown=tasks.publish_poll_countdown(1))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.status, 'publishing')
+
+    def test_missing_image_marks_post_as_error(self):
+        self.post.image = ''
+        self.post.save()
+        tasks.upload_to_facebook(self.post.id)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.status, 'error')
+
+
+class GraphAPIClientTests(TestCase):
+    def setUp(self):
+        self.fake = FakeGraphAPI().start()
+        self.addCleanup(self.fake.stop)
+        self.sleeps = []
+        self.client_api = graph.GraphAPIClient(self.fake.url, max_retries=2, rate_per_token=1000, sleep=self.sleeps.append)
+
+    def test_connections_are_kept_alive(self):
+        for _ in range(5):
+            self.client_api.post('123/media', 'token', image_url='https://example.com/a.jpg')
+        self.assertEqual(self.fake.connections, 1)
+
+    def test_transient_errors_are_retried_with_backoff(self):
+        self.fake.fail_next(2, status=503)
+        data = self.client_api.post('123/media', 'token', image_url='https://example.com/a.jpg')
+        self.assertIn('id', data)
+        self.assertEqual(len(self.sleeps), 2)
+
+    def test_gives_up_after_max_retries(self):
+        self.fake.fail_next(3, status=500)
+        with self.assertRaises(graph.GraphAPIError):
+            self.client_api.post('123/media', 'token', image_url='https://example.com/a.jpg')
+
+    def test_non_idempotent_calls_are_not_retried_on_server_errors(self):
+        self.fake.fail_next(status=503)
+        with self.assertRaises(graph.GraphAPIUncertain):
+            self.client_api.post('123/media_publish', 'token', idempotent=False, creation_id='1')
+        self.assertEqual((len(self.fake.calls), self.sleeps), (1, []))
+
+    def test_client_errors_are_not_retried(self):
+        with self.assertRaises(graph.GraphAPIError) as ctx:
+            self.client_api.post('123/media', 'token')  # no image_url
+        self.assertEqual(ctx.exception.status, 400)
+        self.assertEqual(self.sleeps, [])
+
+    def test_retry_after_is_respected(self):
+        self.fake.fail_next(status=429, headers={'Retry-After': '7'})
+        self.client_api.post('123/media', 'token', image_url='https://example.com/a.jpg')
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertAlmostEqual(self.sleeps[0], 7.0, places=1)
+
+    def test_long_throttle_is_handed_back_to_the_caller(self):
+        usage = '{"1784": [{"type": "instagram", "call_count": 100, "estimated_time_to_regain_access": 10}]}'
+        self.fake.fail_next(status=400, body={'error': {'message': 'limit', 'code': 80002}},
+                            headers={'X-Business-Use-Case-Usage': usage})
+        with self.assertRaises(graph.GraphRateLimited) as ctx:
+            self.client_api.post('123/media', 'token', image_url='https://example.com/a.jpg')
+        self.assertEqual(ctx.exception.retry_after, 600)
+
+    def test_calls_are_rate_limited_per_access_token(self):
+        limited = graph.GraphAPIClient(self.fake.url, rate_per_token=2, burst_per_token=1, sleep=self.sleeps.append)
+        limited.post('123/media', 'token-a', image_url='https://example.com/a.jpg')
+        limited.post('123/media', 'token-b', image_url='https://example.com/a.jpg')
+        self.assertEqual(self.sleeps, [])
+        limited.post('123/media', 'token-a', image_url='https://example.com/a.jpg')
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertTrue(0.2 < self.sleeps[0] <= 0.5)
+
+
+@override_settings(CAMPAIGN_HORIZON_DAYS=0)
+class BatchCaptionTests(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(CAPTION_CACHE={'BACKEND': 'memory'}))
+        self.campaign = make_campaign(make_client(), end_date=date(2030, 1, 2))
+        tasks.materialize_campaign_posts(self.campaign)
+        self.ids = list(Post.objects.values_list('id', flat=True))
+
+    def generate(self, model):
+        with mock.patch.object(ai, 'get_model', return_value=model):
+            tasks.generate_ai_content_batch(self.ids)
+
+    def test_one_request_for_the_whole_group(self):
+        versions = dict(Post.objects.values_list('id', 'version'))
+        model = FakeGenerativeModel()
+        self.generate(model)
+        self.assertEqual(model.calls, 1)
+        captions = list(Post.objects.order_by('scheduled_time').values_list('generated_caption', flat=True))
+        self.assertEqual(len(set(captions)), 6)
+        self.assertTrue(captions[0].endswith('(1)'))
+        self.assertEqual(Post.objects.filter(status='waiting_approval').count(), 6)
+        # 'generating', then the caption: each a bump in SQL
+        self.assertEqual(dict(Post.objects.values_list('id', 'version')), {i: v + 2 for i, v in versions.items()})
+
+    def test_a_repeated_batch_leaves_posts_that_moved_on_alone(self):
+        self.generate(FakeGenerativeModel())
+        approved, posted = Post.objects.order_by('scheduled_time')[:2]
+        Post.objects.filter(id=approved.id).update(status='approved', dispatch_token=uuid.uuid4())
+        Post.objects.filter(id=posted.id).update(status='posted')
+        before = {p.id: (p.status, p.generated_caption, p.dispatch_token) for p in Post.objects.all()}
+
+        model = FakeGenerativeModel()
+        self.generate(model)  # e.g. redelivered
+        self.assertEqual(model.calls, 0)
+        self.assertEqual({p.id: (p.status, p.generated_caption, p.dispatch_token) for p in Post.objects.all()}, before)
+
+    def test_posts_taken_over_while_the_model_runs_are_not_written_back(self):
+        first = Post.objects.order_by('scheduled_time').first()
+
+        def generate(client, prompts, variant=''):
+            Post.objects.filter(id=first.id).update(status='approved')  # e.g. edited and approved by hand
+            return [f"Caption {i}" for i in range(len(prompts))]
+        with mock.patch.object(ai, 'generate_captions_batch', side_effect=generate):
+            tasks.generate_ai_content_batch(self.ids)
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.generated_caption, first.dispatch_token), ('approved', None, None))
+        self.assertEqual(Post.objects.filter(status='waiting_approval').count(), len(self.ids) - 1)
+
+    def test_unparseable_response_falls_back_to_single_calls(self):
+        model = FakeGenerativeModel(broken_json=True)
+        self.generate(model)
+        self.assertEqual(model.calls, 1 + 6)
+        self.assertFalse(Post.objects.filter(generated_caption__isnull=True).exists())
+
+    def test_parse_rejects_wrong_length(self):
+        with self.assertRaises(ValueError):
+            ai.parse_batch_captions('["one", "two"]', expected=3)
+
+
+class AsyncGenerationTests(TestCase):
+    def setUp(self):
+        self.enterContext(override_settings(CAPTION_CACHE={'BACKEND': 'memory'}))
+        client = make_client()
+        self.posts = Post.objects.bulk_create([
+            Post(client=client, news_update=f'News {i}', status='scheduled',
+                 requires_approval=bool(i % 2), scheduled_time='2030-01-01T09:00Z')
+            for i in range(20)
+        ])
+        self.ids = [p.id for p in self.posts]
+
+    async def test_posts_are_generated_concurrently(self):
+        model = FakeGenerativeModel(latency=0.05)
+        counts = await async_ai.generate_many(self.ids, model=model, concurrency=8, rpm=1000, tpm=10**7)
+        self.assertEqual(counts, {'waiting_approval': 10, 'approved': 10})
+        self.assertEqual(model.max_in_flight, 8)
+        self.assertFalse(await Post.objects.filter(generated_caption__isnull=True).aexists())
+
+    async def test_model_errors_mark_only_that_post(self):
+        model = FakeGenerativeModel()
+        original = model.generate_content_async
+
+        async def flaky(prompt, **kwargs):
+            if 'News 3\n' in prompt:
+                raise RuntimeError("quota")
+            return await original(prompt, **kwargs)
+
+        model.generate_content_async = flaky
+        counts = await async_ai.generate_many(self.ids, model=model, concurrency=4, rpm=1000, tpm=10**7)
+        self.assertEqual(counts.get('error'), 1)
+        self.assertEqual(await Post.objects.filter(status='error').acount(), 1)
+
+    async def test_posts_that_moved_on_are_not_overwritten(self):
+        posted, taken = self.ids[:2]
+        await Post.objects.filter(id=posted).aupdate(status='posted', generated_caption='Live')
+        model = FakeGenerativeModel()
+        original = model.generate_content_async
+
+        async def meanwhile(prompt, **kwargs):
+            if 'News 1\n' in prompt:
+                await Post.objects.filter(id=taken).aupdate(status='approved', generated_caption='By hand')
+            return await original(prompt, **kwargs)
+
+        model.generate_content_async = meanwhile
+        statuses = await async_ai.generate_all(self.ids, model=model, concurrency=4, rpm=1000, tpm=10**7)
+        self.assertNotIn(posted, statuses)
+        self.assertNotIn(taken, statuses)
+        self.assertEqual(len(statuses), 18)
+        rows = {p.id: (p.status, p.generated_caption) async for p in Post.objects.filter(id__in=[posted, taken])}
+        self.assertEqual(rows, {posted: ('posted', 'Live'), taken: ('approved', 'By hand')})
+
+    async def test_limiter_holds_requests_past_the_rpm_budget(self):
+        now = [0.0]
+        limiter = async_ai.AsyncRateLimiter(rpm=2, tpm=10**6, clock=lambda: now[0])
+        await limiter.acquire(10)
+        await limiter.acquire(10)
+        self.assertEqual(limiter._wait_time(now[0], 10), 60.0)
+        now[0] = 30.0
+        self.assertEqual(limiter._wait_time(now[0], 10), 30.0)
+
+    async def test_limiter_holds_requests_past_the_tpm_budget(self):
+        limiter = async_ai.AsyncRateLimiter(rpm=100, tpm=1000, clock=lambda: 5.0)
+        await limiter.acquire(600)
+        self.assertEqual(limiter._wait_time(5.0, 300), 0.0)
+        self.assertEqual(limiter._wait_time(5.0, 500), 60.0)
+
+
+class CaptionCacheTests(TestCase):
+    def setUp(self):
+        self.model = FakeGenerativeModel()
+        self.enterContext(mock.patch.object(ai, 'get_model', return_value=self.model))
+        self.client_profile = make_client()
+
+    def test_key_ignores_whitespace_but_not_model_or_variant(self):
+        key = caption_cache.caption_key('m', 'Hello   world\n')
+        self.assertEqual(key, caption_cache.caption_key('m', ' Hello world'))
+        self.assertNotEqual(key, caption_cache.caption_key('other', 'Hello world'))
+        self.assertNotEqual(key, caption_cache.caption_key('m', 'Hello world', variant='post:1'))
+
+    @override_settings(CAPTION_CACHE={'BACKEND': 'memory'})
+    def test_duplicate_prompts_hit_the_cache(self):
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+        ai.generate_caption(self.client_profile, 'Big news')
+        ai.generate_caption(self.client_profile, 'Big news')
+        self.assertEqual(self.model.calls, 1)
+        self.assertEqual(caption_cache.get_caption_cache().stats(), {'hits': 1, 'misses': 1})
+        # ...and for /metrics, which adds up every process
+        with override_settings(METRICS_DIR=None):
+            counters, _ = metrics.collect()
+        for result in ('hit', 'miss'):
+            self.assertEqual(counters[('postx_caption_cache_lookups_total', (('backend', 'memory'), ('result', result)))], 1)
+
+    @override_settings(CAPTION_CACHE={'BACKEND': 'memory'})
+    def test_bypass_regenerates_and_refreshes(self):
+        ai.rewrite_caption(self.client_profile)
+        ai.rewrite_caption(self.client_profile)
+        self.assertEqual(self.model.calls, 2)
+        ai.rewrite_caption(self.client_profile, bypass_cache=False)
+        self.assertEqual(self.model.calls, 2)
+
+    def test_memory_backend_evicts_least_recently_used_and_expired(self):
+        cache = caption_cache.MemoryCaptionCache(ttl=60, max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        with mock.patch('core.caption_cache.time.time', return_value=time.time() + 61):
+            self.assertIsNone(cache.get('a'))
+
+    def test_file_backend_persists_between_instances(self):
+        path = os.path.join(tempfile.mkdtemp(), 'captions.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        caption_cache.FileCaptionCache(path=path).set('k', 'caption')
+        self.assertEqual(caption_cache.FileCaptionCache(path=path).get('k'), 'caption')
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                       CAPTION_CACHE={'BACKEND': 'django', 'TTL': 60})
+    def test_django_backend(self):
+        cache = caption_cache.get_caption_cache()
+        self.assertIsInstance(cache, caption_cache.DjangoCaptionCache)
+        cache.set('k', 'caption')
+        self.assertEqual(cache.get('k'), 'caption')
+
+
+@override_settings(CAMPAIGN_HORIZON_DAYS=0)
+class CampaignUploadTests(TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.enterContext(override_settings(
+            MEDIA_ROOT=os.path.join(root, 'media'), UPLOAD_STAGING_ROOT=os.path.join(root, 'staging'),
+            CAMPAIGN_UPLOAD_CHUNK_SIZE=1024,
+        ))
+        self.ingest = self.enterContext(mock.patch.object(tasks.ingest_campaign_upload, 'delay'))
+        self.enterContext(mock.patch.object(tasks.generate_image_variants, 'delay'))
+        self.client_profile = make_client()
+        self.client.force_login(self.client_profile.user)
+        self.campaign = make_campaign(self.client_profile)
+
+    def png(self, color='red', size=(64, 64)):
+        out = io.BytesIO()
+        Image.new('RGB', size, color).save(out, 'PNG', compress_level=0)
+        return out.getvalue()
+
+    def open_upload(self, data, filename='photo.png'):
+        response = self.client.post(
+            reverse('campaign_uploads', args=[self.campaign.id]),
+            {'filename': filename, 'size': len(data)}, content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()['url']
+
+    def put(self, url, data, start):
+        chunk = data[start:start + 1024]
+        return self.client.put(url, chunk, content_type='application/octet-stream',
+                               headers={'Content-Range': f'bytes {start}-{start + len(chunk) - 1}/{len(data)}'})
+
+    def upload(self, data):
+        url = self.open_upload(data)
+        for start in range(0, len(data), 1024):
+            self.assertEqual(self.put(url, data, start).status_code, 200)
+        return CampaignUpload.objects.get(id=url.rstrip('/').rsplit('/', 1)[1])
+
+    def test_chunks_resume_from_server_offset(self):
+        data = self.png()
+        url = self.open_upload(data)
+        self.assertEqual(self.put(url, data, 0).json()['offset'], 1024)
+
+        # A retried or skipped-ahead chunk is refused with the offset to resume from
+        for start in (0, 2048):
+            response = self.put(url, data, start)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response.json()['offset'], 1024)
+
+        for start in range(1024, len(data), 1024):
+            self.put(url, data, start)
+        upload = CampaignUpload.objects.get()
+        self.assertEqual((upload.status, upload.received), ('processing', len(data)))
+        self.ingest.assert_called_once_with(str(upload.id))
+        with open(uploads.staging_path(upload), 'rb') as fh:
+            self.assertEqual(fh.read(), data)
+
+    def test_ingest_dedups_into_pool_and_backfills_posts(self):
+        tasks.materialize_campaign_posts(self.campaign)
+        first = self.upload(self.png())
+        again = self.upload(self.png())
+
+        self.assertEqual(tasks.ingest_campaign_upload(str(first.id)), 'ready')
+        self.assertEqual(tasks.ingest_campaign_upload(str(again.id)), 'duplicate')
+        image = CampaignImage.objects.get()
+        self.assertTrue(image.image.name.startswith('blobs/'))
+        self.assertFalse(Post.objects.filter(campaign=self.campaign, image='').exists())
+        self.assertEqual(MediaBlob.objects.get().ref_count, 31)  # pool image + 30 posts
+        self.assertFalse(os.path.exists(uploads.staging_path(first)))
+
+    def test_invalid_images_are_rejected(self):
+        truncated = self.upload(self.png()[:-200])
+        self.assertEqual(tasks.ingest_campaign_upload(str(truncated.id)), 'rejected')
+        with override_settings(CAMPAIGN_IMAGE_MAX_PIXELS=100):
+            huge = self.upload(self.png(size=(20, 20)))
+            self.assertEqual(tasks.ingest_campaign_upload(str(huge.id)), 'rejected')
+        self.assertIn('too large', CampaignUpload.objects.get(id=huge.id).error)
+        self.assertFalse(CampaignImage.objects.exists())
+
+    def test_create_campaign_returns_before_ingesting(self):
+        form = {
+            'name': 'Spring', 'type': 'bio', 'posts_per_day': 1, 'start_date': '2030-01-01',
+            'end_date': '2030-01-02', 'daily_start_time': '09:00', 'interval_hours': 2,
+            'campaign_images': [ContentFile(self.png(), name='a.png'), ContentFile(self.png('blue'), name='b.png')],
+        }
+        with mock.patch.object(views.initialize_campaign_posts, 'delay'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('create_campaign'), form)
+        self.assertEqual(response.status_code, 302)
+        staged = CampaignUpload.objects.filter(campaign__name='Spring')
+        self.assertEqual(list(staged.values_list('status', flat=True)), ['processing', 'processing'])
+        self.assertEqual(self.ingest.call_count, 2)
+        self.assertFalse(CampaignImage.objects.exists())
+
+    def test_uploads_belong_to_the_campaign_owner(self):
+        self.client.force_login(make_client('other').user)
+        response = self.client.post(
+            reverse('campaign_uploads', args=[self.campaign.id]), {'filename': 'x.png', 'size': 10},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+class RegenerateCaptionTests(TestCase):
+    def setUp(self):
+        self.client_profile = make_client()
+        self.client.force_login(self.client_profile.user)
+        self.post = Post.objects.create(
+            client=self.client_profile, news_update='Launch', scheduled_time=timezone.now(),
+            status='waiting_approval', generated_caption='Old caption',
+        )
+
+    def test_request_only_queues_the_rewrite(self):
+        with mock.patch.object(views.regenerate_ai_caption, 'delay') as delay:
+            response = self.client.get(reverse('regenerate_caption', args=[self.post.id]), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 202)
+        delay.assert_called_once_with(self.post.id, 'waiting_approval')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.status, 'regenerating')
+
+    def test_double_click_queues_once(self):
+        with mock.patch.object(views.regenerate_ai_caption, 'delay') as delay:
+            self.client.get(reverse('regenerate_caption', args=[self.post.id]))
+            response = self.client.get(reverse('regenerate_caption', args=[self.post.id]))
+        self.assertEqual(delay.call_count, 1)
+        self.assertEqual(response.status_code, 409)
+
+    def test_posts_past_review_are_left_alone(self):
+        for status in ('scheduled', 'generating', 'publishing', 'posted'):
+            Post.objects.filter(id=self.post.id).update(status=status)
+            with mock.patch.object(views.regenerate_ai_caption, 'delay') as delay:
+                response = self.client.get(reverse('regenerate_caption', args=[self.post.id]), HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 409)
+            delay.assert_not_called()
+            self.assertEqual(Post.objects.get(id=self.post.id).status, status)
+
+    @override_settings(CAPTION_CACHE={'BACKEND': 'memory'})
+    def test_task_restores_previous_status_with_new_caption(self):
+        Post.objects.filter(id=self.post.id).update(status='regenerating')
+        with mock.patch.object(ai, 'get_model', return_value=FakeGenerativeModel()):
+            tasks.regenerate_ai_caption(self.post.id, 'waiting_approval')
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.status, 'waiting_approval')
+        self.assertEqual(self.post.generated_caption, FakeGenerativeModel.CAPTION)
+
+    def test_status_endpoint_only_shows_own_posts(self):
+        other = Post.objects.create(client=make_client('rival'), news_update='x', scheduled_time=timezone.now())
+        response = self.client.get(reverse('post_status'), {'ids': f'{self.post.id},{other.id}'})
+        self.assertEqual([p['id'] for p in response.json()['posts']], [self.post.id])
+        self.assertEqual(response.json()['posts'][0]['status'], 'waiting_approval')
+
+
+class BulkActionTests(TestCase):
+    def setUp(self):
+        self.client_profile = make_client()
+        self.other = make_client('rival')
+        self.campaign = make_campaign(self.client_profile)
+        self.timers = self.enterContext(mock.patch.object(tasks.dispatch_post, 'apply_async'))
+        soon = timezone.now() + timedelta(minutes=10)
+        self.mine = Post.objects.bulk_create([
+            Post(client=self.client_profile, campaign=self.campaign, news_update='x', status='waiting_approval',
+                 generated_caption='Hi', image='blobs/ab/abc.jpg', scheduled_time=soon + timedelta(minutes=i))
+            for i in range(3)
+        ])
+        self.theirs = Post.objects.create(client=self.other, news_update='x', status='waiting_approval',
+                                          generated_caption='Hi', scheduled_time=soon)
+        self.client.force_login(self.client_profile.user)
+
+    def bulk(self, **payload):
+        return self.client.post(reverse('bulk_posts'), json.dumps(payload), content_type='application/json')
+
+    def statuses(self):
+        return dict(Post.objects.values_list('id', 'status'))
+
+    def test_approve_whole_campaign_with_fixed_queries(self):
+        # session, user, then: savepoint, UPDATE, arm (a select per stage + bulk update), release
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(8):
+            response = self.bulk(action='approve', campaign=self.campaign.id)
+        self.assertEqual(response.json(), {'action': 'approve', 'updated': 3})
+        self.assertEqual(self.timers.call_count, 3)
+        self.assertEqual(self.statuses()[self.theirs.id], 'waiting_approval')
+
+    def test_approve_keeps_quota_deferrals(self):
+        now = timezone.now()
+        deferred = Post.objects.create(client=self.client_profile, news_update='x', status='approved',
+                                       generated_caption='Hi', scheduled_time=now - timedelta(minutes=5),
+                                       dispatch_at=now + timedelta(hours=1), dispatch_token=uuid.uuid4())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.bulk(action='approve', ids=[deferred.id, self.mine[0].id])
+        self.assertEqual(response.json()['updated'], 1)
+        held = Post.objects.get(id=deferred.id)
+        self.assertEqual((held.dispatch_at, held.dispatch_token), (deferred.dispatch_at, deferred.dispatch_token))
+        self.timers.assert_called_once()
+        self.assertEqual(self.timers.call_args.args[0][0], self.mine[0].id)
+
+    def test_other_tenants_posts_are_filtered_in_the_query(self):
+        response = self.bulk(action='reject', ids=[self.mine[0].id, self.theirs.id])
+        self.assertEqual(response.json()['updated'], 1)
+        statuses = self.statuses()
+        self.assertEqual(statuses[self.mine[0].id], 'draft')
+        self.assertEqual(statuses[self.theirs.id], 'waiting_approval')
+
+    def test_reschedule_shifts_and_rearms(self):
+        Post.objects.filter(campaign=self.campaign).update(status='approved')
+        before = {p.id: p.scheduled_time for p in self.mine}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.bulk(action='reschedule', campaign=self.campaign.id, shift_minutes=5)
+        self.assertEqual(response.json()['updated'], 3)
+        for post in Post.objects.filter(campaign=self.campaign):
+            self.assertEqual(post.scheduled_time, before[post.id] + timedelta(minutes=5))
+            self.assertEqual(post.dispatch_at, post.scheduled_time)
+
+    def test_delete_releases_image_references_per_blob(self):
+        Post.objects.filter(id=self.mine[0].id).update(status='publishing')
+        with mock.patch.object(bulk, 'release_blob') as release:
+            response = self.bulk(action='delete', ids=[p.id for p in self.mine] + [self.theirs.id])
+        self.assertEqual(response.json()['updated'], 2)
+        release.assert_called_once_with('blobs/ab/abc.jpg', 2)
+        self.assertEqual(set(self.statuses()), {self.mine[0].id, self.theirs.id})
+
+    def test_delete_keeps_the_quota_charge_of_a_published_post(self):
+        post = self.mine[0]
+        Post.objects.filter(id=post.id).update(status='posted')
+        PublishQuotaUse.objects.create(business_id='17841400000000000', used_at=timezone.now(), post=post)
+        response = self.bulk(action='delete', ids=[post.id])
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertFalse(Post.objects.filter(id=post.id).exists())
+        self.assertEqual(list(PublishQuotaUse.objects.values_list('post', flat=True)), [None])
+
+    def test_bad_requests(self):
+        self.assertEqual(self.bulk(action='publish', ids=[1]).status_code, 400)
+        self.assertEqual(self.bulk(action='approve').status_code, 400)
+        self.assertEqual(self.bulk(action='approve', ids='12').status_code, 400)
+        self.assertEqual(self.bulk(action='reschedule', ids=[1]).status_code, 400)
+
+
+class DashboardTimelineTests(TestCase):
+    POSTS = 50_000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_profile = make_client()
+        campaign = make_campaign(cls.client_profile)
+        start = timezone.now() - timedelta(days=365)
+        Post.objects.bulk_create([
+            Post(client=cls.client_profile, campaign=campaign if i % 2 else None, news_update=f'Post {i}',
+                 status='waiting_approval', generated_caption='Caption', image='blobs/ab/abc.jpg',
+                 scheduled_time=start + timedelta(minutes=20 * i))
+            for i in range(cls.POSTS)
+        ], batch_size=1000)
+
+    def setUp(self):
+        self.client.force_login(self.client_profile.user)
+        self.enterContext(mock.patch.object(tasks.generate_image_variants, 'delay'))
+
+    def test_dashboard_renders_one_window_with_fixed_queries(self):
+        # session, user, client profile, campaigns, queued posts (quota projection), posts
+        with self.assertNumQueries(6):
+            started = time.perf_counter()
+            response = self.client.get(reverse('dashboard'))
+            elapsed = time.perf_counter() - started
+        self.assertEqual(response.status_code, 200)
+        days = response.context['days']
+        self.assertEqual(len(days), 7)
+        self.assertEqual(sum(len(d['posts']) for d in days), 7 * 72)
+        self.assertLess(elapsed, 2.0)
+
+    def test_timeline_api_pages_with_a_cursor(self):
+        url = reverse('timeline_api')
+        params = {'start': timezone.localdate().isoformat(), 'days': 2, 'limit': 100}
+        seen = []
+        with self.assertNumQueries(4):  # session, user, posts, day counts
+            page = self.client.get(url, params).json()
+        while True:
+            seen += [p['id'] for p in page['posts']]
+            if not page['next']:
+                break
+            page = self.client.get(url, {**params, 'cursor': page['next']}).json()
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), sum(d['count'] for d in page['days']))
+        self.assertEqual(len(seen), 144)
+
+    def test_bad_cursor_is_rejected(self):
+        response = self.client.get(reverse('timeline_api'), {'cursor': 'nope'})
+        self.assertEqual(response.status_code, 400)
+
+
+class DashboardFragmentCacheTests(TestCase):
+    def setUp(self):
+        caches['fragments'].clear()
+        self.addCleanup(caches['fragments'].clear)
+        self.enterContext(mock.patch.object(tasks.dispatch_post, 'apply_async'))
+        client = make_client()
+        noon = timezone.make_aware(datetime.combine(timezone.localdate(), dtime(12, 0)))
+        self.posts = [
+            Post.objects.create(client=client, news_update=f'Post {i}', generated_caption=f'Caption {i}',
+                                status='waiting_approval', scheduled_time=noon + timedelta(hours=i))
+            for i in range(3)
+        ]
+        self.client.force_login(client.user)
+
+    def dashboard(self):
+        return self.client.get(reverse('dashboard')).content.decode()
+
+    def test_saves_bump_the_version(self):
+        post = self.posts[0]
+        post.generated_caption = 'Edited'
+        post.save()
+        post.status = 'approved'
+        post.save(update_fields=['status'])
+        post.refresh_from_db()
+        self.assertEqual(post.version, 2)
+        bulk.reject(Post.objects.filter(id=post.id))
+        self.assertEqual(Post.objects.get(id=post.id).version, 3)
+        # Its thumbnail only exists once the variants are rendered
+        Post.objects.filter(id=post.id).update(image='blobs/ab/abc.jpg')
+        with mock.patch.object(images, 'ensure_variant'):
+            tasks.generate_image_variants('blobs/ab/abc.jpg')
+        self.assertEqual(Post.objects.get(id=post.id).version, 4)
+
+    def test_only_changed_cards_are_rendered_again(self):
+        self.assertIn('Caption 0', self.dashboard())
+        # A write that doesn't bump the version is invisible: the card comes from the cache
+        Post.objects.filter(id=self.posts[0].id).update(generated_caption='Sneaky')
+        self.assertNotIn('Sneaky', self.dashboard())
+
+        self.posts[1].generated_caption = 'Fresh'
+        self.posts[1].save()
+        html = self.dashboard()
+        self.assertIn('Fresh', html)
+        self.assertNotIn('Sneaky', html)
+
+        bulk.approve(Post.objects.filter(id=self.posts[0].id))
+        self.assertIn('Sneaky', self.dashboard())
+
+        # A deleted post leaves its day
+        self.posts[2].delete()
+        self.assertNotIn('Caption 2', self.dashboard())
+
+    def test_renaming_a_campaign_or_client_moves_its_posts_on(self):
+        client = self.posts[0].client
+        campaign = make_campaign(client)
+        Post.objects.filter(id=self.posts[0].id).update(campaign=campaign)
+        versions = lambda: list(Post.objects.order_by('id').values_list('version', flat=True))
+        before = versions()
+
+        # Stopping it doesn't touch the cards
+        campaign.is_active = False
+        campaign.save()
+        self.assertEqual(versions(), before)
+
+        campaign.name = 'Renamed'
+        campaign.save()
+        self.assertEqual(versions(), [before[0] + 1] + before[1:])
+
+        client.company_name = 'Renamed Co'
+        client.save()
+        self.assertEqual(versions(), [before[0] + 2] + [v + 1 for v in before[1:]])
+        client.save()
+        self.assertEqual(versions(), [before[0] + 2] + [v + 1 for v in before[1:]])
+
+
+class LazyProviderTests(TestCase):
+    def test_web_and_beat_start_without_the_gemini_sdk(self):
+        # Raises CommandError if manage.py or beat imports it at startup
+        call_command('bench_startup', repeat=1, stdout=io.StringIO())
+
+    @override_settings(GEMINI_API_KEY='key')
+    def test_sdk_is_configured_once_on_first_use(self):
+        sdk = mock.MagicMock()
+        self.enterContext(mock.patch.dict(ai._models, clear=True))
+        self.enterContext(mock.patch.dict(sys.modules, {'google.generativeai': sdk}))
+        self.assertIs(ai.get_model(), ai.get_model())
+        sdk.configure.assert_called_once_with(api_key='key')
+        sdk.GenerativeModel.assert_called_once_with(settings.GEMINI_MODEL)
@@ -0,0 +1,108 @@
+"""
+Windowed access to the post timeline, shared by the dashboard and the
+timeline JSON API. Everything is bounded: a date window and/or a keyset
+cursor on (scheduled_time, id), one query for the posts (with client and
+campaign joined in) and one for the per-day counts, grouped by the database.
+"""
+import base64
+import hashlib
+from datetime import datetime, time, timedelta
+from itertools import groupby
+
+from django.db.models import Count, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import Post
+
+DEFAULT_WINDOW_DAYS = 7
+MAX_WINDOW_DAYS = 31
+
+# Columns the timeline cards actually render
+CARD_FIELDS = (
+    'id', 'status', 'version', 'scheduled_time', 'news_update', 'generated_caption', 'image',
+    'client__id', 'client__company_name', 'campaign__id', 'campaign__name',
+)
+
+
+def visible_posts(user):
+    """All posts this user may see (superusers see every client's)."""
+    if user.is_superuser:
+        return Post.objects.all()
+    return Post.objects.filter(client__user=user)
+
+
+def parse_window(params):
+    """(start_date, days) from ?start=YYYY-MM-DD&days=N, clamped to sane values."""
+    start = parse_date(params.get('start') or '') or timezone.localdate()
+    try:
+        days = int(params.get('days') or DEFAULT_WINDOW_DAYS)
+    except ValueError:
+        days = DEFAULT_WINDOW_DAYS
+    return start, max(1, min(days, MAX_WINDOW_DAYS))
+
+
+def window_bounds(start, days):
+    """Aware [from, to) datetimes covering `days` local calendar days from `start`."""
+    begin = timezone.make_aware(datetime.combine(start, time.min))
+    end = timezone.make_aware(datetime.combine(start + timedelta(days=days), time.min))
+    return begin, end
+
+
+def timeline(posts, begin=None, end=None):
+    """Card-ready posts (annotated with their local `day`) in timeline order."""
+    if begin is not None:
+        posts = posts.filter(scheduled_time__gte=begin)
+    if end is not None:
+        posts = posts.filter(scheduled_time__lt=end)
+    return (
+        posts.select_related('client', 'campaign')
+        .only(*CARD_FIELDS)
+        .annotate(day=TruncDate('scheduled_time', tzinfo=timezone.get_current_timezone()))
+        .order_by('scheduled_time', 'id')
+    )
+
+
+def day_counts(posts, begin, end):
+    """[{'day': date, 'count': n}, ...] for the window, counted by the database."""
+    return list(
+        posts.filter(scheduled_time__gte=begin, scheduled_time__lt=end)
+        .annotate(day=TruncDate('scheduled_time', tzinfo=timezone.get_current_timezone()))
+        .values('day').annotate(count=Count('id')).order_by('day')
+    )
+
+
+def group_by_day(posts, projected=None):
+    """
+    [{'date': day, 'posts': [...], 'key': digest}, ...] using the database-computed
+    `day`. `key` changes whenever a post of that day is added, removed or bumps
+    its version, so the dashboard can cache the whole day under it.
+    `projected` ({post id: time}, from quota.projected_delays) becomes each
+    post's `projected_at` and is part of the key too.
+    """
+    projected = projected or {}
+    days = []
+    for day, items in groupby(posts, key=lambda p: p.day):
+        items = list(items)
+        for p in items:
+            p.projected_at = projected.get(p.id)
+        state = ','.join(f"{p.id}:{p.status}:{p.version}:{p.projected_at}" for p in items)
+        days.append({'date': day, 'posts': items, 'key': hashlib.md5(state.encode()).hexdigest()})
+    return days
+
+
+# --- keyset cursor on (scheduled_time, id) ---
+def encode_cursor(post):
+    raw = f"{post.scheduled_time.isoformat()}|{post.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def after_cursor(posts, cursor):
+    """Posts strictly after the cursor; raises ValueError on a malformed one."""
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    stamp, post_id = raw.rsplit('|', 1)
+    scheduled_time = parse_datetime(stamp)
+    if scheduled_time is None:
+        raise ValueError("bad cursor")
+    return posts.filter(Q(scheduled_time__gt=scheduled_time) | Q(scheduled_time=scheduled_time, id__gt=int(post_id)))
@@ -0,0 +1,189 @@
+"""
+Campaign image uploads: browsers stream each file in Content-Range chunks into
+a staging area, then a worker decodes, validates and deduplicates it into the
+blob store. Nothing heavy happens inside the request.
+"""
+import os
+import random
+import re
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from PIL import Image
+
+from .models import CampaignImage, CampaignUpload, Post
+from .storage import acquire_blob, blob_storage
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+READ_SIZE = 64 * 1024
+
+# Pillow format -> extension used for the stored blob (the client's filename is never trusted)
+EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+
+# Posts that can still get an image once the pool fills up
+BACKFILL_EXCLUDED_STATUSES = ('publishing', 'posted')
+
+
+class UploadError(Exception):
+    """The chunk doesn't fit the upload; `offset` is where the client should resume."""
+
+    def __init__(self, message, offset=None):
+        super().__init__(message)
+        self.offset = offset
+
+
+class RejectedUpload(Exception):
+    """The finished file isn't an image we can post."""
+
+
+def staging_path(upload):
+    return os.path.join(settings.UPLOAD_STAGING_ROOT, f"{upload.id}.part")
+
+
+def parse_content_range(header, size):
+    """'bytes 0-1023/4096' -> (0, 1023). Raises UploadError if it doesn't fit the upload."""
+    match = CONTENT_RANGE.match(header or '')
+    if not match:
+        raise UploadError("Content-Range must look like 'bytes start-end/total'")
+    start, end, total = (int(value) for value in match.groups())
+    if total != size or start > end or end >= size:
+        raise UploadError(f"Range {start}-{end}/{total} doesn't fit a {size} byte upload")
+    if end - start + 1 > settings.CAMPAIGN_UPLOAD_CHUNK_SIZE:
+        raise UploadError(f"Chunks are limited to {settings.CAMPAIGN_UPLOAD_CHUNK_SIZE} bytes")
+    return start, end
+
+
+def write_chunk(upload, start, end, stream):
+    """
+    Streams one chunk from `stream` into the staging file at `start`.
+    Chunks must arrive in order: anything else is refused with the offset to resume from.
+    Returns True once the whole file has been received.
+    """
+    if upload.status != 'uploading':
+        raise UploadError(f"Upload is already {upload.status}", upload.received)
+    if start != upload.received:
+        raise UploadError(f"Expected a chunk starting at {upload.received}", upload.received)
+
+    path = staging_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    expected = end - start + 1
+    written = 0
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as fh:
+        fh.seek(start)
+        while written < expected:
+            data = stream.read(min(READ_SIZE, expected - written))
+            if not data:
+                break
+            fh.write(data)
+            written += len(data)
+        fh.truncate()
+    if written != expected:
+        raise UploadError(f"Chunk was {written} bytes, Content-Range promised {expected}", upload.received)
+
+    # Guarded on the old offset, so two clients racing on one upload can't both win
+    done = end + 1 == upload.size
+    updated = CampaignUpload.objects.filter(id=upload.id, received=start, status='uploading').update(
+        received=end + 1, status='processing' if done else 'uploading',
+    )
+    if not updated:
+        upload.refresh_from_db()
+        raise UploadError("Upload moved on while this chunk was written", upload.received)
+    upload.received = end + 1
+    if done:
+        upload.status = 'processing'
+    return done
+
+
+def stage_file(campaign, uploaded_file):
+    """Plain multipart fallback: copy an already-received file into staging as one finished upload."""
+    upload = CampaignUpload.objects.create(
+        campaign=campaign, filename=uploaded_file.name[:255], size=uploaded_file.size,
+        received=uploaded_file.size, status='processing',
+    )
+    path = staging_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fh:
+        for chunk in uploaded_file.chunks():
+            fh.write(chunk)
+    return upload
+
+
+def validate_image(path):
+    """Decodes the whole file and checks format and size limits. Returns the Pillow format."""
+    if os.path.getsize(path) > settings.CAMPAIGN_IMAGE_MAX_BYTES:
+        raise RejectedUpload(f"File is larger than {settings.CAMPAIGN_IMAGE_MAX_BYTES // (1024 * 1024)} MB")
+    try:
+        with Image.open(path) as image:
+            fmt = image.format
+            if fmt not in settings.CAMPAIGN_IMAGE_FORMATS:
+                raise RejectedUpload(f"{fmt or 'Unknown'} images are not supported")
+            if image.width * image.height > settings.CAMPAIGN_IMAGE_MAX_PIXELS:
+                raise RejectedUpload(f"Image is too large ({image.width}x{image.height})")
+            image.verify()
+        # verify() only checks structure; load() decodes every pixel and catches truncated files
+        with Image.open(path) as image:
+            image.load()
+    except RejectedUpload:
+        raise
+    except Exception as e:
+        raise RejectedUpload(f"Not a valid image: {e}")
+    return fmt
+
+
+def ingest(upload):
+    """
+    Validates a finished upload and adds it to the campaign pool (deduplicated
+    through the blob store). Sets upload.status; the staging file is always removed.
+    """
+    path = staging_path(upload)
+    try:
+        fmt = validate_image(path)
+        with open(path, 'rb') as fh:
+            name = blob_storage.save(f"campaign_pool/{upload.id}{EXTENSIONS[fmt]}", fh)
+
+        with transaction.atomic():
+            image = CampaignImage.objects.filter(campaign=upload.campaign_id, image=name).first()
+            if image:
+                upload.status = 'duplicate'
+            else:
+                image = CampaignImage.objects.create(campaign_id=upload.campaign_id, image=name)
+                upload.status = 'ready'
+            upload.image = image
+            upload.error = ''
+            upload.save(update_fields=['status', 'image', 'error'])
+    except RejectedUpload as e:
+        upload.status = 'rejected'
+        upload.error = str(e)[:255]
+        upload.save(update_fields=['status', 'error'])
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return upload.status
+
+
+def backfill_campaign_images(campaign):
+    """
+    Campaign posts created before any pool image arrived have no image: share
+    the pool out between them. Returns the number of posts updated.
+    """
+    pool = list(CampaignImage.objects.filter(campaign=campaign).values_list('image', flat=True))
+    if not pool:
+        return 0
+    missing = Q(image='') | Q(image__isnull=True)
+    posts = Post.objects.filter(missing, campaign=campaign).exclude(status__in=BACKFILL_EXCLUDED_STATUSES)
+
+    by_image = defaultdict(list)
+    for post_id in posts.values_list('id', flat=True):
+        by_image[random.choice(pool)].append(post_id)
+
+    updated = 0
+    with transaction.atomic():
+        for name, ids in by_image.items():
+            for i in range(0, len(ids), 500):
+                # Still guarded on `missing`: a concurrent backfill may have got there first
+                count = Post.objects.filter(missing, id__in=ids[i:i + 500]).update(image=name, version=F('version') + 1)
+                acquire_blob(name, count)
+                updated += count
+    return updated
@@ -1,32 +1,115 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
-from .models import Post, Client, Campaign, CampaignImage
+from .models import Post, Client, Campaign, CampaignUpload
 from .forms import PostForm, CampaignForm
-import google.generativeai as genai
-from core.tasks import GEMINI_API_KEY, generate_ai_content, initialize_campaign_posts
+from django.http import HttpResponse, JsonResponse
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_http_methods
+import json
+from datetime import timedelta
+from .timeline import (
+    visible_posts, parse_window, window_bounds, timeline, day_counts, group_by_day, encode_cursor, after_cursor,
+)
+from core.tasks import (
+    generate_ai_content, initialize_campaign_posts, regenerate_ai_caption, ingest_campaign_upload, arm_dispatch,
+    release_future_posts,
+)
+from . import bulk, media, metrics, quota, uploads
 
 @login_required
 def dashboard(request):
     """
-    Shows Active Campaigns AND Recent Single Posts.
+    Shows Active Campaigns AND the Content Timeline, one date window at a time
+    (?start=YYYY-MM-DD&days=N, a week by default).
     """
     if request.user.is_superuser:
-        posts = Post.objects.all().order_by('scheduled_time') # Ascending order for timeline
         campaigns = Campaign.objects.all().order_by('-is_active')
         is_admin = True
     else:
         try:
             client_profile = request.user.client_profile
-            posts = Post.objects.filter(client=client_profile).order_by('scheduled_time')
             campaigns = Campaign.objects.filter(client=client_profile)
             is_admin = False
         except:
             return render(request, 'base.html', {'content': 'No Client Profile Found'})
 
+    # Image ingestion progress per campaign, counted in the same query
+    campaigns = campaigns.annotate(
+        images_ready=Count('uploads', filter=Q(uploads__status__in=['ready', 'duplicate'])),
+        images_pending=Count('uploads', filter=Q(uploads__status__in=['uploading', 'processing'])),
+        images_rejected=Count('uploads', filter=Q(uploads__status='rejected')),
+        # A subquery, so the posts join doesn't multiply the upload counts
+        awaiting_review=Subquery(
+            Post.objects.filter(campaign=OuterRef('pk'), status='waiting_approval').order_by()
+            .values('campaign').annotate(n=Count('id')).values('n')
+        ),
+    )
+
+    start, days = parse_window(request.GET)
+    begin, end = window_bounds(start, days)
+    posts = timeline(visible_posts(request.user), begin, end)
+    # Posts the accounts' 24h publishing quota will hold back past their time
+    delays = quota.projected_delays(visible_posts(request.user), end)
+
     return render(request, 'dashboard.html', {
-        'posts': posts, 
-        'campaigns': campaigns, 
-        'is_admin': is_admin
+        'days': group_by_day(posts, delays),
+        'campaigns': campaigns,
+        'is_admin': is_admin,
+        'fragment_timeout': settings.DASHBOARD_FRAGMENT_TIMEOUT,
+        'window_start': start,
+        'window_end': start + timedelta(days=days - 1),
+        'window_days': days,
+        'prev_start': start - timedelta(days=days),
+        'next_start': start + timedelta(days=days),
+    })
+
+@login_required
+def timeline_api(request):
+    """
+    JSON timeline: /api/timeline/?start=YYYY-MM-DD&days=N&limit=100&cursor=...
+    Pages with a keyset cursor on (scheduled_time, id); `next` is null on the last page.
+    """
+    start, days = parse_window(request.GET)
+    begin, end = window_bounds(start, days)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 100)), 500))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+
+    base = visible_posts(request.user)
+    posts = timeline(base, begin, end)
+    if request.GET.get('cursor'):
+        try:
+            posts = after_cursor(posts, request.GET['cursor'])
+        except (ValueError, UnicodeDecodeError):
+            return JsonResponse({'error': 'invalid cursor'}, status=400)
+
+    page = list(posts[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    labels = dict(Post.STATUS_CHOICES)
+
+    return JsonResponse({
+        'start': start.isoformat(),
+        'days': [{'day': d['day'].isoformat(), 'count': d['count']} for d in day_counts(base, begin, end)],
+        'posts': [{
+            'id': p.id,
+            'day': p.day.isoformat(),
+            'scheduled_time': p.scheduled_time.isoformat(),
+            'status': p.status,
+            'status_display': labels.get(p.status),
+            'news_update': p.news_update,
+            'caption': p.generated_caption,
+            'image_url': p.image.url if p.image else None,
+            'client': p.client.company_name,
+            'campaign': p.campaign.name if p.campaign else None,
+        } for p in page],
+        'next': encode_cursor(page[-1]) if has_more else None,
     })
 
 @login_required
@@ -76,19 +159,120 @@ def create_campaign(request):
             campaign.save()
             
             # --- HANDLE MULTIPLE IMAGES ---
-            images = request.FILES.getlist('campaign_images')
-            for img in images:
-                CampaignImage.objects.create(campaign=campaign, image=img)
+            # The page streams images in chunks after this returns (see campaign_uploads);
+            # files posted the old way are only staged here and checked by a worker
+            for img in request.FILES.getlist('campaign_images'):
+                upload = uploads.stage_file(campaign, img)
+                transaction.on_commit(lambda upload_id=upload.id: ingest_campaign_upload.delay(str(upload_id)))
             
             # 🔥 CALL THE NEW GENERATOR
-            # This generates the roadmap for the WHOLE campaign range immediately
+            # This generates the roadmap for the first CAMPAIGN_HORIZON_DAYS; beat extends it
             initialize_campaign_posts.delay(campaign.id)
             
+            if request.headers.get('Accept') == 'application/json':
+                return JsonResponse({
+                    'id': campaign.id,
+                    'uploads_url': reverse('campaign_uploads', args=[campaign.id]),
+                    'chunk_size': settings.CAMPAIGN_UPLOAD_CHUNK_SIZE,
+                }, status=201)
             return redirect('dashboard')
+        if request.headers.get('Accept') == 'application/json':
+            return JsonResponse({'errors': form.errors}, status=400)
     else:
         form = CampaignForm()
     return render(request, 'create_campaign.html', {'form': form})
 
+@login_required
+def edit_campaign(request, campaign_id):
+    """Change a campaign's settings; only its future, unstarted posts are rebuilt"""
+    campaign = get_object_or_404(Campaign, id=campaign_id)
+    if not request.user.is_superuser and campaign.client.user != request.user:
+        return redirect('dashboard')
+
+    if request.method == 'POST':
+        form = CampaignForm(request.POST, request.FILES, instance=campaign)
+        if form.is_valid():
+            with transaction.atomic():
+                campaign = form.save()
+                for img in request.FILES.getlist('campaign_images'):
+                    upload = uploads.stage_file(campaign, img)
+                    transaction.on_commit(lambda upload_id=upload.id: ingest_campaign_upload.delay(str(upload_id)))
+                release_future_posts(campaign)
+                transaction.on_commit(lambda: initialize_campaign_posts.delay(campaign.id))
+
+            if request.headers.get('Accept') == 'application/json':
+                return JsonResponse({
+                    'id': campaign.id,
+                    'uploads_url': reverse('campaign_uploads', args=[campaign.id]),
+                    'chunk_size': settings.CAMPAIGN_UPLOAD_CHUNK_SIZE,
+                })
+            return redirect('dashboard')
+        if request.headers.get('Accept') == 'application/json':
+            return JsonResponse({'errors': form.errors}, status=400)
+    else:
+        form = CampaignForm(instance=campaign)
+    return render(request, 'create_campaign.html', {'form': form, 'campaign': campaign})
+
+def upload_json(upload):
+    return {
+        'id': str(upload.id),
+        'filename': upload.filename,
+        'size': upload.size,
+        'offset': upload.received,
+        'status': upload.status,
+        'error': upload.error,
+        'url': reverse('upload_chunk', args=[upload.id]),
+    }
+
+@login_required
+@require_http_methods(['GET', 'POST'])
+def campaign_uploads(request, campaign_id):
+    """
+    GET: ingestion progress of every image of the campaign.
+    POST {"filename": ..., "size": ...}: opens a chunked upload; send the bytes to its `url`.
+    """
+    campaign = get_object_or_404(Campaign, id=campaign_id)
+    if not request.user.is_superuser and campaign.client.user != request.user:
+        return JsonResponse({'error': 'Not your campaign'}, status=403)
+
+    if request.method == 'GET':
+        return JsonResponse({'uploads': [upload_json(u) for u in campaign.uploads.order_by('created_at')]})
+
+    try:
+        data = json.loads(request.body)
+        filename, size = str(data['filename'])[:255], int(data['size'])
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected JSON with filename and size'}, status=400)
+    if not 0 < size <= settings.CAMPAIGN_IMAGE_MAX_BYTES:
+        return JsonResponse({'error': f'Images must be under {settings.CAMPAIGN_IMAGE_MAX_BYTES // (1024 * 1024)} MB'}, status=400)
+
+    upload = CampaignUpload.objects.create(campaign=campaign, filename=filename, size=size)
+    return JsonResponse(upload_json(upload), status=201)
+
+@login_required
+@require_http_methods(['GET', 'PUT'])
+def upload_chunk(request, upload_id):
+    """
+    PUT one chunk with `Content-Range: bytes start-end/total`; the body is streamed to disk.
+    GET tells an interrupted client where to resume. 409 means "resume from `offset`".
+    """
+    upload = get_object_or_404(CampaignUpload.objects.select_related('campaign__client'), id=upload_id)
+    if not request.user.is_superuser and upload.campaign.client.user_id != request.user.id:
+        return JsonResponse({'error': 'Not your upload'}, status=403)
+    if request.method == 'GET':
+        return JsonResponse(upload_json(upload))
+
+    try:
+        start, end = uploads.parse_content_range(request.headers.get('Content-Range'), upload.size)
+        done = uploads.write_chunk(upload, start, end, request)
+    except uploads.UploadError as e:
+        status = 400 if e.offset is None else 409
+        return JsonResponse({'error': str(e), 'offset': upload.received if e.offset is None else e.offset}, status=status)
+
+    if done:
+        ingest_campaign_upload.delay(str(upload.id))
+    return JsonResponse(upload_json(upload))
+
 @login_required
 def stop_campaign(request, campaign_id):
     """Stops the auto-scheduler for this campaign"""
@@ -96,8 +280,12 @@ def stop_campaign(request, campaign_id):
     if not request.user.is_superuser and campaign.client.user != request.user:
         return redirect('dashboard')
         
-    campaign.is_active = False
-    campaign.save()
+    with transaction.atomic():
+        campaign.is_active = False
+        campaign.save()
+        # Nothing is claimed for a paused campaign; drop what nobody has reviewed
+        # yet so resuming rebuilds it fresh, and keep what has been
+        release_future_posts(campaign, keep_reviewed=True)
     return redirect('dashboard')
 
 @login_required
@@ -107,8 +295,12 @@ def restart_campaign(request, campaign_id):
     if not request.user.is_superuser and campaign.client.user != request.user:
         return redirect('dashboard')
     
-    campaign.is_active = True
-    campaign.save()
+    with transaction.atomic():
+        campaign.is_active = True
+        campaign.save()
+        # Slots that passed while paused are skipped, not published all at once
+        release_future_posts(campaign, missed=True, keep_reviewed=True)
+        transaction.on_commit(lambda: initialize_campaign_posts.delay(campaign.id))
     return redirect('dashboard')
 
 @login_required
@@ -126,40 +318,113 @@ def approve_post(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     post.status = 'approved'
     post.save()
+    arm_dispatch(Post.objects.filter(id=post.id))
     return redirect('dashboard')
 
 @login_required
 def regenerate_caption(request, post_id):
+    """Queues a caption rewrite and returns straight away; the dashboard polls post_status."""
     post = get_object_or_404(Post, id=post_id)
-    
-    genai.configure(api_key=GEMINI_API_KEY)
-    # Switch to 1.5 if 2.5 fails for you
-    model = genai.GenerativeModel('gemini-2.5-flash')
-    
-    prompt = f"""You are a senior Social Media Manager for {post.client.company_name}
-        Write a high-engaging Instagram caption using the AIDA framework.
-        Include 3-5 emojis and end with 5 hashtags.
-        
-        KEEP THESE GUIDELINES IN MIND:
-        1. Strong Opening Hook: The first sentence is crucial. Ask a question, state a surprising fact, create urgency/FOMO, or use provocative language.
-        2. Clarity and Conciseness: Get straight to the point. Use simple language, maybe bullet points, and keep paragraphs short (1-2 sentences).
-        3. Provide Value: Educate, inspire, entertain, or solve a problem.
-        4. Call to Action (CTA): Tell the audience exactly what to do next (Comment, Share, Link in Bio, Tag a friend).
-        5. Tone and Personality: Be authentic, conversational, and use emojis to convey emotion. Avoid sounding like a corporate bot.
-        6. Searchability: Use strategic hashtags.
-
-        ⚠️ STRICT OUTPUT RULES (DO NOT IGNORE):
-        1. Return ONLY the final caption text.
-        2. Do NOT add introductions like "Here is a caption" or "Sure!".
-        3. Do NOT add quotes "" around the text.
-        4. Start the response immediately with the hook/headline.
-        """
-    
-    response = model.generate_content(prompt)
-    post.generated_caption = response.text.replace('Here is a caption:', '').strip('"')
-    post.save()
+    if not request.user.is_superuser and post.client.user != request.user:
+        return redirect('dashboard')
+
+    # Only posts with a caption to review, one rewrite at a time: the guarded UPDATE
+    # fails if the post is already regenerating, being published or gone past review
+    rewritable = Post.objects.filter(id=post.id, status=post.status,
+                                     status__in=['waiting_approval', 'approved', 'error'])
+    if not rewritable.update(status='regenerating', version=F('version') + 1):
+        message = f"Post is {post.status}, its caption can't be regenerated now"
+        if request.headers.get('Accept') == 'application/json':
+            return JsonResponse({'error': message}, status=409)
+        return HttpResponse(message, status=409, content_type='text/plain')
+    regenerate_ai_caption.delay(post.id, post.status)
+
+    if request.headers.get('Accept') == 'application/json':
+        return JsonResponse({'id': post.id, 'status': 'regenerating'}, status=202)
     return redirect('dashboard')
 
+@login_required
+def post_status(request):
+    """Lightweight poll for the dashboard: /posts/status/?ids=1,2,3"""
+    try:
+        ids = [int(i) for i in request.GET.get('ids', '').split(',') if i][:200]
+    except ValueError:
+        return JsonResponse({'error': 'ids must be comma separated integers'}, status=400)
+
+    posts = Post.objects.filter(id__in=ids)
+    if not request.user.is_superuser:
+        posts = posts.filter(client__user=request.user)
+    labels = dict(Post.STATUS_CHOICES)
+    return JsonResponse({'posts': [
+        {'id': p['id'], 'status': p['status'], 'status_display': labels.get(p['status']), 'caption': p['generated_caption']}
+        for p in posts.values('id', 'status', 'generated_caption')
+    ]})
+
+@login_required
+@require_http_methods(['POST'])
+def bulk_posts(request):
+    """
+    POST {"action": "approve" | "reject" | "delete" | "reschedule", "ids": [...] and/or "campaign": id}
+    Reschedule also takes "scheduled_time" (ISO 8601) or "shift_minutes".
+    Runs as one set-based statement over the posts this user may manage.
+    """
+    try:
+        data = json.loads(request.body)
+        action = data['action']
+        ids = data.get('ids')
+        campaign = data.get('campaign')
+        if ids is not None:
+            if not isinstance(ids, list):
+                raise TypeError
+            ids = [int(i) for i in ids]
+        if campaign is not None:
+            campaign = int(campaign)
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected JSON with action and ids or campaign'}, status=400)
+    if action not in ('approve', 'reject', 'delete', 'reschedule'):
+        return JsonResponse({'error': f'Unknown action {action!r}'}, status=400)
+    if ids is None and campaign is None:
+        return JsonResponse({'error': 'Pass ids, campaign or both'}, status=400)
+    if ids is not None and len(ids) > bulk.MAX_IDS:
+        return JsonResponse({'error': f'At most {bulk.MAX_IDS} ids per request'}, status=400)
+
+    posts = bulk.select_posts(request.user, ids=ids, campaign=campaign)
+    if action == 'reschedule':
+        if data.get('shift_minutes') is not None:
+            try:
+                kwargs = {'shift': timedelta(minutes=float(data['shift_minutes']))}
+            except (TypeError, ValueError):
+                return JsonResponse({'error': 'shift_minutes must be a number'}, status=400)
+        else:
+            when = parse_datetime(str(data.get('scheduled_time') or ''))
+            if when is None:
+                return JsonResponse({'error': 'Pass scheduled_time (ISO 8601) or shift_minutes'}, status=400)
+            kwargs = {'scheduled_time': when if timezone.is_aware(when) else timezone.make_aware(when)}
+        count = bulk.reschedule(posts, **kwargs)
+    else:
+        count = getattr(bulk, action)(posts)
+    return JsonResponse({'action': action, 'updated': count})
+
+def serve_media(request, name):
+    """/media/...: dashboard images for signed-in users (Meta gets signed links instead)."""
+    if not request.user.is_authenticated:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return media.serve(request, name)
+
+def signed_media(request, expires, sig, name):
+    """Time-limited public link from media.signed_url(); no session needed."""
+    if not media.check_signature(name, expires, sig):
+        return HttpResponse('Link expired or invalid', status=403, content_type='text/plain')
+    return media.serve(request, name, public=True)
+
+def metrics_view(request):
+    """Prometheus scrape endpoint (text format 0.0.4)."""
+    auth = request.headers.get('Authorization', '')
+    token_ok = bool(settings.METRICS_TOKEN) and auth == f"Bearer {settings.METRICS_TOKEN}"
+    if not token_ok and not request.user.is_superuser:
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @login_required
 def edit_post(request, post_id):
     post = get_object_or_404(Post, id=post_id)